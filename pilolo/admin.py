@@ -1,21 +1,242 @@
-from django.contrib import admin
-from .models import BookingParticipant, CustomUser, Payment, Tour, TourSchedule, Booking
+import datetime
+
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connection
+from django.template.response import TemplateResponse
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.html import format_html_join
+from django.utils.safestring import mark_safe
+from . import holds, scheduling, services
+from .models import BookingParticipant, CustomUser, OutboxEmail, Payment, PaymentEvent, ScheduleRule, SeatHold, Tour, TourSchedule, Booking
+
+
+class EstimatedCountPaginator(Paginator):
+    """Use the planner's row estimate for unfiltered changelists on big tables.
+
+    ``COUNT(*)`` scans the whole table on PostgreSQL and SQLite. When no
+    filter or search is applied and the statistics say the table has more
+    than ``threshold`` rows, the estimate is shown instead.
+    """
+    threshold = 10000
+
+    def _estimate(self):
+        table = self.object_list.model._meta.db_table
+        try:
+            with connection.cursor() as cursor:
+                if connection.vendor == 'postgresql':
+                    cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+                elif connection.vendor == 'sqlite':
+                    # Filled in by ANALYZE; the first number is the row count
+                    cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table])
+                else:
+                    return None
+                row = cursor.fetchone()
+        except DatabaseError:
+            return None
+        if not row or row[0] is None:
+            return None
+        return int(str(row[0]).split()[0])
+
+    @cached_property
+    def count(self):
+        if not self.object_list.query.where:
+            estimate = self._estimate()
+            if estimate is not None and estimate > self.threshold:
+                return estimate
+        return super().count
+
+
+class BigTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Skip the second, unfiltered COUNT(*) behind "N results (M total)"
+    show_full_result_count = False
+
+
+class IndexedSearchAdmin(BigTableAdmin):
+    """Search ``search_fields`` with exact matches that indexes can answer.
+
+    Django's own search turns ``=`` into ``iexact`` and ``^`` into
+    ``istartswith``, which wrap the column in UPPER() or LIKE and skip its
+    index. Here the whole term is matched exactly against each field, one
+    UNION branch per field, so every branch is an index lookup.
+    """
+    search_help_text = 'Exact match only.'
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        manager = queryset.model._default_manager
+        branches = [manager.filter(**{field: term}).order_by().values('pk') for field in self.search_fields]
+        matches = branches[0].union(*branches[1:]) if len(branches) > 1 else branches[0]
+        return queryset.filter(pk__in=matches), False
+
+
+class MoveBookingsForm(forms.Form):
+    schedule = forms.ModelChoiceField(queryset=TourSchedule.objects.none(), label='Move to schedule')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['schedule'].queryset = TourSchedule.objects.upcoming().select_related('tour')
+
+class TourAdminForm(forms.ModelForm):
+    class Meta:
+        model = Tour
+        fields = '__all__'
+        widgets = {
+            field: forms.Textarea(attrs={'rows': 6, 'placeholder': 'One item per line'})
+            for field in Tour.LIST_FIELDS
+        }
+        help_texts = {field: 'One item per line; blank lines are ignored.' for field in Tour.LIST_FIELDS}
+
 
 @admin.register(Tour)
 class TourAdmin(admin.ModelAdmin):
+    form = TourAdminForm
     list_display = ['name', 'price', 'duration', 'max_participants']
     search_fields = ['name', 'description']
+    readonly_fields = ['highlights_preview', 'what_included_preview', 'what_to_bring_preview']
+    fieldsets = [
+        (None, {'fields': ['name', 'description', 'duration', 'price', 'max_participants', 'meeting_point', 'image']}),
+        ('Lists', {'fields': [
+            ('highlights', 'highlights_preview'),
+            ('what_included', 'what_included_preview'),
+            ('what_to_bring', 'what_to_bring_preview'),
+        ]}),
+    ]
+
+    def _preview(self, items):
+        if not items:
+            return '-'
+        return format_html_join('', '<li>{}</li>', ((item,) for item in items)).join(
+            [mark_safe('<ul>'), mark_safe('</ul>')]
+        )
+
+    @admin.display(description='Saved highlights')
+    def highlights_preview(self, obj):
+        return self._preview(obj.highlights_list)
+
+    @admin.display(description='Saved inclusions')
+    def what_included_preview(self, obj):
+        return self._preview(obj.what_included_list)
+
+    @admin.display(description='Saved items to bring')
+    def what_to_bring_preview(self, obj):
+        return self._preview(obj.what_to_bring_list)
 
 @admin.register(TourSchedule)
 class TourScheduleAdmin(admin.ModelAdmin):
-    list_display = ['tour', 'day', 'start_time', 'end_time']
+    list_display = ['tour', 'day', 'date', 'start_time', 'end_time', 'seats_booked', 'seats_remaining']
     list_filter = ['day', 'tour']
+    search_fields = ['^tour__name']
+    date_hierarchy = 'date'
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_availability()
+
+    @admin.display(ordering='seats_booked', description='Booked')
+    def seats_booked(self, obj):
+        return obj.seats_booked
+
+    @admin.display(ordering='seats_remaining', description='Remaining')
+    def seats_remaining(self, obj):
+        return obj.seats_remaining
+
+class ScheduleRuleAdminForm(forms.ModelForm):
+    days = forms.MultipleChoiceField(choices=TourSchedule.DAYS_OF_WEEK, widget=forms.CheckboxSelectMultiple)
+    blackout_dates = forms.CharField(
+        required=False,
+        widget=forms.Textarea(attrs={'rows': 4, 'placeholder': 'YYYY-MM-DD, one per line'}),
+        help_text='Dates with no departures, one per line.',
+    )
+
+    class Meta:
+        model = ScheduleRule
+        fields = '__all__'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.initial['blackout_dates'] = '\n'.join(self.instance.blackout_dates or [])
+
+    def clean_blackout_dates(self):
+        dates = []
+        for line in self.cleaned_data['blackout_dates'].splitlines():
+            if line.strip():
+                try:
+                    dates.append(datetime.date.fromisoformat(line.strip()).isoformat())
+                except ValueError:
+                    raise forms.ValidationError(f"{line.strip()!r} is not a YYYY-MM-DD date.")
+        return sorted(set(dates))
+
+
+@admin.register(ScheduleRule)
+class ScheduleRuleAdmin(admin.ModelAdmin):
+    form = ScheduleRuleAdminForm
+    list_display = ['tour', 'days', 'start_time', 'end_time', 'season_start', 'season_end', 'active']
+    list_filter = ['active', 'tour']
+    list_select_related = ['tour']
+    actions = ['generate_year']
+
+    @admin.action(description='Generate schedules for the next year')
+    def generate_year(self, request, queryset):
+        created = scheduling.generate_schedules(queryset)
+        self.message_user(request, f"Created {len(created)} schedule(s).")
+
 
 @admin.register(Booking)
-class BookingAdmin(admin.ModelAdmin):
-    list_display = ['user', 'schedule', 'tour_date', 'status']
+class BookingAdmin(IndexedSearchAdmin):
+    list_display = ['reference', 'user', 'schedule', 'tour_date', 'status', 'participants']
     list_filter = ['status', 'tour_date']
-    search_fields = ['user__username', 'schedule__tour__name']
+    search_fields = ['reference', 'user__email']
+    search_help_text = 'Exact booking reference or email address.'
+    raw_id_fields = ['user', 'schedule']
+    actions = ['confirm_selected', 'cancel_selected', 'move_selected']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).for_listing().select_related('user')
+
+    @admin.display(ordering='participant_total', description='Participants')
+    def participants(self, obj):
+        return obj.participant_total
+
+    def _run(self, request, update, queryset, done):
+        try:
+            updated = update(queryset)
+        except holds.SeatsUnavailable as e:
+            self.message_user(request, f"Nothing was changed: {e}", messages.ERROR)
+        else:
+            self.message_user(request, f"{updated} booking(s) {done}.")
+
+    @admin.action(description='Confirm selected bookings')
+    def confirm_selected(self, request, queryset):
+        self._run(request, services.confirm_bookings, queryset, 'confirmed')
+
+    @admin.action(description='Cancel selected bookings')
+    def cancel_selected(self, request, queryset):
+        self._run(request, services.cancel_bookings, queryset, 'cancelled')
+
+    @admin.action(description='Move selected bookings to another schedule')
+    def move_selected(self, request, queryset):
+        if 'apply' in request.POST:
+            form = MoveBookingsForm(request.POST)
+            if form.is_valid():
+                schedule = form.cleaned_data['schedule']
+                self._run(request, lambda qs: services.move_bookings(qs, schedule), queryset, f"moved to {schedule}")
+                return None
+        else:
+            form = MoveBookingsForm()
+        return TemplateResponse(request, 'admin/pilolo/booking/move_bookings.html', {
+            **self.admin_site.each_context(request),
+            'title': 'Move bookings',
+            'opts': self.model._meta,
+            'form': form,
+            'bookings': queryset.select_related('user', 'schedule__tour'),
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+        })
 
 
 @admin.register(CustomUser)
@@ -24,12 +245,50 @@ class CustomUserAdmin(admin.ModelAdmin):
     search_fields = ['email', 'first_name', 'last_name']
 
 @admin.register(BookingParticipant)
-class BookingParticipantAdmin(admin.ModelAdmin):
+class BookingParticipantAdmin(IndexedSearchAdmin):
     list_display = ['booking', 'full_name', 'age', 'notes']
+    list_select_related = ['booking__user', 'booking__schedule__tour']
+    search_fields = ['booking__reference']
+    search_help_text = 'Exact booking reference.'
+    raw_id_fields = ['booking']
 
 
 @admin.register(Payment)
-class PaymentAdmin(admin.ModelAdmin):
+class PaymentAdmin(IndexedSearchAdmin):
     list_display = ['booking', 'amount', 'payment_date', 'status']
     list_filter = ['status', 'payment_date']
-    search_fields = ['booking__user__email', 'transaction_id']
+    list_select_related = ['booking__user', 'booking__schedule__tour']
+    search_fields = ['transaction_id', 'booking__reference', 'booking__user__email']
+    search_help_text = 'Exact transaction id, booking reference or email address.'
+    raw_id_fields = ['booking']
+
+
+@admin.register(PaymentEvent)
+class PaymentEventAdmin(IndexedSearchAdmin):
+    list_display = ['transaction_id', 'event', 'received_at', 'processed_at', 'orphaned']
+    list_filter = ['event', 'orphaned']
+    search_fields = ['transaction_id']
+    search_help_text = 'Exact transaction id.'
+    readonly_fields = ['event', 'transaction_id', 'payload', 'received_at', 'processed_at', 'orphaned']
+
+
+@admin.register(SeatHold)
+class SeatHoldAdmin(admin.ModelAdmin):
+    list_display = ['schedule', 'user', 'seats', 'expires_at']
+    list_select_related = ['schedule__tour', 'user']
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(BigTableAdmin):
+    list_display = ['recipient', 'kind', 'status', 'attempts', 'next_attempt_at', 'sent_at']
+    list_filter = ['status', 'kind']
+    search_fields = ['recipient']
+    readonly_fields = ['claimed_by', 'locked_until', 'last_error', 'created_at', 'sent_at']
+    actions = ['retry_now']
+
+    @admin.action(description='Retry selected emails now')
+    def retry_now(self, request, queryset):
+        updated = queryset.exclude(status='sent').update(
+            status='pending', attempts=0, next_attempt_at=timezone.now(), claimed_by='', locked_until=None
+        )
+        self.message_user(request, f"{updated} email(s) queued for retry.")
@@ -1,6 +1,17 @@
 from django.apps import AppConfig
+from django.contrib.staticfiles.apps import StaticFilesConfig
 
 
 class PiloloConfig(AppConfig):
+    default = True  # this module defines more than one config
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'pilolo'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+
+class PiloloStaticFilesConfig(StaticFilesConfig):
+    # input.css is the Tailwind source read by `manage.py build_assets`; only
+    # the built output.css is collected and served.
+    ignore_patterns = StaticFilesConfig.ignore_patterns + ['css/input.css']
@@ -0,0 +1,351 @@
+"""Latency and query-count benchmarks for the public and booking views.
+
+Every scenario is driven through Django's test client inside a transaction
+that is rolled back at the end, so running the suite leaves no data behind.
+``ServerComparison`` instead drives the WSGI and ASGI applications directly
+to compare their throughput under concurrent load, and
+``SQLiteWriteBenchmark`` runs concurrent booking writers against SQLite.
+"""
+import asyncio
+import datetime
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from .models import CustomUser, Tour, TourSchedule
+
+
+class BenchmarkError(Exception):
+    """Raised when a scenario does not get the response it expects."""
+
+
+def _expect(response, *codes):
+    if response.status_code not in codes:
+        raise BenchmarkError(f"{response.request['PATH_INFO']} returned {response.status_code}")
+    return response
+
+
+class BenchmarkRunner:
+    def __init__(self, iterations=20, warmup=2):
+        self.iterations = iterations
+        self.warmup = warmup
+
+    def run(self):
+        """Run every scenario and return ``{name: {p50_ms, p95_ms, queries}}``."""
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'):
+            with transaction.atomic():
+                results = self._run_all()
+                transaction.set_rollback(True)
+        return results
+
+    def _run_all(self):
+        tour = Tour.objects.annotate(n=Count('schedules')).order_by('-n', 'id').first()
+        user = CustomUser.objects.annotate(n=Count('booking')).order_by('-n', 'id').first()
+        if tour is None or user is None:
+            raise BenchmarkError("No data to benchmark; run `manage.py seed_data` first.")
+        schedule = tour.schedules.order_by('-date').first()
+
+        anonymous = Client()
+        member = Client()
+        member.force_login(user)
+
+        scenarios = {
+            'home': lambda: _expect(anonymous.get(reverse('home')), 200),
+            'tour_list': lambda: _expect(anonymous.get(reverse('tours_list')), 200),
+            'tour_detail': lambda: _expect(anonymous.get(reverse('tour_detail', args=[tour.id])), 200),
+            'booking_start': lambda: _expect(member.get(reverse('booking_start', args=[schedule.id])), 200),
+            'my_bookings': lambda: _expect(member.get(reverse('my_bookings')), 200),
+            'booking_wizard': self._wizard(member),
+        }
+        return {name: self._measure(scenario) for name, scenario in scenarios.items()}
+
+    def _wizard(self, client):
+        # A roomy departure so repeated checkouts never run out of seats
+        tour = Tour.objects.create(
+            name='Benchmark Tour', description='-', price=Decimal('100.00'), max_participants=100_000,
+            highlights='-', what_included='-', what_to_bring='-', meeting_point='-',
+        )
+        schedule = TourSchedule.objects.create(
+            tour=tour, day='saturday', date=datetime.date.today() + datetime.timedelta(days=7),
+            start_time=datetime.time(8, 0), end_time=datetime.time(10, 0),
+        )
+        counter = iter(range(10**9))
+
+        def checkout():
+            n = next(counter)
+            _expect(client.post(reverse('booking_start', args=[schedule.id]), {
+                'schedule': schedule.id, 'participants': 2, 'special_requirements': '',
+            }), 302)
+            _expect(client.get(reverse('booking_participants')), 200)
+            _expect(client.post(reverse('booking_participants'), {
+                'participant_1_full_name': 'Ama', 'participant_1_age': '30', 'participant_1_notes': '',
+                'participant_2_full_name': 'Kofi', 'participant_2_age': '', 'participant_2_notes': '',
+            }), 302)
+            _expect(client.get(reverse('booking_payment')), 200)
+            response = _expect(client.post(
+                reverse('booking_payment'),
+                {'paymentSuccess': True, 'reference': f'BENCH_{n}'},
+                content_type='application/json',
+            ), 302)
+            _expect(client.get(response.url), 200)
+
+        return checkout
+
+    def _measure(self, scenario):
+        for _ in range(self.warmup):
+            scenario()
+        timings = []
+        queries = 0
+        for _ in range(self.iterations):
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                scenario()
+                timings.append((time.perf_counter() - start) * 1000)
+            queries = max(queries, len(captured))
+        return {
+            'p50_ms': round(statistics.median(timings), 2),
+            'p95_ms': round(_percentile(timings, 95), 2),
+            'queries': queries,
+        }
+
+
+def _percentile(values, pct):
+    if len(values) < 2:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[pct - 1]
+
+
+def machine():
+    """Identifies the machine a baseline was recorded on; latencies only compare within one."""
+    return f"{platform.node()} {platform.machine()} {os.cpu_count()} cpu python {platform.python_version()}"
+
+
+def compare_to_baseline(results, baseline, tolerance, latency=None):
+    """Return a list of regressions against ``baseline`` (``{'machine', 'views'}``).
+
+    Query counts must not grow at all. p95 latency may grow up to
+    ``tolerance`` times the stored value, and is only checked when the
+    baseline was recorded on this machine, unless ``latency`` forces it
+    on (True) or off (False).
+    """
+    if latency is None:
+        latency = baseline.get('machine') == machine()
+    regressions = []
+    for name, expected in baseline['views'].items():
+        actual = results.get(name)
+        if actual is None:
+            continue
+        if actual['queries'] > expected['queries']:
+            regressions.append(f"{name}: {actual['queries']} queries, baseline {expected['queries']}")
+        if latency and actual['p95_ms'] > expected['p95_ms'] * tolerance:
+            regressions.append(
+                f"{name}: p95 {actual['p95_ms']}ms, baseline {expected['p95_ms']}ms (x{tolerance} allowed)"
+            )
+    return regressions
+
+
+class ServerComparison:
+    """Concurrent-request throughput of the WSGI and ASGI entry points.
+
+    Requests go straight to ``core.wsgi.application`` (from a pool of
+    ``workers`` threads, like gunicorn's threaded workers) and to
+    ``core.asgi.application`` (``concurrency`` requests in flight on one event
+    loop, like a uvicorn worker), skipping the network so only the Django
+    side is compared. ``latency_ms`` adds a sleep to every SQL query to
+    stand in for a remote or busy database.
+    """
+
+    def __init__(self, paths, requests=200, concurrency=50, workers=4, latency_ms=0):
+        self.paths = paths
+        self.requests = requests
+        self.concurrency = concurrency
+        self.workers = workers
+        self.latency = latency_ms / 1000
+
+    def run(self):
+        connection_created.connect(self._add_latency)
+        try:
+            # Uncached, so every request reaches the database
+            with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+                return {
+                    path: {'wsgi': self._measure(self._wsgi, path), 'asgi': self._measure(self._asgi, path)}
+                    for path in self.paths
+                }
+        finally:
+            connection_created.disconnect(self._add_latency)
+
+    def _add_latency(self, sender, connection, **kwargs):
+        if self.latency and self._slow_query not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self._slow_query)
+
+    def _slow_query(self, execute, sql, params, many, context):
+        time.sleep(self.latency)
+        return execute(sql, params, many, context)
+
+    def _measure(self, serve, path):
+        start = time.perf_counter()
+        statuses = serve(path)
+        elapsed = time.perf_counter() - start
+        if set(statuses) != {200}:
+            raise BenchmarkError(f"{path} returned {sorted(set(statuses))}")
+        return {'requests_per_s': round(self.requests / elapsed, 1), 'seconds': round(elapsed, 3)}
+
+    def _wsgi(self, path):
+        from core.wsgi import application
+
+        def request(_):
+            environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'HTTP_HOST': 'localhost'}
+            setup_testing_defaults(environ)
+            status = []
+            body = application(environ, lambda s, headers, exc_info=None: status.append(int(s[:3])))
+            try:
+                for _ in body:
+                    pass
+            finally:
+                body.close()
+            return status[0]
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            return list(pool.map(request, range(self.requests)))
+
+    def _asgi(self, path):
+        from core.asgi import application
+
+        async def request(limit):
+            async with limit:
+                done = asyncio.Event()
+                status = []
+                messages = iter([{'type': 'http.request', 'body': b'', 'more_body': False}])
+
+                async def receive():
+                    message = next(messages, None)
+                    if message is None:
+                        await done.wait()
+                        message = {'type': 'http.disconnect'}
+                    return message
+
+                async def send(message):
+                    if message['type'] == 'http.response.start':
+                        status.append(message['status'])
+                    elif not message.get('more_body'):
+                        done.set()
+
+                scope = {
+                    'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                    'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+                    'headers': [(b'host', b'localhost')], 'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+                }
+                await application(scope, receive, send)
+                return status[0]
+
+        async def main():
+            limit = asyncio.Semaphore(self.concurrency)
+            return await asyncio.gather(*(request(limit) for _ in range(self.requests)))
+
+        return asyncio.run(main())
+
+
+def _book_repeatedly(schedule_id, user_id, count):
+    """Forked worker for ``SQLiteWriteBenchmark``: ``count`` hold-then-book checkouts."""
+    from . import holds, services
+
+    connections.close_all()
+    user = CustomUser.objects.get(pk=user_id)
+    booked = failed = 0
+    for n in range(count):
+        try:
+            holds.place_hold(schedule_id, user, 1)
+            services.commit_booking(user, schedule_id, [], transaction_reference=f'BENCH_{user_id}_{n}')
+            booked += 1
+        except OperationalError:
+            failed += 1
+    connections.close_all()
+    return booked, failed
+
+
+class SQLiteWriteBenchmark:
+    """Booking throughput of concurrent writer processes on SQLite, per connection profile.
+
+    Each profile gets its own copy of a freshly migrated database file, so
+    the journal mode one profile sets does not leak into the next.
+    ``default`` is SQLite's stock behaviour with no lock retries; ``tuned``
+    is ``SQLITE_OPTIONS`` plus ``SQLITE_LOCK_RETRIES``.
+    """
+
+    def __init__(self, processes=8, bookings=25):
+        self.processes = processes
+        self.bookings = bookings
+
+    def run(self):
+        if connection.vendor != 'sqlite':
+            raise BenchmarkError("The write benchmark needs the default database to be SQLite.")
+        profiles = {
+            'default': ({}, 0),
+            'tuned': (settings.SQLITE_OPTIONS, settings.SQLITE_LOCK_RETRIES),
+        }
+        saved = {key: connection.settings_dict[key] for key in ('NAME', 'OPTIONS')}
+        with tempfile.TemporaryDirectory() as workdir:
+            template = os.path.join(workdir, 'template.sqlite3')
+            self._use(template, {})
+            call_command('migrate', verbosity=0)
+            schedule_id, user_ids = self._seed()
+            connections.close_all()
+            try:
+                results = {}
+                for name, (options, retries) in profiles.items():
+                    path = os.path.join(workdir, f'{name}.sqlite3')
+                    shutil.copy(template, path)
+                    self._use(path, options)
+                    with override_settings(SQLITE_LOCK_RETRIES=retries):
+                        results[name] = self._measure(schedule_id, user_ids)
+            finally:
+                connections.close_all()
+                connection.settings_dict.update(saved)
+        results['speedup'] = round(results['tuned']['bookings_per_s'] / max(results['default']['bookings_per_s'], 0.01), 2)
+        return results
+
+    def _use(self, path, options):
+        connections.close_all()
+        connection.settings_dict.update({'NAME': path, 'OPTIONS': dict(options)})
+
+    def _seed(self):
+        tour = Tour.objects.create(
+            name='Write Benchmark Tour', description='-', price=Decimal('100.00'), max_participants=10**6,
+            highlights='-', what_included='-', what_to_bring='-', meeting_point='-',
+        )
+        schedule = TourSchedule.objects.create(
+            tour=tour, day='saturday', date=datetime.date.today() + datetime.timedelta(days=7),
+            start_time=datetime.time(8, 0), end_time=datetime.time(10, 0),
+        )
+        users = [CustomUser.objects.create_user(f'writer{i}@example.com') for i in range(self.processes)]
+        return schedule.pk, [user.pk for user in users]
+
+    def _measure(self, schedule_id, user_ids):
+        connections.close_all()
+        start = time.perf_counter()
+        with multiprocessing.get_context('fork').Pool(self.processes) as pool:
+            outcomes = pool.starmap(_book_repeatedly, [(schedule_id, user_id, self.bookings) for user_id in user_ids])
+        elapsed = time.perf_counter() - start
+        booked = sum(b for b, _ in outcomes)
+        return {
+            'booked': booked,
+            'failed': sum(f for _, f in outcomes),
+            'seconds': round(elapsed, 3),
+            'bookings_per_s': round(booked / elapsed, 1),
+        }
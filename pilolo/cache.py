@@ -0,0 +1,172 @@
+"""Versioned cache for the public tour catalog.
+
+Cached values live under keys that embed a version number per scope: one
+``catalog`` scope for the tour list, one ``tour:<id>`` scope per tour for
+its schedules and availability, and one ``month:<yyyy-mm>`` scope per month
+for the availability calendar. Model signals bump only the scopes a write
+touches, so stale entries are never read again and simply expire.
+
+``acached`` and ``aversion`` are the same lookups for async views, built on
+the cache's ``a``-prefixed methods.
+
+Misses are rebuilt wherever the view reads from, usually a replica. A scope
+bumped within the last ``REPLICA_PIN_SECONDS`` is rebuilt from the primary
+instead, so a replica that has not caught up with the write is never cached
+under the new version.
+
+Hit/miss counters are kept per process rather than in the cache, so a hit
+never writes to a shared backend. ``stats()`` reports the current process;
+the ``pilolo.metrics`` log line carries each request's hits and misses for a
+site-wide ratio.
+"""
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from . import middleware, routers
+
+PREFIX = 'pilolo'
+CATALOG = 'catalog'
+_MISSING = object()
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def tour_scope(tour_id):
+    return f'tour:{tour_id}'
+
+
+def month_scope(day):
+    """Scope of the calendar month containing ``day`` (a date, datetime or ISO string)."""
+    return f'month:{str(day)[:7]}'
+
+
+def _version_key(scope):
+    return f'{PREFIX}:{scope}:version'
+
+
+def _bumped_key(scope):
+    return f'{PREFIX}:{scope}:bumped'
+
+
+def _fresh_version():
+    # Seeded from the clock so a version key that was evicted and recreated
+    # can never point back at entries cached under an older number.
+    return time.time_ns() // 1000
+
+
+def _versions(scopes):
+    """Versions of ``scopes``, and whether any of them was bumped recently."""
+    keys = [_version_key(scope) for scope in scopes]
+    found = cache.get_many(keys + [_bumped_key(scope) for scope in scopes])
+    for key in keys:
+        if key not in found:
+            cache.add(key, _fresh_version(), None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys], len(found) > len(keys)
+
+
+async def _aversions(scopes):
+    keys = [_version_key(scope) for scope in scopes]
+    found = await cache.aget_many(keys + [_bumped_key(scope) for scope in scopes])
+    for key in keys:
+        if key not in found:
+            await cache.aadd(key, _fresh_version(), None)
+            found[key] = await cache.aget(key)
+    return [found[key] for key in keys], len(found) > len(keys)
+
+
+def version(scope):
+    """Current version of ``scope``; changes whenever the scope is bumped."""
+    return _versions([scope])[0][0]
+
+
+async def aversion(scope):
+    return (await _aversions([scope]))[0][0]
+
+
+def bump(*scopes):
+    """Invalidate everything cached under the given scopes."""
+    for scope in scopes:
+        key = _version_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, _fresh_version(), None)
+    if routers.replicas():
+        cache.set_many({_bumped_key(scope): True for scope in scopes}, getattr(settings, 'REPLICA_PIN_SECONDS', 10))
+
+
+def _building(recently_bumped):
+    # Replicas may still lack the write behind a recent bump
+    return routers.primary() if recently_bumped else nullcontext()
+
+
+def bump_on_commit(*scopes):
+    """Bump ``scopes`` once the current transaction commits.
+
+    Bumping earlier would let a concurrent request cache the old rows under
+    the new version.
+    """
+    transaction.on_commit(lambda: bump(*scopes))
+
+
+def _count(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+    metrics = middleware.current_metrics()
+    if metrics is not None:
+        metrics.cache[outcome] += 1
+
+
+def _key(name, scopes, versions):
+    return ':'.join([PREFIX, name] + [f'{scope}@{version}' for scope, version in zip(scopes, versions)])
+
+
+def cached(name, scopes, build):
+    """Return the value cached as ``name`` under ``scopes``, building it on a miss."""
+    versions, recently_bumped = _versions(scopes)
+    key = _key(name, scopes, versions)
+    value = cache.get(key, _MISSING)
+    if value is _MISSING:
+        _count('misses')
+        with _building(recently_bumped):
+            value = build()
+        cache.set(key, value, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 60))
+    else:
+        _count('hits')
+    return value
+
+
+async def acached(name, scopes, build):
+    """Async ``cached``; ``build`` is a coroutine function."""
+    versions, recently_bumped = await _aversions(scopes)
+    key = _key(name, scopes, versions)
+    value = await cache.aget(key, _MISSING)
+    if value is _MISSING:
+        _count('misses')
+        with _building(recently_bumped):
+            value = await build()
+        await cache.aset(key, value, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 60))
+    else:
+        _count('hits')
+    return value
+
+
+def stats():
+    """Hits, misses and hit ratio of this process since it started or last reset."""
+    with _stats_lock:
+        hits, misses = _stats['hits'], _stats['misses']
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_ratio': round(hits / total, 4) if total else None}
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
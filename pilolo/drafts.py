@@ -0,0 +1,132 @@
+"""Draft storage for the booking wizard.
+
+The session only carries the draft id. The draft itself lives in the cache
+under a per-user key and is copied to ``BookingDraft`` whenever a wizard step
+completes, so a cache miss (eviction, restart, another worker's locmem cache)
+falls back to the last completed step. The participant stepper's +/- clicks
+stay in the page and reach the draft with the participants step.
+
+That only holds when every worker sees the same cache. With a per-process
+cache (locmem, the default) one worker could keep serving a copy another
+worker has replaced, so drafts then skip the cache and every change is
+written to ``BookingDraft``. ``BOOKING_DRAFT_CACHE`` forces either mode.
+
+Drafts expire ``BOOKING_DRAFT_TTL`` seconds after their last change: the
+cache entry times out on its own and ``manage.py purge_drafts`` deletes the
+expired rows in chunks.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils import timezone
+
+from .models import BookingDraft
+
+SESSION_KEY = 'booking_draft'
+
+
+def _ttl():
+    return getattr(settings, 'BOOKING_DRAFT_TTL', 2 * 60 * 60)
+
+
+def _cached():
+    setting = getattr(settings, 'BOOKING_DRAFT_CACHE', None)
+    if setting is not None:
+        return setting
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def _key(user_id, draft_id):
+    return f'pilolo:draft:{user_id}:{draft_id}'
+
+
+def _save(user_id, draft_id, data):
+    BookingDraft.objects.update_or_create(
+        pk=draft_id,
+        user_id=user_id,
+        defaults={'data': data, 'expires_at': timezone.now() + timedelta(seconds=_ttl())},
+    )
+
+
+def create(user, **data):
+    """Store a new draft for ``user`` and return its id."""
+    draft = BookingDraft.objects.create(
+        user=user, data=data, expires_at=timezone.now() + timedelta(seconds=_ttl())
+    )
+    if _cached():
+        cache.set(_key(user.pk, draft.pk), data, _ttl())
+    return str(draft.pk)
+
+
+def get(user, draft_id):
+    """Return the draft's data, or None if it is missing, expired or not ``user``'s."""
+    use_cache = _cached()
+    data = cache.get(_key(user.pk, draft_id)) if use_cache else None
+    if data is None:
+        draft = BookingDraft.objects.filter(pk=draft_id, user=user, expires_at__gt=timezone.now()).first()
+        if draft is None:
+            return None
+        data = draft.data
+        if use_cache:
+            cache.set(_key(user.pk, draft_id), data, _ttl())
+    return data
+
+
+def update(user, draft_id, **changes):
+    """Merge ``changes`` into the draft. Returns the new data, or None if the draft is gone."""
+    data = get(user, draft_id)
+    if data is None:
+        return None
+    data = {**data, **changes}
+    if _cached():
+        cache.set(_key(user.pk, draft_id), data, _ttl())
+    _save(user.pk, draft_id, data)
+    return data
+
+
+def delete(user, draft_id):
+    cache.delete(_key(user.pk, draft_id))
+    BookingDraft.objects.filter(pk=draft_id, user=user).delete()
+
+
+def purge_expired(chunk_size=1000):
+    """Delete expired draft rows ``chunk_size`` at a time; returns the number removed."""
+    removed = 0
+    while True:
+        ids = list(
+            BookingDraft.objects.filter(expires_at__lte=timezone.now()).values_list('pk', flat=True)[:chunk_size]
+        )
+        if not ids:
+            return removed
+        removed += BookingDraft.objects.filter(pk__in=ids).delete()[0]
+
+
+# Request helpers used by the wizard views
+
+def start(request, **data):
+    """Begin a new draft for the current user, replacing any earlier one."""
+    discard(request)
+    request.session[SESSION_KEY] = create(request.user, **data)
+
+
+def _draft_id(request):
+    return request.session.get(SESSION_KEY) if request.user.is_authenticated else None
+
+
+def load(request):
+    draft_id = _draft_id(request)
+    return get(request.user, draft_id) if draft_id else None
+
+
+def save(request, **changes):
+    draft_id = _draft_id(request)
+    return update(request.user, draft_id, **changes) if draft_id else None
+
+
+def discard(request):
+    draft_id = request.session.pop(SESSION_KEY, None)
+    if draft_id and request.user.is_authenticated:
+        delete(request.user, draft_id)
@@ -0,0 +1,104 @@
+"""Streaming CSV exports of bookings, departure rosters and payments.
+
+Each export is a single joined query read with ``.iterator()``, turned into
+CSV one row at a time, so memory use does not depend on the number of rows.
+Used by the staff ``/staff/exports/<kind>.csv`` endpoint and by
+``manage.py export_csv``.
+"""
+import csv
+
+from django.db.models import Count
+
+from .models import Booking, Payment
+
+CHUNK_SIZE = 2000
+
+
+class _Echo:
+    """File-like object whose ``write`` hands the line back to the caller."""
+
+    def write(self, value):
+        return value
+
+
+def _filter(queryset, prefix='', date_from=None, date_to=None, tour=None, schedule=None):
+    filters = {}
+    if date_from:
+        filters[f'{prefix}tour_date__gte'] = date_from
+    if date_to:
+        filters[f'{prefix}tour_date__lte'] = date_to
+    if tour:
+        filters[f'{prefix}schedule__tour'] = tour
+    if schedule:
+        filters[f'{prefix}schedule'] = schedule
+    return queryset.filter(**filters)
+
+
+def booking_rows(**filters):
+    yield [
+        'reference', 'status', 'booked_at', 'tour', 'tour_date', 'start_time',
+        'email', 'first_name', 'last_name', 'participants', 'total_price', 'special_requirements',
+    ]
+    bookings = (
+        _filter(Booking.objects.all(), **filters)
+        .annotate(participants=Count('participant_details'))
+        .order_by('tour_date', 'schedule__start_time', 'id')
+        .values_list(
+            'reference', 'status', 'booking_date', 'schedule__tour__name', 'tour_date', 'schedule__start_time',
+            'user__email', 'user__first_name', 'user__last_name', 'participants', 'schedule__tour__price',
+            'special_requirements',
+        )
+    )
+    for row in bookings.iterator(chunk_size=CHUNK_SIZE):
+        *head, participants, price, requirements = row
+        yield [*head, participants, price * (participants + 1), requirements]
+
+
+def roster_rows(**filters):
+    """One row per rider: each booker followed by the participants they added."""
+    yield ['tour', 'tour_date', 'start_time', 'reference', 'status', 'rider', 'role', 'age', 'email', 'notes']
+    rows = (
+        _filter(Booking.objects.exclude(status='cancelled'), **filters)
+        .order_by('tour_date', 'schedule__start_time', 'schedule', 'id', 'participant_details__id')
+        .values_list(
+            'schedule__tour__name', 'tour_date', 'schedule__start_time', 'reference', 'status',
+            'user__first_name', 'user__last_name', 'user__email', 'special_requirements',
+            'participant_details__full_name', 'participant_details__age', 'participant_details__notes',
+        )
+    )
+    last_reference = None
+    for (tour, date, start, reference, status, first, last, email, requirements,
+         guest, guest_age, guest_notes) in rows.iterator(chunk_size=CHUNK_SIZE):
+        departure = [tour, date, start, reference, status]
+        if reference != last_reference:
+            last_reference = reference
+            yield [*departure, f'{first} {last}'.strip() or email, 'booker', '', email, requirements]
+        if guest is not None:
+            yield [*departure, guest, 'participant', guest_age if guest_age is not None else '', '', guest_notes]
+
+
+def payment_rows(**filters):
+    yield ['transaction_id', 'paid_at', 'amount', 'status', 'reference', 'booking_status', 'tour', 'tour_date', 'email']
+    payments = (
+        _filter(Payment.objects.all(), prefix='booking__', **filters)
+        .order_by('payment_date', 'id')
+        .values_list(
+            'transaction_id', 'payment_date', 'amount', 'status', 'booking__reference', 'booking__status',
+            'booking__schedule__tour__name', 'booking__tour_date', 'booking__user__email',
+        )
+    )
+    yield from payments.iterator(chunk_size=CHUNK_SIZE)
+
+
+EXPORTS = {
+    'bookings': booking_rows,
+    'participants': roster_rows,
+    'payments': payment_rows,
+}
+
+
+def stream_csv(kind, **filters):
+    """Yield the ``kind`` export as CSV text, one line at a time."""
+    writer = csv.writer(_Echo())
+    for row in EXPORTS[kind](**filters):
+        yield writer.writerow(row)
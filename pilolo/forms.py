@@ -1,7 +1,7 @@
 from django import forms
 from allauth.account.forms import SignupForm
 
-from pilolo.models import Booking
+from pilolo.models import Booking, Tour, TourSchedule
 
 
 class BookingForm(forms.ModelForm):
@@ -26,6 +26,8 @@ class BookingForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         self.user = kwargs.pop('user', None)
         super().__init__(*args, **kwargs)
+        # Availability is checked in clean(), so load it with the schedule
+        self.fields['schedule'].queryset = TourSchedule.objects.with_availability()
         if self.user:
             self.fields['participants'].initial = 0
         
@@ -69,4 +71,11 @@ class CustomSignupForm(SignupForm):
         user.save()
 
         # You must return the user object.
-        return user
\ No newline at end of file
+        return user
+
+class ExportFilterForm(forms.Form):
+    """Filters for the staff CSV exports; every field is optional."""
+    date_from = forms.DateField(required=False)
+    date_to = forms.DateField(required=False)
+    tour = forms.ModelChoiceField(queryset=Tour.objects.all(), required=False)
+    schedule = forms.ModelChoiceField(queryset=TourSchedule.objects.all(), required=False)
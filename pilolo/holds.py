@@ -0,0 +1,122 @@
+"""Time-limited seat holds for the booking wizard.
+
+A hold is placed when ``booking_start`` succeeds and claimed when
+``booking_payment`` turns it into a booking. Both steps run with the
+schedule row locked, so two workers can never sell the same seat.
+"""
+import random
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import SeatHold, TourSchedule
+
+
+class SeatsUnavailable(Exception):
+    """Raised when a schedule cannot fit the requested number of seats."""
+
+    def __init__(self, available):
+        self.available = max(available, 0)
+        super().__init__(f"Only {self.available} spot(s) left on this schedule.")
+
+
+def retry_when_locked(func):
+    """Retry ``func`` with jittered exponential backoff while SQLite reports a locked database.
+
+    Only an outermost call is retried; inside a surrounding transaction the
+    error is raised as usual. Attempts are capped by ``SQLITE_LOCK_RETRIES``.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        retries = 0 if connection.in_atomic_block else getattr(settings, 'SQLITE_LOCK_RETRIES', 4)
+        for attempt in range(retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                if 'locked' not in str(e) or attempt == retries:
+                    raise
+            # Full jitter, so workers that collided do not collide again
+            time.sleep(random.uniform(0, min(0.05 * 2 ** attempt, 1.0)))
+    return wrapper
+
+
+def hold_ttl():
+    return timedelta(seconds=getattr(settings, 'SEAT_HOLD_TTL', 15 * 60))
+
+
+def lock_schedule(schedule_id):
+    """Lock the schedule row until the surrounding transaction ends."""
+    schedules = TourSchedule.objects.select_related('tour')
+    if connection.features.has_select_for_update:
+        of = ('self',) if connection.features.has_select_for_update_of else ()
+        return schedules.select_for_update(of=of).get(pk=schedule_id)
+    # SQLite has no row locks; a no-op write takes the database write lock.
+    TourSchedule.objects.filter(pk=schedule_id).update(booked_count=F('booked_count'))
+    return schedules.get(pk=schedule_id)
+
+
+def lock_schedules(schedule_ids):
+    """Lock several schedule rows, always in primary-key order to avoid deadlocks."""
+    schedule_ids = sorted(set(schedule_ids))
+    if connection.features.has_select_for_update:
+        of = ('self',) if connection.features.has_select_for_update_of else ()
+        return list(TourSchedule.objects.select_for_update(of=of).filter(pk__in=schedule_ids).order_by('pk'))
+    TourSchedule.objects.filter(pk__in=schedule_ids).update(booked_count=F('booked_count'))
+    return list(TourSchedule.objects.filter(pk__in=schedule_ids).order_by('pk'))
+
+
+def available_seats(schedule, user=None):
+    """Seats still free on ``schedule``, ignoring any hold owned by ``user``."""
+    holds = SeatHold.objects.active().filter(schedule=schedule)
+    if user is not None:
+        holds = holds.exclude(user=user)
+    held = holds.aggregate(total=Coalesce(Sum('seats'), 0))['total']
+    return schedule.tour.max_participants - schedule.booked_count - held
+
+
+@retry_when_locked
+@transaction.atomic
+def place_hold(schedule_id, user, seats):
+    """Hold ``seats`` on the schedule for ``user``, replacing any earlier hold."""
+    schedule = lock_schedule(schedule_id)
+    available = available_seats(schedule, user)
+    if seats > available:
+        raise SeatsUnavailable(available)
+
+    hold, _ = SeatHold.objects.update_or_create(
+        schedule=schedule,
+        user=user,
+        defaults={'seats': seats, 'expires_at': timezone.now() + hold_ttl()},
+    )
+    return hold
+
+
+def claim_seats(schedule_id, user, seats):
+    """Check ``seats`` are still free and release the user's hold.
+
+    Must run inside the transaction that creates the booking, so the seats
+    are counted before the schedule lock is released. An expired hold is not
+    an error as long as the seats are still free.
+    """
+    if not connection.in_atomic_block:
+        raise RuntimeError("claim_seats() must be called inside transaction.atomic().")
+
+    schedule = lock_schedule(schedule_id)
+    available = available_seats(schedule, user)
+    if seats > available:
+        raise SeatsUnavailable(available)
+
+    SeatHold.objects.filter(schedule=schedule, user=user).delete()
+    return schedule
+
+
+def sweep_expired_holds():
+    """Delete every expired hold in one statement; returns the number removed."""
+    deleted, _ = SeatHold.objects.expired().delete()
+    return deleted
@@ -0,0 +1,81 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from pilolo.benchmarks import BenchmarkError, BenchmarkRunner, compare_to_baseline, machine
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / 'benchmarks' / 'baseline.json'
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the public and booking views against a freshly seeded throwaway "
+        "database and compare query counts (and, on the machine that recorded it, p95 "
+        "latency) with a stored baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, default=1, help="Data size passed to seed_data.")
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--existing', action='store_true', help="Benchmark the current database instead of seeding a throwaway one.")
+        parser.add_argument('--output', help="Write the JSON report to this file as well as stdout.")
+        parser.add_argument('--baseline', default=str(DEFAULT_BASELINE), help="Baseline file, keyed by scale.")
+        parser.add_argument('--tolerance', type=float, default=2.0, help="Allowed p95 growth factor over the baseline.")
+        latency = parser.add_mutually_exclusive_group()
+        latency.add_argument(
+            '--check-latency', dest='latency', action='store_true', default=None,
+            help="Compare p95 latency even if the baseline was recorded on another machine.",
+        )
+        latency.add_argument('--skip-latency', dest='latency', action='store_false', help="Only compare query counts.")
+        parser.add_argument('--write-baseline', action='store_true', help="Store this run as the baseline for --scale.")
+
+    def handle(self, *args, **options):
+        if options['existing']:
+            results = self.run(options)
+        else:
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                call_command('seed_data', scale=options['scale'], stdout=self.stderr)
+                results = self.run(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = json.dumps({'scale': options['scale'], 'views': results}, indent=2)
+        self.stdout.write(report)
+        if options['output']:
+            Path(options['output']).write_text(report + '\n')
+
+        baseline_path = Path(options['baseline'])
+        baselines = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+        scale_key = str(options['scale'])
+
+        if options['write_baseline']:
+            baselines[scale_key] = {'machine': machine(), 'views': results}
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps(baselines, indent=2, sort_keys=True) + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Baseline for scale {scale_key} written to {baseline_path}"))
+            return
+
+        if scale_key not in baselines:
+            self.stderr.write(self.style.WARNING(f"No baseline for scale {scale_key}; nothing to compare."))
+            return
+
+        baseline = baselines[scale_key]
+        if options['latency'] is None and baseline.get('machine') != machine():
+            self.stderr.write(self.style.WARNING(
+                f"Baseline recorded on {baseline.get('machine')!r}; comparing query counts only."
+            ))
+        regressions = compare_to_baseline(results, baseline, options['tolerance'], options['latency'])
+        if regressions:
+            raise CommandError("Performance regressions:\n  " + "\n  ".join(regressions))
+        self.stderr.write(self.style.SUCCESS("Within baseline."))
+
+    def run(self, options):
+        try:
+            return BenchmarkRunner(iterations=options['iterations']).run()
+        except BenchmarkError as e:
+            raise CommandError(str(e))
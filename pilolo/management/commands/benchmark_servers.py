@@ -0,0 +1,48 @@
+import json
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.urls import reverse
+
+from pilolo.benchmarks import BenchmarkError, ServerComparison
+from pilolo.models import Tour
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare concurrent-request throughput of the public views under the WSGI and "
+        "ASGI entry points, against a freshly seeded throwaway database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, default=1, help="Data size passed to seed_data.")
+        parser.add_argument('--requests', type=int, default=200, help="Requests per path and server.")
+        parser.add_argument('--concurrency', type=int, default=50, help="Requests in flight under ASGI.")
+        parser.add_argument('--workers', type=int, default=4, help="Worker threads under WSGI.")
+        parser.add_argument('--latency-ms', type=float, default=0, help="Extra delay added to every SQL query.")
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            call_command('seed_data', scale=options['scale'], stdout=self.stderr)
+            tour = Tour.objects.annotate(n=Count('schedules')).order_by('-n', 'id').first()
+            paths = [
+                reverse('home'),
+                reverse('tours_list'),
+                reverse('tour_detail', args=[tour.id]),
+                reverse('tour_availability', args=[tour.id]),
+            ]
+            comparison = ServerComparison(
+                paths, requests=options['requests'], concurrency=options['concurrency'],
+                workers=options['workers'], latency_ms=options['latency_ms'],
+            )
+            try:
+                results = comparison.run()
+            except BenchmarkError as e:
+                raise CommandError(str(e))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        self.stdout.write(json.dumps({'options': {k: options[k] for k in (
+            'scale', 'requests', 'concurrency', 'workers', 'latency_ms')}, 'paths': results}, indent=2))
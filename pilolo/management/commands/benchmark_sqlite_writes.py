@@ -0,0 +1,23 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pilolo.benchmarks import BenchmarkError, SQLiteWriteBenchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare booking-write throughput of concurrent processes on SQLite with stock "
+        "settings and with the SQLITE_OPTIONS profile, on throwaway database files."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=8)
+        parser.add_argument('--bookings', type=int, default=25, help="Checkouts per process.")
+
+    def handle(self, *args, **options):
+        try:
+            results = SQLiteWriteBenchmark(options['processes'], options['bookings']).run()
+        except BenchmarkError as e:
+            raise CommandError(str(e))
+        self.stdout.write(json.dumps(results, indent=2))
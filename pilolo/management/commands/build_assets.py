@@ -0,0 +1,56 @@
+import os
+import subprocess
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.staticfiles.finders import FileSystemFinder
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+TAILWIND = ['npm', 'run', 'build:css']  # see package.json
+
+
+def _size(path):
+    return os.path.getsize(path) if os.path.exists(path) else None
+
+
+def _kb(size):
+    return '-' if size is None else f"{size / 1024:.1f} KB"
+
+
+class Command(BaseCommand):
+    help = (
+        "Build production static assets: purge and minify Tailwind CSS, collect hashed and "
+        "precompressed files, and report sizes before and after."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skip-css', action='store_true', help="Do not rebuild output.css with Tailwind.")
+        parser.add_argument('--skip-collect', action='store_true', help="Only report on the last collectstatic.")
+
+    def handle(self, *args, **options):
+        ignore = apps.get_app_config('staticfiles').ignore_patterns
+        sources = {path: storage.path(path) for path, storage in FileSystemFinder().list(ignore)}
+        before = {path: _size(full) for path, full in sources.items()}
+
+        if not options['skip_css']:
+            try:
+                subprocess.run(TAILWIND, cwd=settings.BASE_DIR, check=True)
+            except (OSError, subprocess.CalledProcessError) as e:
+                raise CommandError(f"Tailwind build failed ({e}); rerun with --skip-css to keep output.css.")
+
+        if not options['skip_collect']:
+            call_command('collectstatic', interactive=False, verbosity=0)
+
+        self.stdout.write(f"{'file':<28} {'before':>10} {'built':>10} {'gzip':>10} {'brotli':>10}  served as")
+        for path in sorted(sources):
+            try:
+                served = staticfiles_storage.stored_name(path)
+            except ValueError:
+                served = path  # not in the manifest (non-hashing storage)
+            built = os.path.join(settings.STATIC_ROOT, served)
+            self.stdout.write(
+                f"{path:<28} {_kb(before[path]):>10} {_kb(_size(built)):>10} "
+                f"{_kb(_size(built + '.gz')):>10} {_kb(_size(built + '.br')):>10}  {served}"
+            )
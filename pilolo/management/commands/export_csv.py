@@ -0,0 +1,27 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from pilolo import exports
+
+
+class Command(BaseCommand):
+    help = "Stream bookings, participants (departure rosters) or payments as CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(exports.EXPORTS))
+        parser.add_argument('--from', dest='date_from', type=datetime.date.fromisoformat, help="First tour date (YYYY-MM-DD).")
+        parser.add_argument('--to', dest='date_to', type=datetime.date.fromisoformat, help="Last tour date (YYYY-MM-DD).")
+        parser.add_argument('--tour', type=int, help="Tour id.")
+        parser.add_argument('--schedule', type=int, help="Schedule id, for a single departure's roster.")
+        parser.add_argument('--output', help="Write to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        filters = {name: options[name] for name in ('date_from', 'date_to', 'tour', 'schedule') if options[name]}
+        lines = exports.stream_csv(options['kind'], **filters)
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as f:
+                f.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,25 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from pilolo import scheduling
+from pilolo.models import ScheduleRule
+
+
+class Command(BaseCommand):
+    help = "Create tour schedules from the active schedule rules, skipping dates that already exist."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', type=datetime.date.fromisoformat, help="First date (default: today).")
+        parser.add_argument('--to', dest='end', type=datetime.date.fromisoformat, help="Last date (default: a year after --from).")
+        parser.add_argument('--tour', type=int, action='append', help="Only this tour id (repeatable).")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rules = ScheduleRule.objects.filter(active=True)
+        if options['tour']:
+            rules = rules.filter(tour__in=options['tour'])
+        created = scheduling.generate_schedules(
+            rules, start=options['start'], end=options['end'], batch_size=options['batch_size']
+        )
+        self.stdout.write(self.style.SUCCESS(f"Created {len(created)} schedule(s)."))
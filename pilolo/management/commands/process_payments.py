@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from pilolo import payments
+
+
+class Command(BaseCommand):
+    help = "Settle pending Paystack payments from recorded webhooks, verifying stale ones over the API."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--once', action='store_true', help="Settle what is due and exit instead of polling.")
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds to sleep between polls.")
+
+    def handle(self, *args, **options):
+        while True:
+            settled, errors = payments.process_pending(options['batch_size'])
+            if settled or errors:
+                self.stdout.write(f"Settled {settled} payment(s), {errors} could not be verified.")
+            orphaned = payments.sweep_events()
+            if orphaned:
+                self.stderr.write(f"{orphaned} Paystack charge(s) have no payment and need a refund.")
+            if options['once']:
+                return
+            time.sleep(options['interval'])
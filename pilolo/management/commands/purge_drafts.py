@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from pilolo.drafts import purge_expired
+
+
+class Command(BaseCommand):
+    help = "Delete expired booking-wizard drafts in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        deleted = purge_expired(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Removed {deleted} expired draft(s)."))
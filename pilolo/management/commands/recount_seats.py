@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from pilolo.models import TourSchedule, confirmed_seats
+
+
+class Command(BaseCommand):
+    help = "Recompute TourSchedule.booked_count from bookings and report any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help="Only report drift, do not rewrite the counters.",
+        )
+
+    def handle(self, *args, **options):
+        drifted = (
+            TourSchedule.objects.annotate(actual=confirmed_seats())
+            .exclude(booked_count=F('actual'))
+            .values_list('id', 'booked_count', 'actual')
+        )
+
+        with transaction.atomic():
+            drift = list(drifted)
+            for schedule_id, stored, actual in drift:
+                self.stdout.write(self.style.WARNING(
+                    f"Schedule #{schedule_id}: stored {stored}, actual {actual}"
+                ))
+            if drift and not options['dry_run']:
+                TourSchedule.objects.refresh_booked_count(pk__in=[row[0] for row in drift])
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS("All seat counters are correct."))
+        elif options['dry_run']:
+            self.stdout.write(f"{len(drift)} schedule(s) drifted; run without --dry-run to fix.")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Fixed {len(drift)} schedule(s)."))
@@ -0,0 +1,134 @@
+import datetime
+import random
+import uuid
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from pilolo import search
+from pilolo.models import (
+    Booking,
+    BookingParticipant,
+    CustomUser,
+    Payment,
+    Tour,
+    TourSchedule,
+)
+
+
+class Command(BaseCommand):
+    help = "Seed the database with tours, weekend schedules, bookings, participants, payments and users."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, default=1, help="Multiply tours and users by this factor.")
+        parser.add_argument('--tours', type=int, default=10, help="Tours at scale 1.")
+        parser.add_argument('--users', type=int, default=50, help="Users at scale 1.")
+        parser.add_argument('--weeks', type=int, default=12, help="Weekends of schedules per tour (half in the past).")
+        parser.add_argument('--max-bookings', type=int, default=3, help="Most bookings per schedule.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed, for repeatable data.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        scale = options['scale']
+        run = uuid.uuid4().hex[:6]
+
+        password = make_password('pilolo-seed')
+        users = CustomUser.objects.bulk_create(
+            [
+                CustomUser(
+                    email=f"rider{n}.{run}@seed.pilolo.test",
+                    first_name='Seed',
+                    last_name=f"Rider {n}",
+                    password=password,
+                )
+                for n in range(options['users'] * scale)
+            ],
+            batch_size=batch_size,
+        )
+
+        tours = [
+            Tour(
+                name=f"Seed Tour {n} ({run})",
+                description="A guided ride through Accra's neighbourhoods.",
+                duration=rng.choice([2, 3, 4]),
+                price=Decimal(rng.choice([120, 150, 200, 250])),
+                max_participants=12,
+                highlights="Jamestown Lighthouse\nMakola Market\nIndependence Square",
+                what_included="Bike and helmet\nWater\nLocal guide",
+                what_to_bring="Comfortable shoes\nSunscreen",
+                meeting_point="Jamestown Lighthouse",
+            )
+            for n in range(options['tours'] * scale)
+        ]
+        for tour in tours:
+            tour.sync_lists()  # bulk_create skips Tour.save()
+        tours = Tour.objects.bulk_create(tours, batch_size=batch_size)
+        search.index_tours(tours)
+
+        today = timezone.localdate()
+        saturday = today + datetime.timedelta(days=(5 - today.weekday()) % 7)
+        first = saturday - datetime.timedelta(weeks=options['weeks'] // 2)
+        schedules = TourSchedule.objects.bulk_create(
+            [
+                TourSchedule(
+                    tour=tour,
+                    day=day,
+                    date=first + datetime.timedelta(weeks=week, days=offset),
+                    start_time=datetime.time(7, 0),
+                    end_time=datetime.time(7 + tour.duration, 0),
+                )
+                for tour in tours
+                for week in range(options['weeks'])
+                for offset, day in ((0, 'saturday'), (1, 'sunday'))
+            ],
+            batch_size=batch_size,
+        )
+
+        bookings = []
+        party_sizes = []
+        for schedule in schedules:
+            for _ in range(rng.randint(0, options['max_bookings'])):
+                bookings.append(Booking(
+                    user=rng.choice(users),
+                    schedule=schedule,
+                    status=rng.choices(['confirmed', 'pending', 'cancelled'], weights=[8, 1, 1])[0],
+                ))
+                party_sizes.append(rng.randint(0, 2))
+        bookings = Booking.objects.bulk_create(bookings, batch_size=batch_size)
+
+        participants = BookingParticipant.objects.bulk_create(
+            [
+                BookingParticipant(booking=booking, full_name=f"Guest {i + 1} of {booking.reference}", age=rng.randint(12, 70))
+                for booking, size in zip(bookings, party_sizes)
+                for i in range(size)
+            ],
+            batch_size=batch_size,
+        )
+
+        tour_prices = {tour.id: tour.price for tour in tours}
+        payments = Payment.objects.bulk_create(
+            [
+                Payment(
+                    booking=booking,
+                    amount=tour_prices[booking.schedule.tour_id] * (size + 1),
+                    status='completed' if booking.status == 'confirmed' else 'failed',
+                    transaction_id=f"SEED_{booking.reference}",
+                )
+                for booking, size in zip(bookings, party_sizes)
+            ],
+            batch_size=batch_size,
+        )
+
+        # bulk_create skips the signals that maintain the seat counters
+        TourSchedule.objects.refresh_booked_count(tour__in=tours)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(users)} users, {len(tours)} tours, {len(schedules)} schedules, "
+            f"{len(bookings)} bookings, {len(participants)} participants and {len(payments)} payments."
+        ))
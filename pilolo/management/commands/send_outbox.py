@@ -0,0 +1,25 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from pilolo import outbox
+
+
+class Command(BaseCommand):
+    help = "Send pending outbox emails in batches, retrying failures with exponential backoff."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--once', action='store_true', help="Drain what is due and exit instead of polling.")
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds to sleep between polls.")
+
+    def handle(self, *args, **options):
+        worker_id = uuid.uuid4().hex
+        while True:
+            sent, failed = outbox.drain(options['batch_size'], worker_id)
+            if sent or failed:
+                self.stdout.write(f"Sent {sent} email(s), {failed} failed.")
+            if options['once']:
+                return
+            time.sleep(options['interval'])
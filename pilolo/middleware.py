@@ -0,0 +1,227 @@
+import json
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import Template as DjangoTemplate
+
+from . import routers
+
+logger = logging.getLogger('pilolo.metrics')
+
+_current_metrics = ContextVar('pilolo_request_metrics', default=None)
+_original_template_render = DjangoTemplate.render
+
+
+def current_metrics():
+    """The ``RequestMetrics`` of the request being served, or None."""
+    return _current_metrics.get()
+
+
+def _record_query(execute, sql, params, many, context):
+    metrics = _current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+def _install_query_recorder(sender, connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def _timed_template_render(self, context=None, request=None):
+    metrics = _current_metrics.get()
+    if metrics is None:
+        return _original_template_render(self, context, request)
+    start = time.perf_counter()
+    try:
+        return _original_template_render(self, context, request)
+    finally:
+        metrics.template_time += time.perf_counter() - start
+
+
+class RequestMetrics:
+    """Numbers collected for a single request."""
+
+    def __init__(self):
+        self.queries = Counter()
+        # Catalog cache hits and misses, counted by pilolo.cache
+        self.cache = Counter()
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.view_start = None
+        self.view_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Called by the database execute wrapper while this request is current
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.queries[sql] += 1
+
+    @property
+    def query_count(self):
+        return sum(self.queries.values())
+
+    @property
+    def duplicate_count(self):
+        # Repeats of the same SQL with different parameters are the N+1 signature
+        return sum(count - 1 for count in self.queries.values() if count > 1)
+
+    def most_repeated(self):
+        if not self.duplicate_count:
+            return None
+        sql, count = self.queries.most_common(1)[0]
+        return {'sql': sql[:200], 'count': count}
+
+
+class RequestMetricsMiddleware:
+    """Report SQL, template and view timings per request.
+
+    Adds a ``Server-Timing`` header and logs one JSON line on the
+    ``pilolo.metrics`` logger. Enabled with ``REQUEST_METRICS_ENABLED``;
+    otherwise Django drops the middleware at startup.
+
+    ``REQUEST_METRICS_QUERY_BUDGETS`` maps URL names to the most queries a
+    view may run before a warning is logged.
+
+    Works in both sync and async chains. Queries are counted by an execute
+    wrapper installed on every connection, which follows the request through
+    ``sync_to_async`` threads via a context variable.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_METRICS_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.budgets = getattr(settings, 'REQUEST_METRICS_QUERY_BUDGETS', {})
+        DjangoTemplate.render = _timed_template_render
+        connection_created.connect(_install_query_recorder)
+        for conn in connections.all(initialized_only=True):
+            _install_query_recorder(None, conn)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            # Django would run a sync process_view in a worker thread
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics, token, start = self.begin(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_metrics.reset(token)
+        return self.report(request, response, metrics, start)
+
+    async def __acall__(self, request):
+        metrics, token, start = self.begin(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_metrics.reset(token)
+        return self.report(request, response, metrics, start)
+
+    def begin(self, request):
+        metrics = RequestMetrics()
+        request._metrics = metrics
+        return metrics, _current_metrics.set(metrics), time.perf_counter()
+
+    def report(self, request, response, metrics, start):
+        total_time = time.perf_counter() - start
+        if metrics.view_start is not None:
+            metrics.view_time = time.perf_counter() - metrics.view_start
+
+        view_name = request.resolver_match.view_name if request.resolver_match else None
+        response['Server-Timing'] = ', '.join([
+            f'db;desc="{metrics.query_count} queries, {metrics.duplicate_count} duplicate";dur={metrics.sql_time * 1000:.2f}',
+            f'tpl;dur={metrics.template_time * 1000:.2f}',
+            f'view;dur={metrics.view_time * 1000:.2f}',
+            f'total;dur={total_time * 1000:.2f}',
+        ])
+        logger.info(json.dumps({
+            'path': request.path,
+            'method': request.method,
+            'view': view_name,
+            'status': response.status_code,
+            'queries': metrics.query_count,
+            'duplicate_queries': metrics.duplicate_count,
+            'most_repeated': metrics.most_repeated(),
+            'cache_hits': metrics.cache['hits'],
+            'cache_misses': metrics.cache['misses'],
+            'sql_ms': round(metrics.sql_time * 1000, 2),
+            'template_ms': round(metrics.template_time * 1000, 2),
+            'view_ms': round(metrics.view_time * 1000, 2),
+            'total_ms': round(total_time * 1000, 2),
+        }))
+
+        budget = self.budgets.get(view_name)
+        if budget is not None and metrics.query_count > budget:
+            logger.warning(
+                f"{view_name} ran {metrics.query_count} queries, over its budget of {budget}"
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics.view_start = time.perf_counter()
+        return None
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        return self.process_view(request, view_func, view_args, view_kwargs)
+
+
+class PrimaryPinMiddleware:
+    """Pin a user to the primary database for a while after they write.
+
+    Sets the ``routers.PIN_COOKIE`` cookie after any unsafe request or any
+    ORM write, for ``REPLICA_PIN_SECONDS``. Views wrapped in
+    ``routers.replica_reads`` then read from the primary until it runs out.
+    Removed at startup when no replicas are configured.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not routers.replicas():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = routers._writes.set([])
+        try:
+            response = self.get_response(request)
+            return self.pin(request, response, routers._writes.get())
+        finally:
+            routers._writes.reset(token)
+
+    async def __acall__(self, request):
+        token = routers._writes.set([])
+        try:
+            response = await self.get_response(request)
+            return self.pin(request, response, routers._writes.get())
+        finally:
+            routers._writes.reset(token)
+
+    def pin(self, request, response, writes):
+        if writes or request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE'):
+            seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+            response.set_cookie(
+                routers.PIN_COOKIE, f'{time.time() + seconds:.3f}',
+                max_age=seconds, httponly=True, samesite='Lax',
+            )
+        return response
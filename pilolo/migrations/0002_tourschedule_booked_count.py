@@ -0,0 +1,40 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:28
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def populate_booked_count(apps, schema_editor):
+    Booking = apps.get_model('pilolo', 'Booking')
+    TourSchedule = apps.get_model('pilolo', 'TourSchedule')
+    seats = (
+        Booking.objects.filter(schedule=models.OuterRef('pk'), status='confirmed')
+        .order_by()
+        .values('schedule')
+        .annotate(seats=models.Count('id', distinct=True) + models.Count('participant_details'))
+        .values('seats')
+    )
+    TourSchedule.objects.update(
+        booked_count=Coalesce(models.Subquery(seats, output_field=models.IntegerField()), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pilolo', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tourschedule',
+            name='booked_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='tour',
+            name='duration',
+            field=models.IntegerField(default=2, help_text='Duration in hours'),
+        ),
+        migrations.RunPython(populate_booked_count, migrations.RunPython.noop),
+    ]
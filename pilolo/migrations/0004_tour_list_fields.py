@@ -0,0 +1,45 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:37
+
+from django.db import migrations, models
+
+
+def split_lines(text):
+    return [line.strip() for line in (text or '').split('\n') if line.strip()]
+
+
+def populate_lists(apps, schema_editor):
+    Tour = apps.get_model('pilolo', 'Tour')
+    tours = list(Tour.objects.all())
+    for tour in tours:
+        tour.highlights_list = split_lines(tour.highlights)
+        tour.what_included_list = split_lines(tour.what_included)
+        tour.what_to_bring_list = split_lines(tour.what_to_bring)
+    Tour.objects.bulk_update(
+        tours, ['highlights_list', 'what_included_list', 'what_to_bring_list'], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pilolo', '0003_seathold'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tour',
+            name='highlights_list',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tour',
+            name='what_included_list',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tour',
+            name='what_to_bring_list',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.RunPython(populate_lists, migrations.RunPython.noop),
+    ]
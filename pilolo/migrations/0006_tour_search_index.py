@@ -0,0 +1,51 @@
+from django.db import migrations
+
+FIELDS = ['name', 'highlights', 'meeting_point', 'description']
+
+
+def create_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    Tour = apps.get_model('pilolo', 'Tour')
+    rows = [tuple(row) for row in Tour.objects.values_list('pk', *FIELDS)]
+    with schema_editor.connection.cursor() as cursor:
+        if vendor == 'sqlite':
+            cursor.execute(
+                "CREATE VIRTUAL TABLE tour_search USING fts5("
+                "name, highlights, meeting_point, description, tokenize='unicode61 remove_diacritics 2')"
+            )
+            cursor.executemany(
+                "INSERT INTO tour_search (rowid, name, highlights, meeting_point, description) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                rows,
+            )
+        elif vendor == 'postgresql':
+            cursor.execute(
+                "CREATE TABLE tour_search ("
+                "tour_id bigint PRIMARY KEY REFERENCES tour (id) ON DELETE CASCADE, "
+                "document tsvector NOT NULL)"
+            )
+            cursor.execute("CREATE INDEX tour_search_document_idx ON tour_search USING GIN (document)")
+            cursor.executemany(
+                "INSERT INTO tour_search (tour_id, document) VALUES (%s, "
+                "setweight(to_tsvector('english', coalesce(%s, '')), 'A') || "
+                "setweight(to_tsvector('english', coalesce(%s, '')), 'B') || "
+                "setweight(to_tsvector('english', coalesce(%s, '')), 'C') || "
+                "setweight(to_tsvector('english', coalesce(%s, '')), 'D'))",
+                rows,
+            )
+
+
+def drop_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS tour_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pilolo', '0005_outboxemail'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pilolo', '0006_tour_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduleRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('days', models.JSONField(default=list)),
+                ('start_time', models.TimeField()),
+                ('end_time', models.TimeField()),
+                ('season_start', models.DateField()),
+                ('season_end', models.DateField()),
+                ('blackout_dates', models.JSONField(blank=True, default=list)),
+                ('active', models.BooleanField(default=True)),
+            ],
+            options={
+                'verbose_name': 'Schedule Rule',
+                'verbose_name_plural': 'Schedule Rules',
+                'db_table': 'schedule_rule',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='tourschedule',
+            index=models.Index(fields=['tour', 'date'], name='schedule_tour_date_idx'),
+        ),
+        migrations.AddField(
+            model_name='schedulerule',
+            name='tour',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='schedule_rules', to='pilolo.tour'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:04
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pilolo', '0007_schedulerule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookingDraft',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('data', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='booking_drafts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Booking Draft',
+                'verbose_name_plural': 'Booking Drafts',
+                'db_table': 'booking_draft',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pilolo', '0011_payment_refund_due'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentevent',
+            name='orphaned',
+            field=models.BooleanField(default=False),
+        ),
+    ]
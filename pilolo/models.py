@@ -1,9 +1,17 @@
-from django.db import models
+import logging
+import uuid
+
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
-from django.db import models
+from django.db.models.functions import Coalesce
 from django.forms import ValidationError
 from django.utils import timezone
 
+from . import references
+from .references import new_reference, new_references
+
+logger = logging.getLogger(__name__)
+
 # Create your models here.
 class UserManager(BaseUserManager):
     """Custom manager for the CustomUser model."""
@@ -48,6 +56,11 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
         db_table = 'user'
 
 
+def split_lines(text):
+    """Split a one-item-per-line text field into a list of stripped, non-empty items."""
+    return [line.strip() for line in (text or '').split('\n') if line.strip()]
+
+
 class Tour(models.Model):
     """Model representing a tour."""
     name = models.CharField(max_length=200)
@@ -60,16 +73,40 @@ class Tour(models.Model):
     what_to_bring = models.TextField()
     meeting_point = models.CharField(max_length=200)
     image = models.URLField(blank=True)
+    # Parsed one-item-per-line copies of the text fields above, refreshed on save()
+    highlights_list = models.JSONField(default=list, blank=True, editable=False)
+    what_included_list = models.JSONField(default=list, blank=True, editable=False)
+    what_to_bring_list = models.JSONField(default=list, blank=True, editable=False)
+
+    LIST_FIELDS = {
+        'highlights': 'highlights_list',
+        'what_included': 'what_included_list',
+        'what_to_bring': 'what_to_bring_list',
+    }
 
     def highlights_as_list(self):
-        return [h.strip() for h in self.highlights.split('\n') if h.strip()]
+        return self.highlights_list
 
     def what_included_as_list(self):
-        return [i.strip() for i in self.what_included.split('\n') if i.strip()]
+        return self.what_included_list
 
     def what_to_bring_as_list(self):
-        return [b.strip() for b in self.what_to_bring.split('\n') if b.strip()]
-    
+        return self.what_to_bring_list
+
+    def sync_lists(self):
+        """Refresh the parsed lists from the text fields (bulk_create skips save())."""
+        for text_field, list_field in self.LIST_FIELDS.items():
+            setattr(self, list_field, split_lines(getattr(self, text_field)))
+
+    def save(self, *args, **kwargs):
+        self.sync_lists()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {
+                list_field for text_field, list_field in self.LIST_FIELDS.items() if text_field in update_fields
+            }
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.name
     
@@ -81,6 +118,53 @@ class Tour(models.Model):
 
 
 
+def confirmed_seats():
+    """Seats taken on a schedule: one per confirmed booker plus their participants.
+
+    Meant to be evaluated against ``TourSchedule`` rows, e.g. inside ``update()``.
+    """
+    seats = (
+        Booking.objects.filter(schedule=models.OuterRef('pk'), status='confirmed')
+        .order_by()
+        .values('schedule')
+        .annotate(seats=models.Count('id', distinct=True) + models.Count('participant_details'))
+        .values('seats')
+    )
+    return Coalesce(models.Subquery(seats, output_field=models.IntegerField()), 0)
+
+
+class TourScheduleQuerySet(models.QuerySet):
+    def with_availability(self):
+        """Annotate seat availability for every schedule in one grouped query.
+
+        Adds ``seats_booked`` (bookers plus participants of confirmed bookings),
+        ``seats_remaining`` and ``fully_booked``, and joins in the tour.
+        """
+        confirmed = models.Q(bookings__status='confirmed')
+        return (
+            self.select_related('tour')
+            .annotate(
+                seats_booked=(
+                    models.Count('bookings', filter=confirmed, distinct=True)
+                    + models.Count('bookings__participant_details', filter=confirmed)
+                ),
+            )
+            .annotate(seats_remaining=models.F('tour__max_participants') - models.F('seats_booked'))
+            .annotate(
+                fully_booked=models.ExpressionWrapper(
+                    models.Q(seats_remaining__lte=0), output_field=models.BooleanField()
+                ),
+            )
+        )
+
+    def upcoming(self):
+        return self.filter(date__gte=timezone.localdate()).order_by('date', 'start_time')
+
+    def refresh_booked_count(self, **filters):
+        """Recompute the stored seat counter for the matching schedules in one UPDATE."""
+        return self.filter(**filters).update(booked_count=confirmed_seats())
+
+
 class TourSchedule(models.Model):
     """Model representing a schedule for a tour."""
     DAYS_OF_WEEK = [
@@ -93,27 +177,38 @@ class TourSchedule(models.Model):
     date = models.DateField(default=timezone.now)
     start_time = models.TimeField()
     end_time = models.TimeField()
+    # Number of booked participants (bookers included) across confirmed bookings.
+    # Kept in sync by pilolo.signals; rebuild with `manage.py recount_seats`.
+    booked_count = models.PositiveIntegerField(default=0, editable=False)
 
+    objects = TourScheduleQuerySet.as_manager()
 
-    # Count the number of booked participants for this schedule
-    @property
-    def booked_count(self):
-        confirmed_bookings = self.bookings.filter(status='confirmed')
-        participants = sum(booking.participant_details.count() for booking in confirmed_bookings)
-
-        # return participants and the booker
-        return participants + confirmed_bookings.count()
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember where the schedule was listed, so moving it to another
+        # tour or month can invalidate the old catalog pages as well.
+        instance._loaded_listing = (instance.__dict__.get('tour_id'), instance.__dict__.get('date'))
+        return instance
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_listing = (self.tour_id, self.date)
 
     # Calculate the remaining slots for this schedule
     @property
     def remaining_slots(self):
+        # Prefer the value annotated by TourScheduleQuerySet.with_availability()
+        if hasattr(self, 'seats_remaining'):
+            return self.seats_remaining
         return self.tour.max_participants - self.booked_count
 
     # Check if the schedule is fully booked
     @property
     def is_fully_booked(self):
-        return self.remaining_slots == 0
+        if hasattr(self, 'fully_booked'):
+            return self.fully_booked
+        return self.remaining_slots <= 0
 
     def __str__(self):
         return f"{self.tour.name} - {self.day} {self.start_time}"
@@ -122,13 +217,100 @@ class TourSchedule(models.Model):
         verbose_name = 'Tour Schedule'
         verbose_name_plural = 'Tour Schedules'
         db_table = 'tour_schedule'
+        indexes = [
+            models.Index(fields=['tour', 'date'], name='schedule_tour_date_idx'),
+        ]
 
 
-def unique_reference(length=12):
-    """Generate a unique reference code for bookings."""
-    import random
-    import string
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
+class ScheduleRule(models.Model):
+    """Recurring departures for a tour; `manage.py generate_schedules` turns them into schedules."""
+    tour = models.ForeignKey(Tour, on_delete=models.CASCADE, related_name='schedule_rules')
+    # Values from TourSchedule.DAYS_OF_WEEK
+    days = models.JSONField(default=list)
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+    season_start = models.DateField()
+    season_end = models.DateField()
+    # ISO dates on which the rule does not run
+    blackout_dates = models.JSONField(default=list, blank=True)
+    active = models.BooleanField(default=True)
+
+    def __str__(self):
+        return f"{self.tour.name}: {', '.join(self.days)} {self.start_time} ({self.season_start} to {self.season_end})"
+
+    def clean(self):
+        allowed = {day for day, _ in TourSchedule.DAYS_OF_WEEK}
+        if not self.days or not set(self.days) <= allowed:
+            raise ValidationError({'days': f"Choose from: {', '.join(sorted(allowed))}."})
+        if self.season_end < self.season_start:
+            raise ValidationError({'season_end': "The season cannot end before it starts."})
+        if self.end_time <= self.start_time:
+            raise ValidationError({'end_time': "The end time must be after the start time."})
+
+    class Meta:
+        verbose_name = 'Schedule Rule'
+        verbose_name_plural = 'Schedule Rules'
+        db_table = 'schedule_rule'
+
+
+def _with_fresh_references(bookings, insert):
+    """Run ``insert()``, giving ``bookings`` new references if theirs are already taken.
+
+    Generated references only collide when two processes share a worker id
+    (see ``pilolo.references``), so the next draw succeeds.
+    """
+    if not bookings:
+        return insert()
+    for attempt in range(references.ATTEMPTS):
+        try:
+            with transaction.atomic():
+                return insert()
+        except IntegrityError:
+            taken = set(
+                Booking.objects.filter(reference__in=[booking.reference for booking in bookings])
+                .values_list('reference', flat=True)
+            )
+            if not taken or attempt == references.ATTEMPTS - 1:
+                raise
+            logger.warning(f"Booking reference(s) {sorted(taken)} already taken; set BOOKING_REFERENCE_WORKER_ID per process")
+            for booking in bookings:
+                if booking.reference in taken:
+                    booking.reference = new_reference()
+
+
+class BookingQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        """Assign references (and tour dates from loaded schedules) before inserting.
+
+        ``Booking.save()`` is skipped by bulk inserts, so imports and group
+        bookings get their references here in one go.
+        """
+        objs = list(objs)
+        missing = [booking for booking in objs if not booking.reference]
+        for booking, reference in zip(missing, new_references(len(missing))):
+            booking.reference = reference
+        for booking in objs:
+            if not booking.tour_date and Booking.schedule.is_cached(booking):
+                booking.tour_date = booking.schedule.date
+        return _with_fresh_references(missing, lambda: super(BookingQuerySet, self).bulk_create(objs, *args, **kwargs))
+
+    def for_listing(self):
+        """Join schedule and tour and annotate ``participant_total`` and ``price_total``.
+
+        ``Booking.participant_count`` and ``Booking.total_price`` pick these up
+        instead of querying per row.
+        """
+        return (
+            self.select_related('schedule__tour')
+            .annotate(participant_total=models.Count('participant_details'))
+            .annotate(
+                price_total=models.ExpressionWrapper(
+                    (models.F('participant_total') + 1) * models.F('schedule__tour__price'),
+                    output_field=models.DecimalField(max_digits=10, decimal_places=2),
+                ),
+            )
+        )
+
 
 class Booking(models.Model):
     STATUS_CHOICES = [
@@ -144,15 +326,30 @@ class Booking(models.Model):
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
     special_requirements = models.TextField(blank=True)
 
+    objects = BookingQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.user.email} - {self.schedule.tour.name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what was loaded so the seat-counter signals can tell
+        # whether a save actually moved seats.
+        instance._loaded_seat_state = (instance.__dict__.get('schedule_id'), instance.__dict__.get('status'))
+        return instance
+
     @property
     def participant_count(self):
+        # Prefer the value annotated by BookingQuerySet.for_listing()
+        if hasattr(self, 'participant_total'):
+            return self.participant_total
         return self.participant_details.count()
 
     @property
     def total_price(self):
+        if hasattr(self, 'price_total'):
+            return self.price_total
         participant_and_booker_count = self.participant_count + 1  # Include the booker
         return participant_and_booker_count * self.schedule.tour.price
 
@@ -169,21 +366,26 @@ class Booking(models.Model):
         if not self.tour_date and self.schedule:
             self.tour_date = self.schedule.date
         
-        # Generate a unique reference if not already set
+        # References are unique per worker id, see pilolo.references
         if not self.reference:
-            #check if there is a booking with the same reference
-            while True:
-                self.reference = unique_reference()
-                if not Booking.objects.filter(reference=self.reference).exists():
-                    break
-
-        super().save(*args, **kwargs)
+            self.reference = new_reference()
+            _with_fresh_references([self], lambda: super(Booking, self).save(*args, **kwargs))
+        else:
+            super().save(*args, **kwargs)
+        # After the post_save handlers, which compare against the loaded state
+        self._loaded_seat_state = (self.schedule_id, self.status)
 
     class Meta:
         verbose_name = 'Booking'
         verbose_name_plural = 'Bookings'
         db_table = 'booking'
         ordering = ['-booking_date']
+        indexes = [
+            # my_bookings: a user's bookings by status, newest first
+            models.Index(fields=['user', 'status', '-booking_date'], name='booking_user_status_date_idx'),
+            # confirmed_seats(): a schedule's confirmed bookings
+            models.Index(fields=['schedule', 'status'], name='booking_schedule_status_idx'),
+        ]
 
         
 class BookingParticipant(models.Model):
@@ -193,7 +395,7 @@ class BookingParticipant(models.Model):
     notes = models.TextField(blank=True)
 
     def __str__(self):
-        return f"{self.full_name} (Booking #{self.booking.id})"
+        return f"{self.full_name} (Booking #{self.booking_id})"
     
 
     class Meta:
@@ -207,6 +409,8 @@ class Payment(models.Model):
         ('pending', 'Pending'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
+        # Charged by Paystack, but the seats were gone; refund by hand
+        ('refund_due', 'Needs refund'),
     ]
 
     booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name='payments')
@@ -216,10 +420,125 @@ class Payment(models.Model):
     transaction_id = models.CharField(max_length=100, unique=True, blank=True)
 
     def __str__(self):
-        return f"Payment for Booking #{self.booking.id} - {self.status}"
+        return f"Payment for Booking #{self.booking_id} - {self.status}"
 
     class Meta:
         verbose_name = 'Payment'
         verbose_name_plural = 'Payments'
         db_table = 'payment'
+        indexes = [
+            # payments.process_pending(): oldest pending payments first
+            models.Index(fields=['status', 'payment_date'], name='payment_status_date_idx'),
+        ]
+
+
+
+class SeatHoldQuerySet(models.QuerySet):
+    def active(self):
+        return self.filter(expires_at__gt=timezone.now())
+
+    def expired(self):
+        return self.filter(expires_at__lte=timezone.now())
+
+
+class SeatHold(models.Model):
+    """Seats set aside for a user while they go through the booking wizard."""
+    schedule = models.ForeignKey(TourSchedule, on_delete=models.CASCADE, related_name='holds')
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='seat_holds')
+    seats = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
 
+    objects = SeatHoldQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.seats} seat(s) on {self.schedule_id} for {self.user_id}"
+
+    class Meta:
+        verbose_name = 'Seat Hold'
+        verbose_name_plural = 'Seat Holds'
+        db_table = 'seat_hold'
+        constraints = [
+            models.UniqueConstraint(fields=['schedule', 'user'], name='unique_seat_hold_per_user'),
+        ]
+
+
+class BookingDraft(models.Model):
+    """Durable copy of a booking-wizard draft; the cache holds the live one (see pilolo.drafts)."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='booking_drafts')
+    data = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"Draft {self.pk} for {self.user_id}"
+
+    class Meta:
+        verbose_name = 'Booking Draft'
+        verbose_name_plural = 'Booking Drafts'
+        db_table = 'booking_draft'
+
+
+class OutboxEmail(models.Model):
+    """An email waiting to be sent by `manage.py send_outbox`."""
+    STATUS_CHOICES = [
+        ('held', 'Held'),  # waiting for the booking's payment to be verified
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('dead', 'Dead'),
+    ]
+    KIND_CHOICES = [
+        ('booking_confirmation', 'Booking confirmation'),
+    ]
+
+    kind = models.CharField(max_length=50, choices=KIND_CHOICES)
+    booking = models.ForeignKey(Booking, on_delete=models.CASCADE, null=True, blank=True, related_name='emails')
+    recipient = models.EmailField()
+    context = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=32, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.get_kind_display()} to {self.recipient} ({self.status})"
+
+    class Meta:
+        verbose_name = 'Outbox Email'
+        verbose_name_plural = 'Outbox Emails'
+        db_table = 'outbox_email'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+
+class PaymentEvent(models.Model):
+    """A signed Paystack webhook, stored once per transaction and event type."""
+    event = models.CharField(max_length=50)
+    transaction_id = models.CharField(max_length=100)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    # Paystack charged for a transaction we have no payment for; refund it
+    orphaned = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"{self.event} for {self.transaction_id}"
+
+    class Meta:
+        verbose_name = 'Payment Event'
+        verbose_name_plural = 'Payment Events'
+        db_table = 'payment_event'
+        constraints = [
+            # Paystack retries deliveries; the duplicate insert is what makes ingestion idempotent
+            models.UniqueConstraint(fields=['transaction_id', 'event'], name='payment_event_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['processed_at', 'received_at'], name='payment_event_due_idx'),
+        ]
@@ -0,0 +1,178 @@
+"""Database-backed outbox for transactional email.
+
+Views write an ``OutboxEmail`` row inside the same transaction as the change
+it reports on; ``manage.py send_outbox`` renders and sends the rows in
+batches over a single SMTP connection, retrying failures with exponential
+backoff until they are moved to the ``dead`` state.
+"""
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import Booking, OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def enqueue_booking_confirmation(booking, site_name, held=False):
+    """Queue the confirmation email; a ``held`` one waits for ``release_held``."""
+    return OutboxEmail.objects.create(
+        kind='booking_confirmation',
+        booking=booking,
+        recipient=booking.user.email,
+        context={'site_name': site_name},
+        status='held' if held else 'pending',
+    )
+
+
+def release_held(booking_id):
+    """Make the booking's held emails due now."""
+    return OutboxEmail.objects.filter(booking=booking_id, status='held').update(
+        status='pending', next_attempt_at=timezone.now()
+    )
+
+
+def render_booking_confirmation(email):
+    booking = Booking.objects.for_listing().select_related('user').get(pk=email.booking_id)
+    context = {
+        'user': booking.user,
+        'booking': booking,
+        'tour': booking.schedule.tour,
+        'schedule': booking.schedule,
+        'participants': booking.participant_details.all(),
+        'total_price': booking.total_price,
+        'site_name': email.context.get('site_name', ''),
+    }
+    message = EmailMultiAlternatives(
+        f"Your Tour Booking Confirmation - {booking.schedule.tour.name}",
+        render_to_string('emails/booking_confirmation.txt', context),
+        settings.DEFAULT_FROM_EMAIL,
+        [email.recipient],
+    )
+    message.attach_alternative(render_to_string('emails/booking_confirmation.html', context), "text/html")
+    return message
+
+
+RENDERERS = {
+    'booking_confirmation': render_booking_confirmation,
+}
+
+
+def backoff(attempts):
+    """Delay before retry number ``attempts``: base * 2**(attempts - 1), capped."""
+    base = _setting('OUTBOX_BACKOFF_BASE', 60)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), _setting('OUTBOX_MAX_BACKOFF', 3600)))
+
+
+def active_workers(now=None, exclude=None):
+    now = now or timezone.now()
+    leases = OutboxEmail.objects.filter(status='sending', locked_until__gt=now)
+    if exclude:
+        leases = leases.exclude(claimed_by=exclude)
+    return leases.values('claimed_by').distinct().count()
+
+
+def claim_batch(worker_id, batch_size):
+    """Lease up to ``batch_size`` due emails to ``worker_id``.
+
+    Returns an empty list when ``OUTBOX_MAX_WORKERS`` other workers already
+    hold leases. Rows left in ``sending`` by a crashed worker become due
+    again once their lease runs out.
+    """
+    now = timezone.now()
+    if active_workers(now, exclude=worker_id) >= _setting('OUTBOX_MAX_WORKERS', 2):
+        return []
+
+    due = (
+        Q(status='pending', next_attempt_at__lte=now)
+        | Q(status='sending', locked_until__lte=now)
+    )
+    with transaction.atomic():
+        ids = list(OutboxEmail.objects.filter(due).order_by('next_attempt_at').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return []
+        # The status filter is re-checked by the UPDATE, so two workers can
+        # never claim the same row.
+        OutboxEmail.objects.filter(due, pk__in=ids).update(
+            status='sending',
+            claimed_by=worker_id,
+            locked_until=now + timedelta(seconds=_setting('OUTBOX_LEASE', 300)),
+        )
+    return list(OutboxEmail.objects.filter(claimed_by=worker_id, status='sending', pk__in=ids))
+
+
+def _mark_failed(email, error):
+    email.attempts += 1
+    email.last_error = str(error)[:2000]
+    email.claimed_by = ''
+    email.locked_until = None
+    if email.attempts >= _setting('OUTBOX_MAX_ATTEMPTS', 6):
+        email.status = 'dead'
+        logger.error(f"Outbox email {email.pk} is dead after {email.attempts} attempts: {error}")
+    else:
+        email.status = 'pending'
+        email.next_attempt_at = timezone.now() + backoff(email.attempts)
+        logger.warning(f"Outbox email {email.pk} failed (attempt {email.attempts}), retrying: {error}")
+    email.save(update_fields=['attempts', 'last_error', 'claimed_by', 'locked_until', 'status', 'next_attempt_at'])
+
+
+def send_batch(emails):
+    """Send ``emails`` over one SMTP connection. Returns (sent, failed)."""
+    if not emails:
+        return 0, 0
+    sent = failed = 0
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as e:
+        for email in emails:
+            _mark_failed(email, e)
+        return 0, len(emails)
+
+    try:
+        for email in emails:
+            try:
+                message = RENDERERS[email.kind](email)
+                message.connection = connection
+                message.send()
+            except Exception as e:
+                _mark_failed(email, e)
+                failed += 1
+            else:
+                email.status = 'sent'
+                email.sent_at = timezone.now()
+                email.attempts += 1
+                email.claimed_by = ''
+                email.locked_until = None
+                email.save(update_fields=['status', 'sent_at', 'attempts', 'claimed_by', 'locked_until'])
+                sent += 1
+    finally:
+        connection.close()
+    return sent, failed
+
+
+def drain(batch_size=50, worker_id=None, max_batches=None):
+    """Send due emails batch by batch until none are left. Returns (sent, failed)."""
+    worker_id = worker_id or uuid.uuid4().hex
+    totals = [0, 0]
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        emails = claim_batch(worker_id, batch_size)
+        if not emails:
+            break
+        sent, failed = send_batch(emails)
+        totals[0] += sent
+        totals[1] += failed
+        batches += 1
+    return tuple(totals)
@@ -0,0 +1,93 @@
+"""Keyset ("cursor") pagination.
+
+Pages are fetched with ``WHERE (a, b) > (last_a, last_b) ORDER BY a, b
+LIMIT n + 1`` instead of ``OFFSET``/``COUNT(*)``, so every page costs the same
+however deep it is. The last row's sort values travel to the client as a
+signed, opaque cursor.
+"""
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+SALT = 'pilolo.pagination'
+
+
+class CursorPage:
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+
+class CursorPaginator:
+    """Paginate ``queryset`` on ``ordering``, which must end in a unique field.
+
+    ``ordering`` uses ``order_by`` syntax, e.g. ``('-booking_date', '-id')``.
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset.order_by(*ordering)
+        self.ordering = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+        self.per_page = per_page
+
+    def _field(self, name):
+        return self.queryset.model._meta.get_field(name)
+
+    def encode(self, obj):
+        values = [self._field(name).value_to_string(obj) for name, _ in self.ordering]
+        return signing.dumps(values, salt=SALT, compress=True)
+
+    def decode(self, cursor):
+        """Return the sort values stored in ``cursor``, or None if it is missing or invalid."""
+        if not cursor:
+            return None
+        try:
+            values = signing.loads(cursor, salt=SALT)
+            if len(values) != len(self.ordering):
+                return None
+            return [self._field(name).to_python(value) for (name, _), value in zip(self.ordering, values)]
+        except (signing.BadSignature, ValidationError, TypeError, ValueError):
+            return None
+
+    def _after(self, values):
+        # (a, b, c) after (x, y, z) == a > x OR (a = x AND b > y) OR ...
+        condition = Q()
+        for i, (name, descending) in enumerate(self.ordering):
+            step = Q(**{f'{name}__{"lt" if descending else "gt"}': values[i]})
+            for (prior, _), value in zip(self.ordering[:i], values):
+                step &= Q(**{prior: value})
+            condition |= step
+        return condition
+
+    def _after_cursor(self, cursor):
+        values = self.decode(cursor)
+        queryset = self.queryset if values is None else self.queryset.filter(self._after(values))
+        return queryset[:self.per_page + 1]
+
+    def _page(self, rows):
+        if len(rows) > self.per_page:
+            rows = rows[:self.per_page]
+            return CursorPage(rows, self.encode(rows[-1]))
+        return CursorPage(rows, None)
+
+    def page(self, cursor=None):
+        """Return the page after ``cursor``; an invalid cursor gives the first page."""
+        return self._page(list(self._after_cursor(cursor)))
+
+    async def apage(self, cursor=None):
+        return self._page([row async for row in self._after_cursor(cursor)])
@@ -0,0 +1,211 @@
+"""Paystack payment verification and webhook ingestion.
+
+Checkout never talks to Paystack: ``services.commit_booking`` stores the
+payment as ``pending`` and holds the confirmation email. Paystack's signed
+``charge.success`` webhook is recorded once per transaction in
+``PaymentEvent``, and ``manage.py process_payments`` settles pending
+payments from those events, or by asking Paystack's verify endpoint when no
+webhook has arrived after ``PAYSTACK_VERIFY_AFTER`` seconds. ``sweep_events``
+closes webhooks that no pending payment will consume and flags charges we
+have no payment for at all.
+
+All API calls share one ``requests.Session`` so connections to Paystack are
+pooled and reused, and every call has a connect and read timeout.
+"""
+import hashlib
+import hmac
+import logging
+import threading
+from datetime import timedelta
+from urllib.parse import quote
+
+import requests
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import outbox, services
+from .models import Booking, Payment, PaymentEvent
+
+logger = logging.getLogger(__name__)
+
+HANDLED_EVENTS = {'charge.success'}
+# Paystack statuses that may still turn into a success
+UNSETTLED = {'ongoing', 'pending', 'processing', 'queued'}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class PaystackError(Exception):
+    """Raised when Paystack cannot be reached or gives an unusable answer."""
+
+
+def session():
+    """The process-wide HTTP session used for every Paystack call."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                # Only connection failures and gateway errors are retried;
+                # a read timeout is reported rather than doubled.
+                retry = Retry(
+                    total=2, connect=2, read=0, status=2, backoff_factor=0.2,
+                    status_forcelist=(502, 503, 504), allowed_methods=frozenset({'GET'}), raise_on_status=False,
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=1, pool_maxsize=getattr(settings, 'PAYSTACK_POOL_SIZE', 10), max_retries=retry
+                )
+                http = requests.Session()
+                http.mount('https://', adapter)
+                http.mount('http://', adapter)
+                http.headers.update({'Accept': 'application/json'})
+                _session = http
+    return _session
+
+
+def verify_transaction(reference):
+    """Return Paystack's ``data`` for ``reference``.
+
+    An unknown reference comes back as ``{'status': 'not_found'}``; network
+    errors, timeouts and other error responses raise ``PaystackError``.
+    """
+    url = f"{settings.PAYSTACK_BASE_URL.rstrip('/')}/transaction/verify/{quote(reference, safe='')}"
+    try:
+        response = session().get(
+            url,
+            headers={'Authorization': f'Bearer {settings.PAYSTACK_API_SECRET_KEY}'},
+            timeout=settings.PAYSTACK_TIMEOUT,
+        )
+        body = response.json()
+    except (requests.RequestException, ValueError) as e:
+        raise PaystackError(f"Could not verify {reference}: {e}") from e
+    if not isinstance(body, dict):
+        raise PaystackError(f"Paystack answered {response.status_code} for {reference} with an unexpected body")
+    if response.status_code in (400, 404) and body.get('status') is False:
+        return {'status': 'not_found', 'reference': reference}
+    if response.status_code != 200 or not body.get('status') or not isinstance(body.get('data'), dict):
+        raise PaystackError(f"Paystack answered {response.status_code} for {reference}: {body.get('message', '')}")
+    return body['data']
+
+
+def valid_signature(body, signature):
+    """Check the ``X-Paystack-Signature`` header: HMAC-SHA512 of the raw body with the secret key."""
+    secret = settings.PAYSTACK_API_SECRET_KEY
+    if not secret or not signature:
+        return False
+    expected = hmac.new(secret.encode(), body, hashlib.sha512).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def record_event(payload):
+    """Store a webhook payload; returns False if this delivery was already recorded."""
+    event = payload['event']
+    reference = str(payload['data']['reference'])
+    try:
+        with transaction.atomic():
+            PaymentEvent.objects.create(
+                event=event,
+                transaction_id=reference,
+                payload=payload,
+                # Events we do not act on are kept for the record only
+                processed_at=None if event in HANDLED_EVENTS else timezone.now(),
+            )
+    except IntegrityError:
+        return False
+    return True
+
+
+def _paid_in_full(payment, data):
+    # Paystack amounts are in the currency's subunit (pesewas)
+    return (
+        data.get('currency') == settings.PAYSTACK_CURRENCY
+        and int(data.get('amount') or 0) >= int(payment.amount * 100)
+    )
+
+
+@transaction.atomic
+def settle(payment_id, data):
+    """Apply a Paystack transaction to a pending payment.
+
+    A full successful charge completes the payment and releases its
+    confirmation email. Anything else that is final fails the payment and
+    cancels the booking, freeing its seats. Returns the new status, or None
+    if the payment was not pending or Paystack has not finished.
+    """
+    payment = Payment.objects.select_for_update().filter(pk=payment_id, status='pending').first()
+    if payment is None or data.get('status') in UNSETTLED:
+        return None
+    if data.get('status') == 'success' and _paid_in_full(payment, data):
+        payment.status = 'completed'
+        payment.save(update_fields=['status'])
+        outbox.release_held(payment.booking_id)
+    else:
+        logger.warning(f"Payment {payment.transaction_id} failed verification: {data.get('status')}")
+        payment.status = 'failed'
+        payment.save(update_fields=['status'])
+        payment.booking.emails.filter(status='held').delete()
+        services.cancel_bookings(Booking.objects.filter(pk=payment.booking_id))
+    return payment.status
+
+
+def process_pending(batch_size=50):
+    """Settle up to ``batch_size`` pending payments; returns ``(settled, errors)``.
+
+    Payments with a recorded webhook are settled from it without calling
+    Paystack. The rest are verified over the API once they are older than
+    ``PAYSTACK_VERIFY_AFTER`` seconds.
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=getattr(settings, 'PAYSTACK_VERIFY_AFTER', 60))
+    due_events = PaymentEvent.objects.filter(event__in=HANDLED_EVENTS, processed_at=None)
+    payments = list(
+        Payment.objects.filter(status='pending')
+        .filter(Q(transaction_id__in=due_events.values('transaction_id')) | Q(payment_date__lte=cutoff))
+        .order_by('payment_date')[:batch_size]
+    )
+    events = {
+        event.transaction_id: event
+        for event in due_events.filter(transaction_id__in=[payment.transaction_id for payment in payments])
+    }
+
+    settled = errors = 0
+    for payment in payments:
+        event = events.get(payment.transaction_id)
+        if event is not None:
+            data = event.payload['data']
+        else:
+            try:
+                data = verify_transaction(payment.transaction_id)
+            except PaystackError as e:
+                logger.warning(str(e))
+                errors += 1
+                continue
+        if settle(payment.pk, data):
+            settled += 1
+        if event is not None:
+            PaymentEvent.objects.filter(pk=event.pk).update(processed_at=now)
+    return settled, errors
+
+
+def sweep_events():
+    """Close webhook events that will never settle a payment; returns the number orphaned.
+
+    Events for payments that are no longer pending (verified over the API
+    first, or kept for a refund) are marked processed. A charge with no
+    payment at all after ``PAYSTACK_ORPHAN_AFTER`` seconds is flagged as
+    orphaned and logged as an error so it can be refunded.
+    """
+    now = timezone.now()
+    due = PaymentEvent.objects.filter(event__in=HANDLED_EVENTS, processed_at=None)
+    known = Payment.objects.values('transaction_id')
+    due.filter(transaction_id__in=known.exclude(status='pending')).update(processed_at=now)
+
+    cutoff = now - timedelta(seconds=getattr(settings, 'PAYSTACK_ORPHAN_AFTER', 15 * 60))
+    orphans = list(due.filter(received_at__lte=cutoff).exclude(transaction_id__in=known))
+    for event in orphans:
+        logger.error(f"Paystack charge {event.transaction_id} has no payment; it needs a refund")
+    return PaymentEvent.objects.filter(pk__in=[event.pk for event in orphans]).update(processed_at=now, orphaned=True)
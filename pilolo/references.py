@@ -0,0 +1,153 @@
+"""Booking reference codes that are unique by construction.
+
+A reference is 12 uppercase base-36 characters: 11 characters encoding
+``(milliseconds since 2025-01-01, worker id, sequence)`` followed by one
+check character. Two references can only be equal if the same worker id
+was used in the same millisecond with the same sequence number. One
+generator never does that, so no database lookup is needed.
+
+The 56-bit value is passed through a keyed permutation (a Feistel network
+over HMAC-SHA256, keyed by ``BOOKING_REFERENCE_KEY`` or ``SECRET_KEY``)
+before it is encoded. A permutation keeps values distinct, but consecutive
+references no longer share a prefix and do not reveal when they were issued.
+
+Distinct processes are only guaranteed distinct references if each has its
+own worker id: set ``BOOKING_REFERENCE_WORKER_ID`` (0-63) per process or
+host. The default, the low bits of the process id, can repeat between
+processes; ``Booking`` inserts then draw a new reference when they hit the
+unique constraint.
+"""
+import hashlib
+import hmac
+import os
+import string
+import threading
+import time
+
+from django.conf import settings
+
+ALPHABET = string.digits + string.ascii_uppercase
+LENGTH = 12
+
+EPOCH_MS = 1735689600000  # 2025-01-01T00:00:00Z
+WORKER_BITS = 6
+SEQUENCE_BITS = 9
+MAX_WORKER = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+# 41 bits of milliseconds (about 69 years) plus worker id and sequence; 36**11 > 2**56
+PAYLOAD_BITS = 56
+HALF_BITS = PAYLOAD_BITS // 2
+HALF_MASK = (1 << HALF_BITS) - 1
+ROUNDS = 4
+# Draws of a reference before an insert that keeps colliding gives up
+ATTEMPTS = 3
+
+
+def _encode(number, width):
+    chars = []
+    while number:
+        number, digit = divmod(number, 36)
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars)).rjust(width, '0')
+
+
+def check_character(payload):
+    """ISO 7064 MOD 37,36 check character; catches every single-character error."""
+    product = 36
+    for char in payload:
+        total = (product + ALPHABET.index(char)) % 36 or 36
+        product = (total * 2) % 37
+    return ALPHABET[(37 - product) % 36]
+
+
+def _key():
+    secret = getattr(settings, 'BOOKING_REFERENCE_KEY', None) or settings.SECRET_KEY
+    return hashlib.sha256(b'pilolo.references:' + secret.encode()).digest()
+
+
+def _round(key, number, half):
+    digest = hmac.new(key, bytes([number]) + half.to_bytes(4, 'big'), hashlib.sha256).digest()
+    return int.from_bytes(digest[:4], 'big') & HALF_MASK
+
+
+def scramble(value, key):
+    """Keyed permutation of 56-bit integers."""
+    left, right = value >> HALF_BITS, value & HALF_MASK
+    for number in range(ROUNDS):
+        left, right = right, left ^ _round(key, number, right)
+    return (left << HALF_BITS) | right
+
+
+def unscramble(value, key):
+    """Inverse of ``scramble``, for support staff decoding when a reference was issued."""
+    left, right = value >> HALF_BITS, value & HALF_MASK
+    for number in reversed(range(ROUNDS)):
+        left, right = right ^ _round(key, number, left), left
+    return (left << HALF_BITS) | right
+
+
+def is_valid(reference):
+    return (
+        len(reference) == LENGTH
+        and all(char in ALPHABET for char in reference)
+        and check_character(reference[:-1]) == reference[-1]
+    )
+
+
+class ReferenceGenerator:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._last_ms = -1
+        self._sequence = 0
+
+    def _worker_id(self):
+        worker = getattr(settings, 'BOOKING_REFERENCE_WORKER_ID', None)
+        if worker is None:
+            worker = os.getpid()
+        return int(worker) & MAX_WORKER
+
+    def _next_slot(self):
+        # Caller holds the lock. Sequence state is reset after a fork so
+        # child processes never continue their parent's sequence.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._last_ms = -1
+            self._sequence = 0
+
+        now_ms = int(time.time() * 1000) - EPOCH_MS
+        if now_ms > self._last_ms:
+            self._last_ms = now_ms
+            self._sequence = 0
+        else:
+            # Same millisecond, or the clock went backwards: keep counting
+            # from the last millisecond we used and borrow the next one when
+            # the sequence runs out.
+            self._sequence += 1
+            if self._sequence > MAX_SEQUENCE:
+                self._last_ms += 1
+                self._sequence = 0
+        return self._last_ms, self._sequence
+
+    def generate(self, count=1):
+        with self._lock:
+            worker = self._worker_id()
+            slots = [self._next_slot() for _ in range(count)]
+        key = _key()
+        references = []
+        for ms, sequence in slots:
+            value = ((((ms << WORKER_BITS) | worker) << SEQUENCE_BITS) | sequence) & ((1 << PAYLOAD_BITS) - 1)
+            payload = _encode(scramble(value, key), LENGTH - 1)
+            references.append(payload + check_character(payload))
+        return references
+
+
+_generator = ReferenceGenerator()
+
+
+def new_reference():
+    return _generator.generate()[0]
+
+
+def new_references(count):
+    return _generator.generate(count)
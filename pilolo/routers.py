@@ -0,0 +1,90 @@
+"""Route reads from read-only views to replica databases.
+
+Views wrapped in ``replica_reads`` send their ORM reads to one of the
+aliases in ``DATABASE_REPLICAS``; everything else, and every write, uses
+``default``. Sessions and the database cache table always stay on the
+primary, so a fresh login or cache write is never missed, and cache writes
+do not count as the user writing.
+
+A user who has just written is pinned to the primary for
+``REPLICA_PIN_SECONDS`` by ``middleware.PrimaryPinMiddleware`` (a cookie set
+after any unsafe request or ORM write), so their new booking shows up on the
+next page even if the replicas are behind.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+PIN_COOKIE = 'pilolo_primary'
+PRIMARY_ONLY_APPS = {'sessions', 'django_cache'}
+
+_replica_reads = ContextVar('pilolo_replica_reads', default=False)
+# Set per request by PrimaryPinMiddleware; records whether the request wrote
+_writes = ContextVar('pilolo_db_writes', default=None)
+
+
+def replicas():
+    return list(getattr(settings, 'DATABASE_REPLICAS', []))
+
+
+def is_pinned(request):
+    """True while the request carries an unexpired primary pin."""
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+@contextmanager
+def _reading(enabled):
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def primary():
+    """Read from the primary inside this block, even within a replica view."""
+    return _reading(False)
+
+
+def replica_reads(view):
+    """Let ``view``'s reads go to a replica unless the user is pinned to the primary."""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            with _reading(not is_pinned(request)):
+                return await view(request, *args, **kwargs)
+    else:
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            with _reading(not is_pinned(request)):
+                return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get() or model._meta.app_label in PRIMARY_ONLY_APPS:
+            return None
+        aliases = replicas()
+        return random.choice(aliases) if aliases else None
+
+    def db_for_write(self, model, **hints):
+        writes = _writes.get()
+        if writes is not None and model._meta.app_label not in PRIMARY_ONLY_APPS:
+            writes.append(model._meta.label)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {'default', *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
@@ -0,0 +1,70 @@
+"""Generate tour schedules from recurring ``ScheduleRule`` rows.
+
+Existing schedules are read once per run and matching dates are skipped, so
+generating the same window twice is harmless. New rows go in with
+``bulk_create``, which skips the model signals; the catalog cache is bumped
+here instead.
+"""
+import calendar
+import datetime
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import cache as catalog_cache
+from .models import ScheduleRule, TourSchedule
+
+WEEKDAYS = {name.lower(): number for number, name in enumerate(calendar.day_name)}
+
+
+def rule_dates(rule, start, end):
+    """Dates in ``[start, end]`` on which ``rule`` runs."""
+    first = max(rule.season_start, start)
+    last = min(rule.season_end, end)
+    weekdays = {WEEKDAYS[day] for day in rule.days}
+    blackouts = {datetime.date.fromisoformat(day) for day in rule.blackout_dates}
+    day = first
+    while day <= last:
+        if day.weekday() in weekdays and day not in blackouts:
+            yield day
+        day += datetime.timedelta(days=1)
+
+
+@transaction.atomic
+def generate_schedules(rules=None, start=None, end=None, batch_size=1000):
+    """Create the schedules ``rules`` call for between ``start`` and ``end``.
+
+    Defaults to every active rule and the year from today. Returns the
+    created schedules.
+    """
+    rules = list(ScheduleRule.objects.filter(active=True) if rules is None else rules)
+    start = start or timezone.localdate()
+    end = end or start + datetime.timedelta(days=365)
+    if not rules:
+        return []
+
+    existing = set(
+        TourSchedule.objects.filter(tour__in={rule.tour_id for rule in rules}, date__range=(start, end))
+        .values_list('tour_id', 'date', 'start_time')
+    )
+    new = []
+    for rule in rules:
+        for day in rule_dates(rule, start, end):
+            key = (rule.tour_id, day, rule.start_time)
+            if key in existing:
+                continue
+            existing.add(key)
+            new.append(TourSchedule(
+                tour_id=rule.tour_id,
+                day=calendar.day_name[day.weekday()].lower(),
+                date=day,
+                start_time=rule.start_time,
+                end_time=rule.end_time,
+            ))
+
+    created = TourSchedule.objects.bulk_create(new, batch_size=batch_size)
+    catalog_cache.bump_on_commit(
+        *{catalog_cache.tour_scope(s.tour_id) for s in created},
+        *{catalog_cache.month_scope(s.date) for s in created},
+    )
+    return created
@@ -0,0 +1,144 @@
+"""Ranked full-text search over tours.
+
+The index lives in a ``tour_search`` table next to ``tour`` (created by
+migration 0006): an FTS5 virtual table on SQLite and a ``tsvector`` column
+with a GIN index on PostgreSQL.
+Both sit behind the same three calls: ``index_tours``, ``remove_tours`` and
+``search``. Signals keep the index in sync; ``manage.py rebuild_search_index``
+rebuilds it from scratch.
+"""
+import re
+
+from django.db import connection, connections, router
+
+from .models import Tour
+
+TABLE = 'tour_search'
+INDEXED_FIELDS = ['name', 'highlights', 'meeting_point', 'description']
+
+
+def _terms(query):
+    # Only word characters reach the database, so user input can never
+    # inject FTS or tsquery operators.
+    return re.findall(r'\w+', query.lower())[:10]
+
+
+class SQLiteBackend:
+    # Column weights for bm25(), in INDEXED_FIELDS order
+    WEIGHTS = (10.0, 4.0, 2.0, 1.0)
+
+    def index(self, cursor, rows):
+        cursor.executemany(f"DELETE FROM {TABLE} WHERE rowid = %s", [(row[0],) for row in rows])
+        cursor.executemany(
+            f"INSERT INTO {TABLE} (rowid, {', '.join(INDEXED_FIELDS)}) VALUES (%s, %s, %s, %s, %s)", rows
+        )
+
+    def remove(self, cursor, tour_ids):
+        cursor.executemany(f"DELETE FROM {TABLE} WHERE rowid = %s", [(tour_id,) for tour_id in tour_ids])
+
+    def clear(self, cursor):
+        cursor.execute(f"DELETE FROM {TABLE}")
+
+    def search(self, cursor, terms, limit):
+        # Every term must match; each one is a prefix so typeahead works
+        # mid-word. The table has no stemmer because Porter would rewrite
+        # partial words ("kay" -> "kai") and miss them; prefixes cover plurals.
+        match = ' '.join(f'"{term}"*' for term in terms)
+        cursor.execute(
+            f"SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s "
+            f"ORDER BY bm25({TABLE}, {', '.join(map(str, self.WEIGHTS))}) LIMIT %s",
+            [match, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresBackend:
+    WEIGHTS = ('A', 'B', 'C', 'D')  # in INDEXED_FIELDS order
+
+    def index(self, cursor, rows):
+        document = ' || '.join(
+            f"setweight(to_tsvector('english', coalesce(%s, '')), '{weight}')" for weight in self.WEIGHTS
+        )
+        cursor.executemany(
+            f"INSERT INTO {TABLE} (tour_id, document) VALUES (%s, {document}) "
+            f"ON CONFLICT (tour_id) DO UPDATE SET document = EXCLUDED.document",
+            rows,
+        )
+
+    def remove(self, cursor, tour_ids):
+        cursor.execute(f"DELETE FROM {TABLE} WHERE tour_id = ANY(%s)", [list(tour_ids)])
+
+    def clear(self, cursor):
+        cursor.execute(f"TRUNCATE {TABLE}")
+
+    def search(self, cursor, terms, limit):
+        cursor.execute(
+            f"SELECT tour_id FROM {TABLE}, to_tsquery('english', %s) query "
+            f"WHERE document @@ query ORDER BY ts_rank_cd(document, query) DESC, tour_id LIMIT %s",
+            [' & '.join(f'{term}:*' for term in terms), limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+BACKENDS = {
+    'sqlite': SQLiteBackend,
+    'postgresql': PostgresBackend,
+}
+
+
+def get_backend(conn=None):
+    conn = conn or connection
+    return BACKENDS[conn.vendor]()
+
+
+def _rows(tours):
+    return [(tour.pk, *(getattr(tour, field) for field in INDEXED_FIELDS)) for tour in tours]
+
+
+def index_tours(tours):
+    rows = _rows(tours)
+    if rows:
+        with connection.cursor() as cursor:
+            get_backend().index(cursor, rows)
+
+
+def remove_tours(tour_ids):
+    if tour_ids:
+        with connection.cursor() as cursor:
+            get_backend().remove(cursor, tour_ids)
+
+
+def rebuild(chunk_size=500):
+    """Re-index every tour, reading them in chunks. Returns the number indexed."""
+    backend = get_backend()
+    count = 0
+    with connection.cursor() as cursor:
+        backend.clear(cursor)
+        chunk = []
+        for tour in Tour.objects.only('pk', *INDEXED_FIELDS).iterator(chunk_size=chunk_size):
+            chunk.append(tour)
+            if len(chunk) == chunk_size:
+                backend.index(cursor, _rows(chunk))
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            backend.index(cursor, _rows(chunk))
+            count += len(chunk)
+    return count
+
+
+def search(query, limit=50):
+    """Return the ids of tours matching ``query``, best match first."""
+    terms = _terms(query)
+    if not terms:
+        return []
+    conn = connections[router.db_for_read(Tour)]
+    with conn.cursor() as cursor:
+        return get_backend(conn).search(cursor, terms, limit)
+
+
+def search_tours(query, limit=50):
+    """Like ``search`` but returns ``Tour`` objects in rank order."""
+    ids = search(query, limit)
+    tours = Tour.objects.in_bulk(ids)
+    return [tours[tour_id] for tour_id in ids if tour_id in tours]
@@ -0,0 +1,132 @@
+"""Write paths shared by the views and any future API or importer."""
+from django.db import transaction
+
+from . import cache as catalog_cache, holds, outbox
+from .models import Booking, BookingParticipant, Payment, SeatHold, TourSchedule
+
+
+@holds.retry_when_locked
+@transaction.atomic
+def commit_booking(user, schedule_id, participants, special_requirements='',
+                   transaction_reference=None, site_name=''):
+    """Create a confirmed booking with its participants and payment in one transaction.
+
+    ``participants`` is a list of dicts with ``full_name``, ``age`` and
+    ``notes``. Seats are re-checked under the schedule lock (raising
+    ``holds.SeatsUnavailable``) and the user's seat hold is released. The
+    number of queries does not depend on the number of participants.
+    A write that finds SQLite locked is retried from the start.
+
+    The payment is always stored as pending and the confirmation email held
+    until ``payments`` has checked the transaction with Paystack, which
+    cancels the booking if it was not paid.
+    """
+    schedule = holds.claim_seats(schedule_id, user, len(participants) + 1)
+
+    # Bulk inserts skip the per-row signals, so the seat counter and the
+    # catalog cache are refreshed once below instead of once per row.
+    booking, = Booking.objects.bulk_create([Booking(
+        user=user,
+        schedule=schedule,
+        tour_date=schedule.date,
+        special_requirements=special_requirements,
+        status='confirmed',
+    )])
+    BookingParticipant.objects.bulk_create([
+        BookingParticipant(
+            booking=booking,
+            full_name=p['full_name'],
+            age=p['age'] if p['age'] else None,
+            notes=p['notes'],
+        )
+        for p in participants
+    ])
+    TourSchedule.objects.refresh_booked_count(pk=schedule.pk)
+    catalog_cache.bump_on_commit(catalog_cache.tour_scope(schedule.tour_id), catalog_cache.month_scope(schedule.date))
+
+    Payment.objects.create(
+        booking=booking,
+        amount=schedule.tour.price * (len(participants) + 1),
+        status='pending',
+        # transaction_id is unique and not nullable; fall back to our reference
+        transaction_id=transaction_reference or booking.reference,
+    )
+
+    outbox.enqueue_booking_confirmation(booking, site_name, held=True)
+    return booking
+
+
+@holds.retry_when_locked
+@transaction.atomic
+def record_refund_due(user, schedule_id, participants, special_requirements='', transaction_reference=None):
+    """Keep a paid checkout whose seats were gone as a cancelled booking with a ``refund_due`` payment.
+
+    Called after ``commit_booking`` raised ``holds.SeatsUnavailable`` for a
+    payment Paystack already took, so staff have a record to refund from.
+    """
+    schedule = TourSchedule.objects.select_related('tour').get(pk=schedule_id)
+    booking, = Booking.objects.bulk_create([Booking(
+        user=user,
+        schedule=schedule,
+        tour_date=schedule.date,
+        special_requirements=special_requirements,
+        status='cancelled',
+    )])
+    BookingParticipant.objects.bulk_create([
+        BookingParticipant(booking=booking, full_name=p['full_name'], age=p['age'] if p['age'] else None, notes=p['notes'])
+        for p in participants
+    ])
+    Payment.objects.create(
+        booking=booking,
+        amount=schedule.tour.price * (len(participants) + 1),
+        status='refund_due',
+        transaction_id=transaction_reference or booking.reference,
+    )
+    SeatHold.objects.filter(schedule=schedule, user=user).delete()
+    return booking
+
+
+def _update_bookings(bookings, extra_schedule_ids=(), **changes):
+    """Apply ``changes`` to ``bookings`` in one UPDATE and recount seats once per schedule.
+
+    Raises ``holds.SeatsUnavailable`` (rolling everything back) if a schedule
+    gains seats beyond what the tour allows.
+    """
+    with transaction.atomic():
+        booking_ids = list(bookings.values_list('pk', flat=True))
+        schedule_ids = set(
+            Booking.objects.filter(pk__in=booking_ids).values_list('schedule_id', flat=True).distinct()
+        ) | set(extra_schedule_ids)
+        before = {schedule.pk: schedule.booked_count for schedule in holds.lock_schedules(schedule_ids)}
+
+        updated = Booking.objects.filter(pk__in=booking_ids).update(**changes)
+        TourSchedule.objects.refresh_booked_count(pk__in=schedule_ids)
+
+        scopes = set()
+        after = TourSchedule.objects.filter(pk__in=schedule_ids).values_list(
+            'pk', 'tour_id', 'date', 'booked_count', 'tour__max_participants'
+        )
+        for pk, tour_id, date, booked, capacity in after:
+            if booked > capacity and booked > before[pk]:
+                raise holds.SeatsUnavailable(capacity - before[pk])
+            scopes.update([catalog_cache.tour_scope(tour_id), catalog_cache.month_scope(date)])
+        catalog_cache.bump_on_commit(*scopes)
+    return updated
+
+
+def confirm_bookings(bookings):
+    """Confirm every booking in the queryset that is not already confirmed."""
+    return _update_bookings(bookings.exclude(status='confirmed'), status='confirmed')
+
+
+def cancel_bookings(bookings):
+    """Cancel every booking in the queryset that is not already cancelled."""
+    return _update_bookings(bookings.exclude(status='cancelled'), status='cancelled')
+
+
+def move_bookings(bookings, schedule):
+    """Move bookings to ``schedule``, updating their tour date."""
+    return _update_bookings(
+        bookings.exclude(schedule=schedule), extra_schedule_ids=[schedule.pk],
+        schedule=schedule, tour_date=schedule.date,
+    )
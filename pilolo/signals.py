@@ -0,0 +1,93 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import cache as catalog_cache, search
+from .models import Booking, BookingParticipant, Tour, TourSchedule
+
+
+# Keep TourSchedule.booked_count in step with bookings. Each handler issues a
+# single UPDATE that recomputes the counter from the booking tables, so the
+# write is atomic and concurrent saves cannot leave it drifting.
+
+@receiver(post_save, sender=Booking)
+def booking_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    loaded_schedule_id, loaded_status = getattr(instance, '_loaded_seat_state', (None, None))
+    if created and instance.status != 'confirmed':
+        return
+    if not created and (loaded_schedule_id, loaded_status) == (instance.schedule_id, instance.status):
+        return
+
+    schedule_ids = {instance.schedule_id, loaded_schedule_id} - {None}
+    TourSchedule.objects.refresh_booked_count(pk__in=schedule_ids)
+
+
+@receiver(post_delete, sender=Booking)
+def booking_deleted(sender, instance, **kwargs):
+    TourSchedule.objects.refresh_booked_count(pk=instance.schedule_id)
+
+
+@receiver(post_save, sender=BookingParticipant)
+def participant_saved(sender, instance, created, raw=False, **kwargs):
+    if raw or not created:
+        return
+    TourSchedule.objects.refresh_booked_count(bookings=instance.booking_id)
+
+
+@receiver(post_delete, sender=BookingParticipant)
+def participant_deleted(sender, instance, **kwargs):
+    TourSchedule.objects.refresh_booked_count(bookings=instance.booking_id)
+
+
+# Catalog cache invalidation: bump only the versions a write can affect.
+
+@receiver(post_save, sender=Tour)
+@receiver(post_delete, sender=Tour)
+def tour_changed(sender, instance, **kwargs):
+    catalog_cache.bump_on_commit(catalog_cache.CATALOG, catalog_cache.tour_scope(instance.pk))
+
+
+@receiver(post_save, sender=TourSchedule)
+@receiver(post_delete, sender=TourSchedule)
+def schedule_changed(sender, instance, **kwargs):
+    listings = {(instance.tour_id, instance.date), getattr(instance, '_loaded_listing', (None, None))}
+    catalog_cache.bump_on_commit(*_schedule_scopes(listing for listing in listings if None not in listing))
+
+
+def _schedule_scopes(schedules):
+    # Seat changes show up on the tour's pages and in the month's calendar
+    for tour_id, date in schedules:
+        yield catalog_cache.tour_scope(tour_id)
+        yield catalog_cache.month_scope(date)
+
+
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+def booking_changed(sender, instance, **kwargs):
+    # A moved booking frees seats on the schedule it was loaded with, and the
+    # counter UPDATE above fires no TourSchedule signal for it.
+    loaded_schedule_id, _ = getattr(instance, '_loaded_seat_state', (None, None))
+    schedule_ids = {instance.schedule_id, loaded_schedule_id} - {None}
+    schedules = TourSchedule.objects.filter(pk__in=schedule_ids).values_list('tour_id', 'date')
+    catalog_cache.bump_on_commit(*_schedule_scopes(schedules))
+
+
+@receiver(post_save, sender=BookingParticipant)
+@receiver(post_delete, sender=BookingParticipant)
+def participant_changed(sender, instance, **kwargs):
+    schedules = TourSchedule.objects.filter(bookings=instance.booking_id).values_list('tour_id', 'date')
+    catalog_cache.bump_on_commit(*_schedule_scopes(schedules))
+
+
+# Full-text search index
+
+@receiver(post_save, sender=Tour)
+def tour_saved_index(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_tours([instance])
+
+
+@receiver(post_delete, sender=Tour)
+def tour_deleted_index(sender, instance, **kwargs):
+    search.remove_tours([instance.pk])
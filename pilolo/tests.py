@@ -1,3 +1,1661 @@
-from django.test import TestCase
+import csv
+import datetime
+import hashlib
+import hmac
+import io
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from pathlib import Path
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.contrib import admin as django_admin
+from django.core import mail
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import Count
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import admin as pilolo_admin, benchmarks, cache as catalog_cache, drafts, exports, holds, outbox, payments, references, routers, scheduling, search, services, views
+from .benchmarks import ServerComparison, SQLiteWriteBenchmark
+from .middleware import RequestMetricsMiddleware
+from .models import Booking, BookingDraft, BookingParticipant, CustomUser, OutboxEmail, Payment, PaymentEvent, ScheduleRule, SeatHold, Tour, TourSchedule, confirmed_seats
+from .pagination import CursorPaginator
+
+
+def make_tour(**kwargs):
+    defaults = {
+        'name': 'Accra Old Town',
+        'description': 'A ride through Jamestown.',
+        'price': Decimal('150.00'),
+        'max_participants': 8,
+        'highlights': 'Lighthouse\nFishing harbour',
+        'what_included': 'Bike\nHelmet',
+        'what_to_bring': 'Water',
+        'meeting_point': 'Jamestown Lighthouse',
+    }
+    defaults.update(kwargs)
+    return Tour.objects.create(**defaults)
+
+
+def make_schedule(tour, **kwargs):
+    defaults = {
+        'day': 'saturday',
+        'date': datetime.date.today() + datetime.timedelta(days=7),
+        'start_time': datetime.time(8, 0),
+        'end_time': datetime.time(10, 0),
+    }
+    defaults.update(kwargs)
+    return TourSchedule.objects.create(tour=tour, **defaults)
+
+
+def make_user(email='rider@example.com'):
+    return CustomUser.objects.create_user(email, password='pass1234')
+
+
+class SeatCounterTests(TestCase):
+    def setUp(self):
+        self.tour = make_tour()
+        self.schedule = make_schedule(self.tour)
+        self.user = make_user()
+
+    def book(self, participants=0, status='confirmed'):
+        booking = Booking.objects.create(user=self.user, schedule=self.schedule, status=status)
+        for i in range(participants):
+            BookingParticipant.objects.create(booking=booking, full_name=f"Guest {i}")
+        return booking
+
+    def booked_count(self):
+        self.schedule.refresh_from_db()
+        return self.schedule.booked_count
+
+    def test_confirmed_booking_counts_booker_and_participants(self):
+        self.book(participants=2)
+        self.assertEqual(self.booked_count(), 3)
+        self.assertEqual(self.schedule.remaining_slots, 5)
+
+    def test_pending_booking_takes_no_seats_until_confirmed(self):
+        booking = self.book(participants=1, status='pending')
+        self.assertEqual(self.booked_count(), 0)
+
+        booking = Booking.objects.get(pk=booking.pk)
+        booking.status = 'confirmed'
+        booking.save()
+        self.assertEqual(self.booked_count(), 2)
+
+        booking.status = 'cancelled'
+        booking.save()
+        self.assertEqual(self.booked_count(), 0)
+
+    def test_deletes_release_seats(self):
+        booking = self.book(participants=2)
+        booking.participant_details.first().delete()
+        self.assertEqual(self.booked_count(), 2)
+
+        booking.delete()
+        self.assertEqual(self.booked_count(), 0)
+
+    def test_moving_a_booking_updates_both_schedules(self):
+        other = make_schedule(self.tour, day='sunday')
+        booking = Booking.objects.get(pk=self.book(participants=1).pk)
+        booking.schedule = other
+        booking.save()
+
+        other.refresh_from_db()
+        self.assertEqual(self.booked_count(), 0)
+        self.assertEqual(other.booked_count, 2)
+
+    def test_recount_seats_reports_and_fixes_drift(self):
+        self.book(participants=1)
+        TourSchedule.objects.filter(pk=self.schedule.pk).update(booked_count=7)
+
+        out = StringIO()
+        call_command('recount_seats', stdout=out)
+        self.assertIn(f"Schedule #{self.schedule.pk}: stored 7, actual 2", out.getvalue())
+        self.assertEqual(self.booked_count(), 2)
+
+
+class ScheduleAvailabilityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tour = make_tour(max_participants=4)
+        self.user = make_user()
+
+    def add_schedules(self, count):
+        with self.captureOnCommitCallbacks(execute=True):
+            self._add_schedules(count)
+
+    def _add_schedules(self, count):
+        for i in range(count):
+            schedule = make_schedule(self.tour, date=datetime.date.today() + datetime.timedelta(days=i))
+            booking = Booking.objects.create(user=self.user, schedule=schedule, status='confirmed')
+            BookingParticipant.objects.create(booking=booking, full_name='Guest')
+            Booking.objects.create(user=self.user, schedule=schedule, status='cancelled')
+
+    def test_with_availability_annotates_confirmed_seats(self):
+        self.add_schedules(1)
+        schedule = TourSchedule.objects.with_availability().get()
+        self.assertEqual(schedule.seats_booked, 2)
+        self.assertEqual(schedule.remaining_slots, 2)
+        self.assertFalse(schedule.is_fully_booked)
+
+    def test_tour_detail_query_count_does_not_grow_with_schedules(self):
+        url = reverse('tour_detail', args=[self.tour.id])
+        self.add_schedules(2)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+
+        self.add_schedules(48)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+
+        self.assertEqual(len(response.context['schedules']), 50)
+        self.assertEqual(len(few), len(many))
+
+
+class BookingListingTests(TestCase):
+    def setUp(self):
+        self.schedule = make_schedule(make_tour(price=Decimal('100.00')))
+        self.user = make_user()
+        self.client.force_login(self.user)
+
+    def add_bookings(self, count, participants=2):
+        for _ in range(count):
+            booking = Booking.objects.create(user=self.user, schedule=self.schedule, status='confirmed')
+            for i in range(participants):
+                BookingParticipant.objects.create(booking=booking, full_name=f"Guest {i}")
+
+    def test_for_listing_annotates_count_and_price(self):
+        self.add_bookings(1)
+        booking = Booking.objects.for_listing().get()
+        with self.assertNumQueries(0):
+            self.assertEqual(booking.participant_count, 2)
+            self.assertEqual(booking.total_price, Decimal('300.00'))
+            self.assertEqual(booking.schedule.tour.name, 'Accra Old Town')
+
+    def test_my_bookings_query_count_does_not_grow_with_rows(self):
+        url = reverse('my_bookings')
+        self.add_bookings(1)
+        with CaptureQueriesContext(connection) as one:
+            self.client.get(url)
+
+        self.add_bookings(9)
+        with CaptureQueriesContext(connection) as ten:
+            self.client.get(url)
+
+        self.assertEqual(len(one), len(ten))
+
+
+class SeatHoldTests(TestCase):
+    def setUp(self):
+        self.schedule = make_schedule(make_tour(max_participants=4))
+        self.alice = make_user('alice@example.com')
+        self.bob = make_user('bob@example.com')
+
+    def test_hold_blocks_other_users(self):
+        holds.place_hold(self.schedule.id, self.alice, 3)
+        with self.assertRaises(holds.SeatsUnavailable) as ctx:
+            holds.place_hold(self.schedule.id, self.bob, 2)
+        self.assertEqual(ctx.exception.available, 1)
+
+    def test_replacing_own_hold_does_not_count_against_user(self):
+        holds.place_hold(self.schedule.id, self.alice, 3)
+        hold = holds.place_hold(self.schedule.id, self.alice, 4)
+        self.assertEqual(hold.seats, 4)
+        self.assertEqual(SeatHold.objects.count(), 1)
+
+    def test_expired_holds_free_seats_and_are_swept(self):
+        holds.place_hold(self.schedule.id, self.alice, 4)
+        SeatHold.objects.update(expires_at=timezone.now() - datetime.timedelta(seconds=1))
+
+        holds.place_hold(self.schedule.id, self.bob, 4)
+        self.assertEqual(holds.sweep_expired_holds(), 1)
+        self.assertEqual(list(SeatHold.objects.values_list('user', flat=True)), [self.bob.id])
+
+    def test_claim_releases_hold(self):
+        holds.place_hold(self.schedule.id, self.alice, 2)
+        with transaction.atomic():
+            holds.claim_seats(self.schedule.id, self.alice, 2)
+        self.assertFalse(SeatHold.objects.exists())
+
+
+def _checkout(schedule_id, user_id):
+    """Run one hold-then-book checkout in a forked worker process."""
+    connections.close_all()
+    user = CustomUser.objects.get(pk=user_id)
+    try:
+        holds.place_hold(schedule_id, user, 1)
+        with transaction.atomic():
+            holds.claim_seats(schedule_id, user, 1)
+            Booking.objects.create(user=user, schedule_id=schedule_id, status='confirmed')
+    except holds.SeatsUnavailable:
+        return False
+    finally:
+        connections.close_all()
+    return True
+
+
+class SeatHoldConcurrencyTests(TransactionTestCase):
+    workers = 16
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("Needs a test database that other processes can open.")
+
+    def test_parallel_checkouts_never_oversell_the_last_seat(self):
+        schedule = make_schedule(make_tour(max_participants=3))
+        owner = make_user('owner@example.com')
+        booking = Booking.objects.create(user=owner, schedule=schedule, status='confirmed')
+        BookingParticipant.objects.create(booking=booking, full_name='Guest')
+        users = [make_user(f'racer{i}@example.com').pk for i in range(self.workers)]
+
+        connections.close_all()
+        ctx = multiprocessing.get_context('fork')
+        with ctx.Pool(self.workers) as pool:
+            results = pool.starmap(_checkout, [(schedule.id, user_id) for user_id in users])
+
+        schedule.refresh_from_db()
+        self.assertEqual(sum(results), 1)
+        self.assertEqual(schedule.booked_count, 3)
+        self.assertEqual(Booking.objects.filter(schedule=schedule, status='confirmed').count(), 2)
+
+
+@override_settings(REQUEST_METRICS_ENABLED=True, REQUEST_METRICS_QUERY_BUDGETS={'tour_detail': 1})
+class RequestMetricsMiddlewareTests(TestCase):
+    def test_reports_server_timing_and_budget(self):
+        tour = make_tour()
+        make_schedule(tour)
+        with self.assertLogs('pilolo.metrics', level='INFO') as logs:
+            response = self.client.get(reverse('tour_detail', args=[tour.id]))
+
+        self.assertRegex(response['Server-Timing'], r'^db;desc="\d+ queries, \d+ duplicate";dur=[\d.]+, tpl;dur=')
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['view'], 'tour_detail')
+        self.assertEqual((line['cache_hits'], line['cache_misses']), (0, 1))
+        self.assertGreater(line['queries'], 1)
+        self.assertGreater(line['template_ms'], 0)
+        self.assertIn('over its budget of 1', logs.output[-1])
+
+    def test_async_chain_stays_async(self):
+        tour = make_tour()
+
+        async def view(request):
+            await sync_to_async(list)(Tour.objects.filter(pk=tour.pk))
+            return HttpResponse('ok')
+
+        middleware = RequestMetricsMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        self.assertTrue(iscoroutinefunction(middleware.process_view))
+        request = RequestFactory().get('/probe/')
+        with self.assertLogs('pilolo.metrics', level='INFO') as logs:
+            response = async_to_sync(middleware)(request)
+        self.assertRegex(response['Server-Timing'], r'^db;desc="1 queries, 0 duplicate"')
+        self.assertEqual(json.loads(logs.records[0].getMessage())['queries'], 1)
+
+    @override_settings(REQUEST_METRICS_ENABLED=False)
+    def test_disabled_by_default(self):
+        response = self.client.get(reverse('home'))
+        self.assertNotIn('Server-Timing', response)
+
+
+class BenchmarkTests(TestCase):
+    def test_seed_data_and_benchmark_run(self):
+        call_command('seed_data', tours=2, users=3, weeks=2, stdout=StringIO())
+        self.assertEqual(TourSchedule.objects.count(), 8)
+        schedule = TourSchedule.objects.with_availability().filter(seats_booked__gt=0).first()
+        if schedule is not None:
+            self.assertEqual(schedule.booked_count, schedule.seats_booked)
+
+        out = StringIO()
+        call_command('benchmark', existing=True, iterations=2, baseline='/nonexistent.json', stdout=out, stderr=StringIO())
+        report = json.loads(out.getvalue())
+        self.assertEqual(
+            set(report['views']),
+            {'home', 'tour_list', 'tour_detail', 'booking_start', 'my_bookings', 'booking_wizard'},
+        )
+        # The benchmark rolls back everything it writes
+        self.assertFalse(Booking.objects.filter(payments__transaction_id__startswith='BENCH_').exists())
+        # A change that adds queries must refresh benchmarks/baseline.json
+        baseline = json.loads((Path(settings.BASE_DIR) / 'benchmarks' / 'baseline.json').read_text())
+        self.assertEqual(benchmarks.compare_to_baseline(report['views'], baseline['1'], 2.0, latency=False), [])
+
+    def test_latency_is_only_compared_on_the_recording_machine(self):
+        results = {'home': {'p50_ms': 9.0, 'p95_ms': 10.0, 'queries': 2}}
+        views = {'home': {'p50_ms': 1.0, 'p95_ms': 1.0, 'queries': 2}}
+        self.assertEqual(benchmarks.compare_to_baseline(results, {'machine': 'elsewhere', 'views': views}, 2.0), [])
+        here = {'machine': benchmarks.machine(), 'views': views}
+        self.assertEqual(len(benchmarks.compare_to_baseline(results, here, 2.0)), 1)
+        self.assertEqual(benchmarks.compare_to_baseline(results, here, 2.0, latency=False), [])
+
+        views['home']['queries'] = 1
+        self.assertEqual(benchmarks.compare_to_baseline(results, {'machine': 'elsewhere', 'views': views}, 2.0),
+                         ['home: 2 queries, baseline 1'])
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        catalog_cache.reset_stats()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tour = make_tour()
+            self.schedule = make_schedule(self.tour)
+        self.url = reverse('tour_detail', args=[self.tour.id])
+
+    def test_second_view_is_served_from_cache(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.context['schedules'][0].remaining_slots, 8)
+        self.assertEqual(catalog_cache.stats(), {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'pilolo_test_cache',
+    }})
+    def test_hits_do_not_write_to_the_database_cache(self):
+        call_command('createcachetable', verbosity=0)
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get(self.url)
+        self.assertTrue(captured)
+        self.assertFalse([q for q in captured if not q['sql'].startswith('SELECT')])
+
+    def test_booking_invalidates_only_its_tour(self):
+        other = make_tour(name='Kumasi Loop')
+        make_schedule(other)
+        other_url = reverse('tour_detail', args=[other.id])
+        self.client.get(self.url)
+        self.client.get(other_url)
+        self.client.get(reverse('tours_list'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Booking.objects.create(user=make_user(), schedule=self.schedule, status='confirmed')
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['schedules'][0].remaining_slots, 7)
+        with self.assertNumQueries(0):
+            self.client.get(other_url)
+            self.client.get(reverse('tours_list'))
+
+    def test_tour_edit_invalidates_catalog(self):
+        self.client.get(reverse('tours_list'))
+        self.tour.name = 'Accra by Night'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tour.save()
+        response = self.client.get(reverse('tours_list'))
+        self.assertEqual(response.context['tours'][0].name, 'Accra by Night')
+
+    def test_moving_a_booking_invalidates_the_old_schedule(self):
+        other = make_tour(name='Kumasi Loop')
+        with self.captureOnCommitCallbacks(execute=True):
+            target = make_schedule(other)
+            booking = Booking.objects.create(user=make_user(), schedule=self.schedule, status='confirmed')
+        self.client.get(self.url)
+
+        # As the admin change form does it: a model save, not move_bookings()
+        booking = Booking.objects.get(pk=booking.pk)
+        booking.schedule = target
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['schedules'][0].remaining_slots, 8)
+
+    def test_moving_a_schedule_invalidates_its_old_month(self):
+        calendar_url = reverse('availability_calendar')
+        month = f'{self.schedule.date:%Y-%m}'
+        self.client.get(calendar_url, {'month': month})
+        schedule = TourSchedule.objects.get(pk=self.schedule.pk)
+        schedule.date += datetime.timedelta(days=62)
+        with self.captureOnCommitCallbacks(execute=True):
+            schedule.save()
+        response = self.client.get(calendar_url, {'month': month})
+        self.assertFalse(any(cell['departures'] for week in response.context['weeks'] for cell in week))
+
+
+class TourListFieldTests(TestCase):
+    def test_lists_are_parsed_on_save(self):
+        tour = make_tour(highlights=' Lighthouse \n\nFishing harbour\n')
+        tour = Tour.objects.get(pk=tour.pk)
+        self.assertEqual(tour.highlights_as_list(), ['Lighthouse', 'Fishing harbour'])
+
+        tour.what_to_bring = 'Water\nHat'
+        tour.save(update_fields=['what_to_bring'])
+        self.assertEqual(Tour.objects.get(pk=tour.pk).what_to_bring_list, ['Water', 'Hat'])
+
+
+class FailingEmailBackend(LocmemEmailBackend):
+    def send_messages(self, messages):
+        raise ConnectionRefusedError("SMTP is down")
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        user = make_user()
+        self.booking = Booking.objects.create(user=user, schedule=make_schedule(make_tour()), status='confirmed')
+        BookingParticipant.objects.create(booking=self.booking, full_name='Ama')
+
+    def test_checkout_queues_email_instead_of_sending(self):
+        client_user = make_user('payer@example.com')
+        self.client.force_login(client_user)
+        session = self.client.session
+        session[drafts.SESSION_KEY] = drafts.create(
+            client_user, schedule_id=self.booking.schedule_id, participants=0, special_requirements=''
+        )
+        session.save()
+
+        response = self.client.post(
+            reverse('booking_payment'), {'paymentSuccess': True, 'reference': 'T_1'}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.recipient, email.status), ('payer@example.com', 'held'))
+        # Held until the payment is verified
+        self.assertEqual(outbox.drain(), (0, 0))
+
+    def test_drain_sends_pending_emails(self):
+        outbox.enqueue_booking_confirmation(self.booking, 'pilolo.test')
+        outbox.enqueue_booking_confirmation(self.booking, 'pilolo.test')
+
+        self.assertEqual(outbox.drain(batch_size=1), (2, 0))
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertIn('Ama', mail.outbox[0].body)
+        self.assertIn(f'http://pilolo.test/bookings/{self.booking.id}/', mail.outbox[0].body)
+        self.assertFalse(OutboxEmail.objects.exclude(status='sent').exists())
+
+    @override_settings(
+        EMAIL_BACKEND='pilolo.tests.FailingEmailBackend',
+        OUTBOX_MAX_ATTEMPTS=2,
+        OUTBOX_BACKOFF_BASE=60,
+    )
+    def test_failures_back_off_then_go_dead(self):
+        email = outbox.enqueue_booking_confirmation(self.booking, 'pilolo.test')
+
+        self.assertEqual(outbox.drain(), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('pending', 1))
+        self.assertGreater(email.next_attempt_at, timezone.now() + datetime.timedelta(seconds=50))
+        self.assertEqual(outbox.drain(), (0, 0))  # not due yet
+
+        OutboxEmail.objects.update(next_attempt_at=timezone.now())
+        outbox.drain()
+        email.refresh_from_db()
+        self.assertEqual(email.status, 'dead')
+        self.assertIn('SMTP is down', email.last_error)
+
+    @override_settings(OUTBOX_MAX_WORKERS=1)
+    def test_worker_limit(self):
+        outbox.enqueue_booking_confirmation(self.booking, 'pilolo.test')
+        outbox.enqueue_booking_confirmation(self.booking, 'pilolo.test')
+        self.assertEqual(len(outbox.claim_batch('worker-a', 1)), 1)
+        self.assertEqual(outbox.claim_batch('worker-b', 1), [])
+
+
+class BookingReferenceTests(TestCase):
+    def test_references_are_unique_and_checked(self):
+        refs = references.new_references(5000)
+        self.assertEqual(len(set(refs)), 5000)
+        for ref in refs[:50]:
+            self.assertRegex(ref, r'^[A-Z0-9]{12}$')
+            self.assertTrue(references.is_valid(ref))
+        tampered = refs[0][:3] + ('A' if refs[0][3] != 'A' else 'B') + refs[0][4:]
+        self.assertFalse(references.is_valid(tampered))
+
+    def test_save_does_not_look_up_existing_references(self):
+        schedule = make_schedule(make_tour())
+        user = make_user()
+        with CaptureQueriesContext(connection) as captured:
+            booking = Booking.objects.create(user=user, schedule=schedule)
+        self.assertTrue(references.is_valid(booking.reference))
+        self.assertEqual(booking.tour_date, schedule.date)
+        self.assertFalse([q for q in captured if q['sql'].startswith('SELECT') and '"booking"' in q['sql']])
+
+    def test_references_do_not_reveal_their_order(self):
+        first, second = references.new_references(2)
+        self.assertNotEqual(first[:6], second[:6])
+        with override_settings(BOOKING_REFERENCE_KEY='another key'):
+            self.assertNotEqual(references.new_reference()[:6], references.new_reference()[:6])
+        key = references._key()
+        for value in (0, 1, (1 << references.PAYLOAD_BITS) - 1, 123456789012345):
+            self.assertEqual(references.unscramble(references.scramble(value, key), key), value)
+
+    def repeat_reference(self, taken):
+        class Repeating(references.ReferenceGenerator):
+            # Another process with the same worker id issued ``taken`` first
+            def generate(self, count=1):
+                if not self.repeated:
+                    self.repeated = True
+                    return [taken] + super().generate(count - 1)
+                return super().generate(count)
+
+        generator = Repeating()
+        generator.repeated = False
+        self.addCleanup(setattr, references, '_generator', references._generator)
+        references._generator = generator
+
+    def test_checkout_draws_a_new_reference_when_one_is_taken(self):
+        schedule = make_schedule(make_tour())
+        taken = Booking.objects.create(user=make_user('first@example.com'), schedule=schedule).reference
+        self.repeat_reference(taken)
+
+        with self.assertLogs('pilolo.models', 'WARNING'):
+            booking = services.commit_booking(make_user(), schedule.id, [], transaction_reference='T_1')
+        self.assertNotEqual(booking.reference, taken)
+        self.assertEqual(Booking.objects.get(pk=booking.pk).reference, booking.reference)
+        self.assertEqual(booking.payments.get().transaction_id, 'T_1')
+
+    def test_save_and_bulk_create_draw_a_new_reference_when_one_is_taken(self):
+        schedule = make_schedule(make_tour())
+        user = make_user()
+        taken = Booking.objects.create(user=user, schedule=schedule).reference
+
+        self.repeat_reference(taken)
+        with self.assertLogs('pilolo.models', 'WARNING'):
+            booking = Booking.objects.create(user=user, schedule=schedule)
+        self.assertNotEqual(booking.reference, taken)
+
+        self.repeat_reference(taken)
+        with self.assertLogs('pilolo.models', 'WARNING'):
+            bookings = Booking.objects.bulk_create([Booking(user=user, schedule=schedule) for _ in range(3)])
+        self.assertNotIn(taken, {b.reference for b in bookings})
+        self.assertEqual(Booking.objects.count(), 5)
+
+    def test_confirmation_is_only_shown_to_its_owner(self):
+        booking = Booking.objects.create(user=make_user(), schedule=make_schedule(make_tour()))
+        self.client.force_login(make_user('other@example.com'))
+        response = self.client.get(reverse('booking_confirmation', args=[booking.reference]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_bulk_create_assigns_references(self):
+        schedule = make_schedule(make_tour())
+        user = make_user()
+        bookings = Booking.objects.bulk_create([Booking(user=user, schedule=schedule) for _ in range(20)])
+        self.assertEqual(len({b.reference for b in bookings}), 20)
+        self.assertEqual(Booking.objects.filter(tour_date=schedule.date).count(), 20)
+
+
+class CommitBookingTests(TestCase):
+    def setUp(self):
+        self.schedule = make_schedule(make_tour(price=Decimal('100.00'), max_participants=20))
+        self.user = make_user()
+
+    def party(self, size):
+        return [{'full_name': f"Guest {i}", 'age': '30', 'notes': ''} for i in range(size)]
+
+    def test_write_query_count_is_fixed(self):
+        counts = []
+        for size in (1, 6):
+            with CaptureQueriesContext(connection) as captured:
+                services.commit_booking(self.user, self.schedule.id, self.party(size), transaction_reference=f'T_{size}')
+            counts.append(len(captured))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_commits_booking_participants_payment_and_email(self):
+        holds.place_hold(self.schedule.id, self.user, 3)
+        booking = services.commit_booking(self.user, self.schedule.id, self.party(2), transaction_reference='T_1', site_name='pilolo.test')
+
+        self.schedule.refresh_from_db()
+        self.assertEqual(self.schedule.booked_count, 3)
+        self.assertEqual(booking.participant_details.count(), 2)
+        payment = booking.payments.get()
+        self.assertEqual((payment.amount, payment.status), (Decimal('300.00'), 'pending'))
+        self.assertEqual(OutboxEmail.objects.get(status='held').booking, booking)
+        self.assertFalse(SeatHold.objects.exists())
+
+    def test_rolls_back_when_seats_run_out(self):
+        with self.assertRaises(holds.SeatsUnavailable):
+            services.commit_booking(self.user, self.schedule.id, self.party(20))
+        self.assertFalse(Booking.objects.exists())
+
+    def start_checkout(self, size):
+        self.client.force_login(self.user)
+        session = self.client.session
+        session[drafts.SESSION_KEY] = drafts.create(
+            self.user, schedule_id=self.schedule.id, special_requirements='', participant_data=self.party(size)
+        )
+        session.save()
+
+    def test_hold_is_renewed_before_payment(self):
+        self.start_checkout(2)
+        response = self.client.post(reverse('booking_hold'))
+        self.assertEqual(response.json()['seats'], 3)
+        self.assertEqual(SeatHold.objects.get(user=self.user).seats, 3)
+
+        # The hold lapsed and someone else took the seats
+        SeatHold.objects.update(expires_at=timezone.now() - datetime.timedelta(minutes=1))
+        holds.place_hold(self.schedule.id, make_user('other@example.com'), 18)
+        response = self.client.post(reverse('booking_hold'))
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('filled up', response.json()['error'])
+
+    def test_paid_checkout_without_seats_is_kept_for_refund(self):
+        self.start_checkout(2)
+        holds.place_hold(self.schedule.id, make_user('other@example.com'), 18)
+        with self.assertLogs('pilolo.views', 'ERROR'):
+            response = self.client.post(
+                reverse('booking_payment'), {'paymentSuccess': True, 'reference': 'T_1'}, content_type='application/json'
+            )
+        payment = Payment.objects.get(transaction_id='T_1')
+        self.assertEqual((payment.status, payment.amount, payment.booking.status), ('refund_due', Decimal('300.00'), 'cancelled'))
+        self.assertEqual(payment.booking.participant_details.count(), 2)
+        self.schedule.refresh_from_db()
+        self.assertEqual(self.schedule.booked_count, 0)
+        self.assertFalse(OutboxEmail.objects.exists())
+
+        self.assertRedirects(response, reverse('booking_unfulfilled', args=[payment.booking.reference]))
+        response = self.client.get(response.url)
+        self.assertContains(response, 'will be refunded')
+        self.assertContains(response, 'T_1')
+
+    def test_checkout_without_a_payment_books_nothing(self):
+        self.start_checkout(2)
+        for body in ({'paymentSuccess': False, 'reference': 'T_1'}, {'paymentSuccess': True}, {}):
+            response = self.client.post(reverse('booking_payment'), body, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Booking.objects.exists())
+        self.assertFalse(Payment.objects.exists())
+        self.schedule.refresh_from_db()
+        self.assertEqual(self.schedule.booked_count, 0)
+
+
+class TourSearchTests(TestCase):
+    def setUp(self):
+        self.kayak = make_tour(name='Volta Kayak Ride', description='Paddle and pedal.', meeting_point='Akosombo')
+        self.market = make_tour(name='Market Loop', description='Ends with a kayak demo at the harbour.')
+
+    def test_name_match_ranks_above_description_match(self):
+        self.assertEqual(search.search('kayak'), [self.kayak.id, self.market.id])
+
+    def test_prefix_and_all_terms_must_match(self):
+        self.assertEqual(search.search('kay volta'), [self.kayak.id])
+        self.assertEqual(search.search('kayak kumasi'), [])
+        self.assertEqual(search.search('"*)'), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.market.name = 'Makola Dash'
+        self.market.save()
+        self.assertEqual(search.search('makola'), [self.market.id])
+        self.kayak.delete()
+        self.assertEqual(search.search('volta'), [])
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            search.get_backend().clear(cursor)
+        self.assertEqual(search.search('kayak'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(search.search('kayak'), [self.kayak.id, self.market.id])
+
+    def test_tour_list_and_typeahead(self):
+        response = self.client.get(reverse('tours_list'), {'search': 'volta'})
+        self.assertEqual([tour.id for tour in response.context['tours']], [self.kayak.id])
+
+        response = self.client.get(reverse('tour_search'), {'search': 'kay'}, HTTP_HX_REQUEST='true')
+        self.assertContains(response, 'Volta Kayak Ride')
+        self.assertContains(response, reverse('tour_detail', args=[self.market.id]))
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user()
+        self.client.force_login(self.user)
+        self.schedule = make_schedule(make_tour(max_participants=50))
+
+    def walk(self, url, params, template):
+        seen, cursor = [], None
+        while True:
+            response = self.client.get(url, {**params, **({'cursor': cursor} if cursor else {})}, HTTP_HX_REQUEST='true')
+            self.assertTemplateUsed(response, template)
+            page = response.context['page']
+            seen.extend(obj.id for obj in page)
+            if not page.has_next:
+                return seen
+            cursor = page.next_cursor
+
+    def test_my_bookings_walks_every_booking_once_newest_first(self):
+        bookings = Booking.objects.bulk_create([
+            Booking(user=self.user, schedule=self.schedule, status='cancelled' if i % 3 else 'confirmed')
+            for i in range(25)
+        ])
+        # Shared timestamps exercise the id tie-breaker
+        Booking.objects.filter(id__in=[b.id for b in bookings[:10]]).update(booking_date=timezone.now())
+        expected = list(Booking.objects.order_by('-booking_date', '-id').values_list('id', flat=True))
+
+        self.assertEqual(self.walk(reverse('my_bookings'), {'status': 'all'}, 'pilolo/partials/booking_cards.html'), expected)
+        cancelled = self.walk(reverse('my_bookings'), {'status': 'cancelled'}, 'pilolo/partials/booking_cards.html')
+        self.assertEqual(cancelled, [pk for pk in expected if Booking.objects.get(pk=pk).status == 'cancelled'])
+
+    def test_deep_page_costs_the_same_and_never_counts(self):
+        Booking.objects.bulk_create([Booking(user=self.user, schedule=self.schedule) for _ in range(30)])
+        url = reverse('my_bookings')
+        with CaptureQueriesContext(connection) as first:
+            response = self.client.get(url, HTTP_HX_REQUEST='true')
+        with CaptureQueriesContext(connection) as later:
+            self.client.get(url, {'cursor': response.context['page'].next_cursor}, HTTP_HX_REQUEST='true')
+        self.assertEqual(len(first), len(later))
+        sql = ' '.join(q['sql'] for q in first.captured_queries + later.captured_queries)
+        self.assertNotIn('COUNT(*)', sql)
+        self.assertNotIn('OFFSET', sql)
+
+    def test_tour_list_pages_by_name_then_id(self):
+        for i in range(12):
+            make_tour(name=f'Tour {i % 4}')
+        expected = list(Tour.objects.order_by('name', 'id').values_list('id', flat=True))
+        first = self.client.get(reverse('tours_list'))
+        self.assertEqual([t.id for t in first.context['tours']], expected[:9])
+        rest = self.client.get(reverse('tours_list'), {'cursor': first.context['page'].next_cursor}, HTTP_HX_REQUEST='true')
+        self.assertTemplateUsed(rest, 'pilolo/partials/tour_cards.html')
+        self.assertEqual([t.id for t in rest.context['tours']], expected[9:])
+
+    def test_tampered_cursor_falls_back_to_first_page(self):
+        response = self.client.get(reverse('tours_list'), {'cursor': 'not-a-cursor'})
+        self.assertTemplateUsed(response, 'pilolo/tour_list.html')
+        self.assertEqual([t.id for t in response.context['tours']], [self.schedule.tour_id])
+
+
+class BookingAdminTests(TestCase):
+    def setUp(self):
+        self.admin = CustomUser.objects.create_superuser('admin@example.com', 'pass1234')
+        self.client.force_login(self.admin)
+        self.tour = make_tour(max_participants=4)
+        self.schedule = make_schedule(self.tour)
+        self.other = make_schedule(self.tour, date=datetime.date.today() + datetime.timedelta(days=8))
+        self.user = make_user()
+
+    def add_bookings(self, count, status='pending', schedule=None):
+        return Booking.objects.bulk_create([
+            Booking(user=self.user, schedule=schedule or self.schedule, status=status) for _ in range(count)
+        ])
+
+    def action(self, action, bookings, **extra):
+        return self.client.post(reverse('admin:pilolo_booking_changelist'), {
+            'action': action, '_selected_action': [b.pk for b in bookings], **extra,
+        })
+
+    def test_changelists_do_not_query_per_row(self):
+        for name in ('booking', 'bookingparticipant', 'payment', 'tourschedule'):
+            url = reverse(f'admin:pilolo_{name}_changelist')
+            self.add_bookings(1, status='confirmed')
+            with CaptureQueriesContext(connection) as few:
+                self.client.get(url)
+            for booking in self.add_bookings(5, status='confirmed'):
+                BookingParticipant.objects.create(booking=booking, full_name='Guest')
+                Payment.objects.create(booking=booking, amount=1, transaction_id=booking.reference)
+            make_schedule(make_tour(name=f'Extra {name}'))
+            with CaptureQueriesContext(connection) as many:
+                self.client.get(url)
+            self.assertEqual(len(few), len(many), name)
+
+    def test_confirm_and_cancel_recount_each_schedule_once(self):
+        bookings = self.add_bookings(2) + self.add_bookings(2, schedule=self.other)
+        with CaptureQueriesContext(connection) as captured:
+            self.action('confirm_selected', bookings)
+        self.assertEqual(sum('UPDATE "tour_schedule" SET "booked_count" = COALESCE' in q['sql'] for q in captured), 1)
+        self.assertEqual(list(TourSchedule.objects.order_by('pk').values_list('booked_count', flat=True)), [2, 2])
+
+        self.action('cancel_selected', bookings[:3])
+        self.assertEqual(list(TourSchedule.objects.order_by('pk').values_list('booked_count', flat=True)), [0, 1])
+
+    def test_confirm_refuses_to_oversell(self):
+        bookings = self.add_bookings(5)
+        response = self.action('confirm_selected', bookings)
+        self.assertFalse(Booking.objects.filter(status='confirmed').exists())
+        self.assertIn('Nothing was changed', str(list(response.wsgi_request._messages)))
+
+    def test_move_asks_for_schedule_then_moves(self):
+        bookings = self.add_bookings(3, status='confirmed')
+        TourSchedule.objects.refresh_booked_count()
+        response = self.action('move_selected', bookings)
+        self.assertTemplateUsed(response, 'admin/pilolo/booking/move_bookings.html')
+
+        self.action('move_selected', bookings, apply='1', schedule=self.other.pk)
+        self.assertEqual(set(Booking.objects.values_list('schedule', 'tour_date')), {(self.other.pk, self.other.date)})
+        self.assertEqual(list(TourSchedule.objects.order_by('pk').values_list('booked_count', flat=True)), [0, 3])
+
+    def test_search_matches_exact_reference_or_email(self):
+        booking, other = self.add_bookings(2)
+        url = reverse('admin:pilolo_booking_changelist')
+        response = self.client.get(url, {'q': booking.reference})
+        self.assertEqual(list(response.context['cl'].result_list), [booking])
+        response = self.client.get(url, {'q': self.user.email})
+        self.assertEqual(set(response.context['cl'].result_list), {booking, other})
+        response = self.client.get(url, {'q': booking.reference[:4]})
+        self.assertEqual(list(response.context['cl'].result_list), [])
+
+    def test_estimated_count_for_unfiltered_big_tables(self):
+        self.add_bookings(3)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.add_bookings(2)  # not yet in the statistics
+        paginator = type('Paginator', (pilolo_admin.EstimatedCountPaginator,), {'threshold': 1})
+        self.assertEqual(paginator(Booking.objects.all(), 10).count, 3)
+        self.assertEqual(paginator(Booking.objects.filter(status='pending'), 10).count, 5)
+        self.assertEqual(pilolo_admin.EstimatedCountPaginator(Booking.objects.all(), 10).count, 5)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.tour = make_tour(price=Decimal('100.00'))
+        self.schedule = make_schedule(self.tour)
+        self.later = make_schedule(self.tour, date=datetime.date.today() + datetime.timedelta(days=30))
+        self.user = make_user()
+        self.booking = Booking.objects.create(user=self.user, schedule=self.schedule, status='confirmed')
+        BookingParticipant.objects.create(booking=self.booking, full_name='Ama Mensah', age=30)
+        BookingParticipant.objects.create(booking=self.booking, full_name='Kofi Mensah')
+        Payment.objects.create(booking=self.booking, amount=Decimal('300.00'), status='completed', transaction_id='T1')
+        Booking.objects.create(user=self.user, schedule=self.later, status='confirmed')
+        self.staff = CustomUser.objects.create_superuser('staff@example.com', 'pass1234')
+
+    def export(self, kind, **params):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('export_csv', args=[kind]), params)
+        self.assertTrue(response.streaming)
+        return list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+
+    def test_bookings_export_totals_and_filters(self):
+        rows = self.export('bookings', schedule=self.schedule.pk)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(dict(zip(rows[0], rows[1]))['total_price'], '300.00')
+        self.assertEqual(len(self.export('bookings', date_from=self.later.date.isoformat())), 2)
+
+    def test_roster_lists_booker_then_participants(self):
+        rows = self.export('participants', schedule=self.schedule.pk)
+        self.assertEqual([(row[5], row[6]) for row in rows[1:]], [
+            ('rider@example.com', 'booker'), ('Ama Mensah', 'participant'), ('Kofi Mensah', 'participant'),
+        ])
+
+    def test_export_query_count_is_fixed(self):
+        with self.assertNumQueries(1):
+            list(exports.stream_csv('participants'))
+        for _ in range(20):
+            booking = Booking.objects.create(user=self.user, schedule=self.later, status='confirmed')
+            BookingParticipant.objects.create(booking=booking, full_name='Guest')
+        with self.assertNumQueries(1):
+            list(exports.stream_csv('participants'))
+
+    def test_payments_export_and_command(self):
+        rows = self.export('payments')
+        self.assertEqual(rows[1][:4], ['T1', rows[1][1], '300.00', 'completed'])
+        out = StringIO()
+        call_command('export_csv', 'payments', '--tour', str(self.tour.pk), stdout=out)
+        self.assertEqual(out.getvalue().splitlines()[1].split(',')[0], 'T1')
+
+    def test_requires_staff_and_known_kind(self):
+        self.assertEqual(self.client.get(reverse('export_csv', args=['bookings'])).status_code, 302)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(reverse('export_csv', args=['users'])).status_code, 404)
+
+
+class ScheduleGeneratorTests(TestCase):
+    def setUp(self):
+        self.tour = make_tour()
+        self.start = datetime.date(2031, 1, 1)  # a Wednesday
+        self.rule = ScheduleRule.objects.create(
+            tour=self.tour, days=['saturday', 'sunday'],
+            start_time=datetime.time(7, 0), end_time=datetime.time(10, 0),
+            season_start=self.start, season_end=datetime.date(2031, 3, 31),
+            blackout_dates=['2031-01-04'],
+        )
+
+    def test_generates_weekends_in_season_minus_blackouts(self):
+        created = scheduling.generate_schedules(start=self.start, end=datetime.date(2031, 12, 31))
+        dates = sorted(s.date for s in created)
+        self.assertEqual(dates[:3], [datetime.date(2031, 1, 5), datetime.date(2031, 1, 11), datetime.date(2031, 1, 12)])
+        self.assertEqual(dates[-1], datetime.date(2031, 3, 30))
+        self.assertTrue(all(s.date.weekday() in (5, 6) and s.day == s.date.strftime('%A').lower() for s in created))
+
+    def test_skips_existing_dates_and_is_idempotent(self):
+        make_schedule(self.tour, date=datetime.date(2031, 1, 5), start_time=datetime.time(7, 0))
+        first = scheduling.generate_schedules(start=self.start)
+        self.assertNotIn(datetime.date(2031, 1, 5), [s.date for s in first])
+        self.assertEqual(scheduling.generate_schedules(start=self.start), [])
+
+    def test_full_year_for_every_tour_in_fixed_queries(self):
+        for i in range(5):
+            ScheduleRule.objects.create(
+                tour=make_tour(name=f'Tour {i}'), days=['saturday'],
+                start_time=datetime.time(8, 0), end_time=datetime.time(11, 0),
+                season_start=self.start, season_end=datetime.date(2031, 12, 31),
+            )
+        with CaptureQueriesContext(connection) as captured:
+            created = scheduling.generate_schedules(start=self.start, end=datetime.date(2031, 12, 31))
+        self.assertEqual(len(created), 5 * 52 + 25)
+        # One read of the rules and of existing dates, then batched inserts
+        self.assertLess(len(captured), 8)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('generate_schedules', '--from', '2031-01-01', '--to', '2031-01-31', stdout=out)
+        self.assertIn('Created 7 schedule(s).', out.getvalue())
+
+    def test_tour_detail_shows_only_the_upcoming_window(self):
+        today = timezone.localdate()
+        past = make_schedule(self.tour, date=today - datetime.timedelta(days=7))
+        soon = make_schedule(self.tour, date=today + datetime.timedelta(days=3))
+        far = make_schedule(self.tour, date=today + datetime.timedelta(days=400))
+        cache.clear()
+        response = self.client.get(reverse('tour_detail', args=[self.tour.id]))
+        self.assertEqual([s.id for s in response.context['schedules']], [soon.id])
+        self.assertNotIn(past.id, [s.id for s in response.context['schedules']])
+        self.assertNotIn(far.id, [s.id for s in response.context['schedules']])
+
+
+class AvailabilityEndpointTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tour = make_tour(max_participants=5)
+            self.schedule = make_schedule(self.tour)
+        self.url = reverse('schedule_availability', args=[self.tour.id, self.schedule.id])
+
+    def test_returns_remaining_seats_with_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.json()['remaining'], 5)
+        self.assertTrue(response['ETag'].startswith('"'))
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        tour_response = self.client.get(reverse('tour_availability', args=[self.tour.id]))
+        self.assertEqual([s['id'] for s in tour_response.json()['schedules']], [self.schedule.id])
+        self.assertEqual(tour_response['ETag'], response['ETag'])
+
+    def test_unchanged_poll_is_304_without_queries(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_booking_changes_the_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Booking.objects.create(user=make_user(), schedule=self.schedule, status='confirmed')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['remaining'], 4)
+
+    def test_unknown_schedule_is_404(self):
+        other = make_schedule(make_tour(name='Other'))
+        self.assertEqual(self.client.get(reverse('schedule_availability', args=[self.tour.id, other.id])).status_code, 404)
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'pilolo_test_cache',
+    }})
+    def test_works_with_the_database_cache(self):
+        call_command('createcachetable', verbosity=0)
+        for url in (self.url, reverse('tour_availability', args=[self.tour.id])):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+
+
+@override_settings(STORAGES={
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'},
+})
+class StaticPipelineTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.static_root = tempfile.mkdtemp()
+        cls.enterClassContext(override_settings(STATIC_ROOT=cls.static_root))
+        cls.report = StringIO()
+        call_command('build_assets', '--skip-css', stdout=cls.report)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.static_root)
+        super().tearDownClass()
+
+    def test_report_lists_hashed_and_compressed_sizes(self):
+        line = next(l for l in self.report.getvalue().splitlines() if l.startswith('css/output.css'))
+        served = line.split()[-1]
+        self.assertRegex(served, r'^css/output\.[0-9a-f]{12}\.css$')
+        self.assertTrue(os.path.exists(os.path.join(self.static_root, served + '.gz')))
+        self.assertTrue(os.path.exists(os.path.join(self.static_root, served + '.br')))
+
+    def test_hashed_files_are_immutable_and_video_supports_ranges(self):
+        from django.contrib.staticfiles.storage import staticfiles_storage
+        css = self.client.get(staticfiles_storage.url('css/output.css'), HTTP_ACCEPT_ENCODING='br, gzip')
+        self.assertIn('immutable', css['Cache-Control'])
+        self.assertEqual(css['Content-Encoding'], 'br')
+
+        video = self.client.get(staticfiles_storage.url('videos/pilolo.mp4'), HTTP_RANGE='bytes=0-1023')
+        self.assertEqual(video.status_code, 206)
+        self.assertEqual(video['Content-Length'], '1024')
+        self.assertNotIn('Content-Encoding', video)
+
+
+class BookingDraftTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user()
+        self.client.force_login(self.user)
+        self.schedule = make_schedule(make_tour())
+
+    def start(self, participants=2):
+        self.client.post(reverse('booking_start', args=[self.schedule.id]), {
+            'schedule': self.schedule.id, 'participants': participants, 'special_requirements': 'Vegetarian',
+        })
+        return self.client.session[drafts.SESSION_KEY]
+
+    def test_session_holds_only_the_draft_id(self):
+        draft_id = self.start()
+        session = self.client.session
+        self.assertEqual(set(session.keys()) - {'_auth_user_id', '_auth_user_backend', '_auth_user_hash'}, {drafts.SESSION_KEY})
+        self.assertEqual(drafts.get(self.user, draft_id)['special_requirements'], 'Vegetarian')
+
+    def test_stepper_count_is_saved_with_the_participants(self):
+        # The shipped locmem cache: the +/- stepper has no endpoint, the count
+        # reaches the draft only when the participant cards are submitted
+        draft_id = self.start()
+        response = self.client.get(reverse('booking_participants'))
+        self.assertNotContains(response, 'update-participant-count')
+        party = {}
+        for i in range(1, 4):
+            party.update({f'participant_{i}_full_name': f'Guest {i}', f'participant_{i}_age': '', f'participant_{i}_notes': ''})
+        self.assertRedirects(self.client.post(reverse('booking_participants'), party), reverse('booking_payment'),
+                             fetch_redirect_response=False)
+        data = BookingDraft.objects.get(pk=draft_id).data
+        self.assertEqual((data['participants'], len(data['participant_data'])), (3, 3))
+
+    def test_per_process_cache_is_bypassed(self):
+        # locmem is private to each worker: every change must reach the table
+        draft_id = self.start()
+        self.assertFalse(cache.has_key(drafts._key(self.user.pk, draft_id)))
+        self.client.post(reverse('booking_participants'), {'participant_1_full_name': 'Kofi', 'participant_1_age': '', 'participant_1_notes': ''})
+        self.assertEqual(BookingDraft.objects.get(pk=draft_id).data['participants'], 1)
+
+        # Another worker saves participants; this one sees them
+        draft = BookingDraft.objects.get(pk=draft_id)
+        draft.data = {**draft.data, 'participant_data': [{'full_name': 'Ama', 'age': '', 'notes': ''}]}
+        draft.save()
+        self.assertEqual(drafts.get(self.user, draft_id)['participant_data'][0]['full_name'], 'Ama')
+
+    @override_settings(BOOKING_DRAFT_CACHE=True)
+    def test_cache_miss_falls_back_to_last_completed_step(self):
+        draft_id = self.start(participants=1)
+        self.client.post(reverse('booking_participants'), {'participant_1_full_name': 'Ama', 'participant_1_age': '', 'participant_1_notes': ''})
+        cache.clear()
+        data = drafts.get(self.user, draft_id)
+        self.assertEqual(data['participant_data'][0]['full_name'], 'Ama')
+        self.assertIsNone(drafts.get(make_user('other@example.com'), draft_id))
+
+    def test_confirmation_discards_the_draft(self):
+        draft_id = self.start(participants=0)
+        response = self.client.post(reverse('booking_payment'), {'paymentSuccess': True, 'reference': 'T_1'}, content_type='application/json')
+        self.client.get(response.url)
+        self.assertNotIn(drafts.SESSION_KEY, self.client.session)
+        self.assertIsNone(drafts.get(self.user, draft_id))
+
+    def test_purge_removes_expired_drafts_in_chunks(self):
+        for _ in range(5):
+            drafts.create(self.user, schedule_id=self.schedule.id)
+        keep = drafts.create(self.user, schedule_id=self.schedule.id)
+        BookingDraft.objects.exclude(pk=keep).update(expires_at=timezone.now() - datetime.timedelta(minutes=1))
+        out = StringIO()
+        call_command('purge_drafts', '--chunk-size', '2', stdout=out)
+        self.assertIn('Removed 5 expired draft(s).', out.getvalue())
+        self.assertEqual([str(pk) for pk in BookingDraft.objects.values_list('pk', flat=True)], [keep])
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tour = make_tour()
+        self.schedule = make_schedule(self.tour)
+
+    def test_catalog_views_are_async(self):
+        for view in (views.home, views.tour_list, views.tour_detail, views.tour_availability, views.schedule_availability):
+            self.assertTrue(iscoroutinefunction(view), view.__name__)
+
+    async def test_async_client_reads_the_catalog(self):
+        response = await self.async_client.get(reverse('home'))
+        self.assertContains(response, 'Accra Old Town')
+        response = await self.async_client.get(reverse('tours_list'), {'search': 'jamestown'})
+        self.assertContains(response, 'Accra Old Town')
+        response = await self.async_client.get(reverse('tour_detail', args=[self.tour.id]))
+        self.assertEqual(response.context['schedules'], [self.schedule])
+        response = await self.async_client.get(reverse('tour_detail', args=[self.tour.id + 1]))
+        self.assertEqual(response.status_code, 404)
+
+        url = reverse('schedule_availability', args=[self.tour.id, self.schedule.id])
+        response = await self.async_client.get(url)
+        self.assertEqual(response.json()['remaining'], 8)
+        response = await self.async_client.get(url, headers={'if-none-match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_async_catalog_cache_shares_entries_with_the_sync_helper(self):
+        catalog_cache.reset_stats()
+        async def build():
+            return 'async'
+        self.assertEqual(catalog_cache.cached('probe', [catalog_cache.CATALOG], lambda: 'sync'), 'sync')
+        self.assertEqual(async_to_sync(catalog_cache.acached)('probe', [catalog_cache.CATALOG], build), 'sync')
+        catalog_cache.bump(catalog_cache.CATALOG)
+        self.assertEqual(async_to_sync(catalog_cache.acached)('probe', [catalog_cache.CATALOG], build), 'async')
+        self.assertEqual(catalog_cache.stats()['hits'], 1)
+
+
+class AsgiProfileTests(TransactionTestCase):
+    """The deployed entry points, each request on its own connection."""
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("Needs a test database that other threads can open.")
+        cache.clear()
+        self.tour = make_tour()
+        make_schedule(self.tour)
+
+    def test_asgi_application_serves_the_catalog(self):
+        from core.asgi import application
+        self.assertIsInstance(application, ASGIHandler)
+
+        async def get(path):
+            communicator = ApplicationCommunicator(application, {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': path, 'query_string': b'', 'headers': [(b'host', b'localhost')],
+            })
+            await communicator.send_input({'type': 'http.request', 'body': b''})
+            start = await communicator.receive_output(5)
+            body = await communicator.receive_output(5)
+            await communicator.wait()
+            return start['status'], body['body']
+
+        status, body = async_to_sync(get)(reverse('tour_detail', args=[self.tour.id]))
+        self.assertEqual(status, 200)
+        self.assertIn(b'Accra Old Town', body)
+        status, body = async_to_sync(get)(reverse('tour_availability', args=[self.tour.id]))
+        self.assertEqual(json.loads(body)['schedules'][0]['remaining'], 8)
+
+    def test_server_comparison(self):
+        paths = [reverse('home'), reverse('tour_availability', args=[self.tour.id])]
+        results = ServerComparison(paths, requests=4, concurrency=2, workers=2, latency_ms=1).run()
+        self.assertEqual(set(results), set(paths))
+        for result in results.values():
+            self.assertGreater(result['wsgi']['requests_per_s'], 0)
+            self.assertGreater(result['asgi']['requests_per_s'], 0)
+
+
+class FakePaystackHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, so connection reuse is visible
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, self.headers['Authorization'], self.client_address))
+        time.sleep(server.delay)
+        reference = self.path.rsplit('/', 1)[-1]
+        if reference in server.bodies:
+            status, body = 200, server.bodies[reference]
+        elif reference in server.transactions:
+            status, body = 200, {'status': True, 'message': 'Verification successful', 'data': server.transactions[reference]}
+        else:
+            status, body = 400, {'status': False, 'message': 'Transaction reference not found'}
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        try:
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client timed out
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(PAYSTACK_API_SECRET_KEY='sk_test_pilolo', PAYSTACK_VERIFY_AFTER=0, PAYSTACK_TIMEOUT=(1, 1))
+class PaystackTests(TestCase):
+    """Verification and webhooks against a local fake of Paystack's API."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakePaystackHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_port}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.transactions = {}
+        self.server.bodies = {}
+        self.server.requests = []
+        self.server.delay = 0
+        settings_override = override_settings(PAYSTACK_BASE_URL=self.base_url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.schedule = make_schedule(make_tour(price=Decimal('100.00'), max_participants=4))
+        self.user = make_user()
+
+    def checkout(self, reference='T_100', participants=1):
+        party = [{'full_name': f'Guest {i}', 'age': '', 'notes': ''} for i in range(participants)]
+        booking = services.commit_booking(self.user, self.schedule.id, party, transaction_reference=reference, site_name='pilolo.test')
+        return booking.payments.get()
+
+    def charge(self, reference='T_100', status='success', amount=20000, currency='GHS'):
+        return {'reference': reference, 'status': status, 'amount': amount, 'currency': currency}
+
+    def post_webhook(self, payload, secret='sk_test_pilolo'):
+        body = json.dumps(payload).encode()
+        signature = hmac.new(secret.encode(), body, hashlib.sha512).hexdigest()
+        return self.client.post(reverse('paystack_webhook'), body, content_type='application/json',
+                                headers={'x-paystack-signature': signature})
+
+    def test_webhook_checks_signature_and_records_each_delivery_once(self):
+        payload = {'event': 'charge.success', 'data': self.charge()}
+        self.assertEqual(self.post_webhook(payload, secret='sk_wrong').status_code, 401)
+        self.assertFalse(PaymentEvent.objects.exists())
+
+        self.assertEqual(self.post_webhook(payload).status_code, 200)
+        self.assertEqual(self.post_webhook(payload).status_code, 200)
+        event = PaymentEvent.objects.get()
+        self.assertEqual((event.transaction_id, event.processed_at), ('T_100', None))
+
+        self.post_webhook({'event': 'transfer.success', 'data': self.charge()})
+        self.assertIsNotNone(PaymentEvent.objects.get(event='transfer.success').processed_at)
+
+    def test_checkout_is_settled_from_the_webhook_without_calling_paystack(self):
+        payment = self.checkout()
+        self.assertEqual(self.server.requests, [])
+        self.post_webhook({'event': 'charge.success', 'data': self.charge()})
+
+        self.assertEqual(payments.process_pending(), (1, 0))
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'completed')
+        self.assertEqual(OutboxEmail.objects.get().status, 'pending')
+        self.assertIsNotNone(PaymentEvent.objects.get().processed_at)
+        self.assertEqual(self.server.requests, [])
+        self.assertEqual(payments.process_pending(), (0, 0))
+
+    def test_payment_without_webhook_is_verified_over_the_pooled_session(self):
+        first = self.checkout('T_1')
+        second = self.checkout('T_2')
+        self.server.transactions = {'T_1': self.charge('T_1'), 'T_2': self.charge('T_2')}
+
+        self.assertEqual(payments.process_pending(), (2, 0))
+        self.assertEqual(Payment.objects.get(pk=first.pk).status, 'completed')
+        self.assertEqual(Payment.objects.get(pk=second.pk).status, 'completed')
+        paths = [path for path, _, _ in self.server.requests]
+        self.assertEqual(paths, ['/transaction/verify/T_1', '/transaction/verify/T_2'])
+        self.assertEqual({auth for _, auth, _ in self.server.requests}, {'Bearer sk_test_pilolo'})
+        # Both calls went over the same kept-alive connection
+        self.assertEqual(len({client for _, _, client in self.server.requests}), 1)
+
+    def test_failed_short_or_unknown_payments_cancel_the_booking(self):
+        cases = {'T_failed': self.charge('T_failed', status='failed'),
+                 'T_short': self.charge('T_short', amount=100),
+                 'T_usd': self.charge('T_usd', currency='USD')}
+        for reference in [*cases, 'T_unknown']:
+            self.checkout(reference, participants=0)
+        self.server.transactions = cases
+        self.schedule.refresh_from_db()
+        self.assertEqual(self.schedule.booked_count, 4)
+
+        with self.assertLogs('pilolo.payments', 'WARNING'):
+            self.assertEqual(payments.process_pending(), (4, 0))
+        self.assertFalse(Payment.objects.exclude(status='failed').exists())
+        self.assertFalse(Booking.objects.exclude(status='cancelled').exists())
+        self.assertFalse(OutboxEmail.objects.exists())
+        self.schedule.refresh_from_db()
+        self.assertEqual(self.schedule.booked_count, 0)
+
+    def test_unfinished_and_unreachable_payments_stay_pending(self):
+        ongoing = self.checkout('T_ongoing', participants=0)
+        self.server.transactions = {'T_ongoing': self.charge('T_ongoing', status='ongoing')}
+        self.assertEqual(payments.process_pending(), (0, 0))
+        self.assertEqual(Payment.objects.get(pk=ongoing.pk).status, 'pending')
+
+        self.server.delay = 1.5
+        with self.assertRaises(payments.PaystackError):
+            payments.verify_transaction('T_ongoing')
+        with override_settings(PAYSTACK_BASE_URL='http://127.0.0.1:9'), self.assertLogs('pilolo.payments', 'WARNING'):
+            self.assertEqual(payments.process_pending(), (0, 1))
+        self.assertEqual(Payment.objects.get(pk=ongoing.pk).status, 'pending')
+
+    def test_unexpected_body_is_a_transient_error(self):
+        self.server.bodies = {'T_odd': ['not', 'a', 'dict']}
+        with self.assertRaises(payments.PaystackError):
+            payments.verify_transaction('T_odd')
+
+    def test_webhooks_without_a_pending_payment_are_closed_or_orphaned(self):
+        self.server.transactions = {'T_100': self.charge()}
+        self.checkout()
+        self.assertEqual(payments.process_pending(), (1, 0))
+        # The webhook arrives after the API already settled the payment
+        self.post_webhook({'event': 'charge.success', 'data': self.charge()})
+        self.post_webhook({'event': 'charge.success', 'data': self.charge('T_stray')})
+
+        self.assertEqual(payments.sweep_events(), 0)
+        self.assertIsNotNone(PaymentEvent.objects.get(transaction_id='T_100').processed_at)
+        self.assertIsNone(PaymentEvent.objects.get(transaction_id='T_stray').processed_at)
+
+        PaymentEvent.objects.update(received_at=timezone.now() - datetime.timedelta(hours=1))
+        out, err = StringIO(), StringIO()
+        with self.assertLogs('pilolo.payments', 'ERROR') as logs:
+            call_command('process_payments', '--once', stdout=out, stderr=err)
+        self.assertIn('T_stray', logs.output[0])
+        self.assertIn('1 Paystack charge(s) have no payment', err.getvalue())
+        stray = PaymentEvent.objects.get(transaction_id='T_stray')
+        self.assertTrue(stray.orphaned)
+        self.assertIsNotNone(stray.processed_at)
+        self.assertEqual(payments.sweep_events(), 0)
+
+    def test_recent_payments_wait_for_the_webhook(self):
+        self.checkout()
+        with override_settings(PAYSTACK_VERIFY_AFTER=600):
+            self.assertEqual(payments.process_pending(), (0, 0))
+        self.assertEqual(self.server.requests, [])
+
+    def test_process_payments_command(self):
+        self.checkout()
+        self.post_webhook({'event': 'charge.success', 'data': self.charge()})
+        out = StringIO()
+        call_command('process_payments', '--once', stdout=out)
+        self.assertIn('Settled 1 payment(s), 0 could not be verified.', out.getvalue())
+
+
+def full_scans(queryset):
+    """Tables (or aliases) the database would read in full to answer ``queryset``."""
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # Small tables are cheaper to scan, so only report scans the planner cannot avoid
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN {sql}', params)
+            return [table for (line,) in cursor.fetchall() for table in re.findall(r'Seq Scan on (\w+)', line)]
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return [
+            match.group(1) for *_, detail in cursor.fetchall()
+            if (match := re.fullmatch(r'SCAN (?:TABLE )?(\w+)(?: AS \w+)?', detail))
+        ]
+
+
+class QueryPlanTests(TestCase):
+    """Every hot query must be answered from an index on a realistic amount of data."""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_data', scale=5, stdout=StringIO())
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.user = CustomUser.objects.annotate(n=Count('booking')).order_by('-n').first()
+        cls.schedule = TourSchedule.objects.annotate(n=Count('bookings')).order_by('-n').first()
+        cls.booking = cls.schedule.bookings.first()
+
+    def assertIndexed(self, queryset):
+        self.assertEqual(full_scans(queryset), [], str(queryset.query))
+
+    def test_my_bookings(self):
+        bookings = Booking.objects.filter(user=self.user).for_listing()
+        for queryset in (
+            bookings,
+            bookings.filter(status='confirmed'),
+            bookings.filter(status__in=['confirmed', 'pending'], tour_date__gte=timezone.localdate()),
+        ):
+            with self.subTest(query=str(queryset.query.where)):
+                self.assertIndexed(CursorPaginator(queryset, ('-booking_date', '-id'), 10)._after_cursor(None))
+
+    def test_seat_counting(self):
+        self.assertIndexed(TourSchedule.objects.filter(pk=self.schedule.pk).annotate(seats=confirmed_seats()))
+        self.assertIndexed(Booking.objects.filter(schedule=self.schedule, status='confirmed'))
+        self.assertIndexed(SeatHold.objects.active().filter(schedule=self.schedule))
+
+    def test_schedules_by_tour_and_date(self):
+        today = timezone.localdate()
+        schedules = TourSchedule.objects.filter(
+            tour=self.schedule.tour_id, date__range=(today, today + datetime.timedelta(days=120))
+        )
+        self.assertIndexed(schedules.with_availability().order_by('date', 'start_time'))
+
+    def test_payments(self):
+        self.assertIndexed(Payment.objects.filter(booking=self.booking))
+        self.assertIndexed(Payment.objects.filter(status='pending').order_by('payment_date')[:50])
+        self.assertIndexed(BookingParticipant.objects.filter(booking=self.booking))
+
+    def search(self, model, term):
+        model_admin = django_admin.site._registry[model]
+        return model_admin.get_search_results(None, model.objects.all(), term)[0]
+
+    def test_admin_search(self):
+        email = self.booking.user.email
+        for model, term in (
+            (Booking, self.booking.reference),
+            (Booking, email),
+            (BookingParticipant, self.booking.reference),
+            (Payment, email),
+            (PaymentEvent, 'T_1'),
+        ):
+            with self.subTest(model=model.__name__, term=term):
+                self.assertIndexed(self.search(model, term))
+
+        self.assertEqual(set(self.search(Booking, email)), set(Booking.objects.filter(user__email=email)))
+        self.assertEqual(set(self.search(Payment, f' {self.booking.reference} ')), set(self.booking.payments.all()))
+
+    def test_detects_a_full_scan(self):
+        self.assertNotEqual(full_scans(Booking.objects.filter(special_requirements='Vegetarian')), [])
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTests(TransactionTestCase):
+    """Two SQLite files: ``default`` has the writes, ``replica`` lags behind with none of them."""
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("Needs file-backed databases.")
+        cache.clear()
+        self.user = make_user()
+        self.client.force_login(self.user)
+        self.tour = make_tour()
+        Booking.objects.create(user=self.user, schedule=make_schedule(self.tour), status='confirmed')
+
+    def test_router(self):
+        router = routers.ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Tour))
+        with routers._reading(True):
+            self.assertEqual(router.db_for_read(Tour), 'replica')
+            self.assertIsNone(router.db_for_read(Session))
+            with routers.primary():
+                self.assertIsNone(router.db_for_read(Tour))
+            self.assertEqual(router.db_for_write(Tour), 'default')
+
+    def test_user_reads_their_own_writes_then_returns_to_the_replica(self):
+        def listed():
+            return len(self.client.get(reverse('my_bookings')).context['bookings'])
+
+        self.assertEqual(listed(), 0)
+        response = self.client.post(reverse('booking_hold'))
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+        self.assertEqual(listed(), 1)
+
+        self.client.cookies[routers.PIN_COOKIE] = str(time.time() - 1)
+        self.assertEqual(listed(), 0)
+
+    def test_async_views_route_too_and_fresh_bumps_build_from_the_primary(self):
+        # Uncached search runs on the replica, where the tour is not indexed yet
+        response = self.client.get(reverse('tours_list'), {'search': 'jamestown'})
+        self.assertEqual(list(response.context['tours']), [])
+        # The tour was just written, so its catalog pages are built from the primary
+        self.assertContains(self.client.get(reverse('home')), 'Accra Old Town')
+        self.assertEqual(self.client.get(reverse('tour_detail', args=[self.tour.id])).status_code, 200)
+
+        self.client.cookies[routers.PIN_COOKIE] = str(time.time() + 60)
+        response = self.client.get(reverse('tours_list'), {'search': 'jamestown'})
+        self.assertEqual(list(response.context['tours']), [self.tour])
+
+    def test_settled_cache_misses_are_built_on_the_replica(self):
+        cache.clear()  # no recent bumps
+        self.assertNotContains(self.client.get(reverse('home')), 'Accra Old Town')
+        self.assertEqual(self.client.get(reverse('tour_detail', args=[self.tour.id])).status_code, 404)
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'pilolo_test_cache',
+    }})
+    def test_database_cache_writes_do_not_pin(self):
+        call_command('createcachetable', database='default', verbosity=0)
+        self.client.logout()
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+
+
+class SQLiteProfileTests(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor != 'sqlite' or connection.is_in_memory_db():
+            self.skipTest("Needs a file-backed SQLite database.")
+
+    def test_connections_use_the_tuned_pragmas(self):
+        with connection.cursor() as cursor:
+            pragmas = {}
+            for name in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size', 'cache_size'):
+                cursor.execute(f'PRAGMA {name}')
+                pragmas[name] = cursor.fetchone()[0]
+        self.assertEqual(pragmas, {
+            'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 5000, 'mmap_size': 134217728, 'cache_size': -20000,
+        })
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+    def test_retry_when_locked(self):
+        calls = []
+
+        @holds.retry_when_locked
+        def flaky(error):
+            calls.append(error)
+            if len(calls) < 3:
+                raise OperationalError(error)
+            return 'done'
+
+        self.assertEqual(flaky('database is locked'), 'done')
+        self.assertEqual(len(calls), 3)
+
+        calls.clear()
+        with self.assertRaises(OperationalError):
+            flaky('no such table: booking')
+        self.assertEqual(len(calls), 1)
+
+        calls.clear()
+        with self.assertRaises(OperationalError), transaction.atomic():
+            flaky('database is locked')
+        self.assertEqual(len(calls), 1)
+
+        calls.clear()
+        with override_settings(SQLITE_LOCK_RETRIES=1), self.assertRaises(OperationalError):
+            flaky('database is locked')
+        self.assertEqual(len(calls), 2)
+
+    def test_checkout_waits_for_another_writer(self):
+        schedule = make_schedule(make_tour())
+        user = make_user()
+        locked, release = threading.Event(), threading.Event()
+
+        def other_writer():
+            other = sqlite3.connect(connection.settings_dict['NAME'])
+            other.execute('BEGIN IMMEDIATE')
+            locked.set()
+            release.wait(5)
+            other.rollback()
+            other.close()
+
+        thread = threading.Thread(target=other_writer)
+        thread.start()
+        locked.wait(5)
+        threading.Timer(0.3, release.set).start()
+        booking = services.commit_booking(user, schedule.id, [], transaction_reference='T_1')
+        thread.join()
+        self.assertTrue(release.is_set())
+        self.assertEqual(booking.payments.get().transaction_id, 'T_1')
+
+    def test_write_benchmark(self):
+        results = SQLiteWriteBenchmark(processes=2, bookings=2).run()
+        for profile in ('default', 'tuned'):
+            self.assertEqual((results[profile]['booked'], results[profile]['failed']), (4, 0))
+        self.assertIn('speedup', results)
+        # The test database is back in place
+        self.assertEqual(connection.settings_dict['NAME'], connection.creation._get_test_db_name())
+        self.assertFalse(Tour.objects.exists())
+
+
+class AvailabilityCalendarTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('availability_calendar')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tour = make_tour(max_participants=5)
+            self.schedule = make_schedule(self.tour, date=datetime.date(2030, 3, 9))
+            self.april = make_schedule(self.tour, date=datetime.date(2030, 4, 6))
+
+    def departures(self, response):
+        return {
+            departure['id']: departure['seats_remaining']
+            for week in response.context['weeks'] for cell in week for departure in cell['departures']
+        }
+
+    def add_tours(self, count):
+        with self.captureOnCommitCallbacks(execute=True):
+            for n in range(count):
+                make_schedule(make_tour(name=f'Tour {n}'), date=datetime.date(2030, 3, 10 + n))
+
+    def test_query_count_does_not_grow_with_tours(self):
+        self.add_tours(1)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(self.url, {'month': '2030-03'})
+        self.add_tours(5)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(self.url, {'month': '2030-03'})
+        self.assertEqual(len(few), 1)
+        self.assertEqual(len(many), len(few))
+        self.assertEqual(len(self.departures(response)), 7)
+
+    def test_remaining_seats_and_month_grid(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            booking = Booking.objects.create(user=make_user(), schedule=self.schedule, status='confirmed')
+            BookingParticipant.objects.create(booking=booking, full_name='Ama Mensah')
+        response = self.client.get(self.url, {'month': '2030-03'})
+        self.assertEqual(self.departures(response), {self.schedule.id: 3})
+        self.assertEqual(response.context['weeks'][0][0]['date'], datetime.date(2030, 2, 25))
+        self.assertEqual(response.context['previous_month'], datetime.date(2030, 2, 1))
+        self.assertEqual(response.context['next_month'], datetime.date(2030, 4, 1))
+        self.assertContains(response, '3 left')
+        self.assertContains(response, reverse('booking_start', args=[self.schedule.id]))
+
+        partial = self.client.get(self.url, {'month': 'nonsense'}, headers={'HX-Request': 'true'})
+        self.assertEqual(partial.context['month'], timezone.localdate().replace(day=1))
+        self.assertNotContains(partial, '<html')
+
+    def test_booking_invalidates_only_its_month(self):
+        self.client.get(self.url, {'month': '2030-03'})
+        self.client.get(self.url, {'month': '2030-04'})
+        with self.assertNumQueries(0):
+            self.client.get(self.url, {'month': '2030-03'})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Booking.objects.create(user=make_user(), schedule=self.april, status='confirmed')
+        with self.assertNumQueries(0):
+            self.client.get(self.url, {'month': '2030-03'})
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {'month': '2030-04'})
+        self.assertEqual(self.departures(response), {self.april.id: 4})
@@ -4,6 +4,8 @@ from . import views
 urlpatterns = [
     path('', views.home, name='home'),
     path('tour/<int:tour_id>/', views.tour_detail, name='tour_detail'),
+    path('tour/<int:tour_id>/availability/', views.tour_availability, name='tour_availability'),
+    path('tour/<int:tour_id>/schedule/<int:schedule_id>/availability/', views.schedule_availability, name='schedule_availability'),
     # path('booking-form/', views.booking_form, name='booking_form'),
     # path('create-booking/', views.create_booking, name='create_booking'),
     path('bookings/', views.my_bookings, name='my_bookings'),
@@ -13,8 +15,14 @@ urlpatterns = [
     path('book/schedule/<int:schedule_id>/', views.booking_start, name='booking_start'),
     path('book/participants/', views.booking_participants, name='booking_participants'),
     path('book/schedule/payment/', views.booking_payment, name='booking_payment'),
+    path('book/hold/', views.booking_hold, name='booking_hold'),
     path('book/confirmation/<str:reference>/', views.booking_confirmation, name='booking_confirmation'),
+    path('book/unfulfilled/<str:reference>/', views.booking_unfulfilled, name='booking_unfulfilled'),
+    path('payments/paystack/webhook/', views.paystack_webhook, name='paystack_webhook'),
     path('bookings/<int:booking_id>/', views.booking_details, name='booking_details'),
-    path('update-participant-count/', views.update_participant_count, name='update_participant_count'),
     path('tours/', views.tour_list, name='tours_list'),
+    path('tours/search/', views.tour_search, name='tour_search'),
+    path('tours/calendar/', views.availability_calendar, name='availability_calendar'),
+    path('staff/cache-stats/', views.catalog_cache_stats, name='catalog_cache_stats'),
+    path('staff/exports/<str:kind>.csv', views.export_csv, name='export_csv'),
 ]
\ No newline at end of file
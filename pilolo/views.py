@@ -1,65 +1,172 @@
+import calendar
+import datetime
+from collections import defaultdict
+from functools import wraps
 from django.utils import timezone
 import json
 from django.conf import settings
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse, HttpResponse
+from django.http import Http404, JsonResponse, HttpResponse, StreamingHttpResponse
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
+from django.views.decorators.cache import cache_control
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.urls import reverse
-from .models import BookingParticipant, Payment, Tour, TourSchedule, Booking
-from .forms import BookingForm
-from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from .models import Tour, TourSchedule, Booking
+from .forms import BookingForm, ExportFilterForm
+from . import cache as catalog_cache, drafts, exports, holds, payments, search, services
+from .pagination import CursorPage, CursorPaginator
+from .routers import replica_reads
 import logging
-from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
-from django.core.paginator import Paginator
+from asgiref.sync import sync_to_async
 
 
 
 logger = logging.getLogger(__name__)
 
 
-def home(request):
-    tours = Tour.objects.all()[:5]  # Limit to 5 tours for the home page
-    logger.info(f"Loaded {tours.count()} tours for home page")
+# The public catalog views are async: their reads go through the async ORM
+# and cache APIs, so under ASGI a slow query or cache call waits on the event
+# loop instead of holding a worker. Template rendering stays sync because the
+# templates read the session-backed user and messages.
+arender = sync_to_async(render)
+
+
+async def _home_tours():
+    return [tour async for tour in Tour.objects.all()[:5]]
+
+
+@replica_reads
+async def home(request):
+    # Limit to 5 tours for the home page
+    tours = await catalog_cache.acached('home_tours', [catalog_cache.CATALOG], _home_tours)
+    logger.info(f"Loaded {len(tours)} tours for home page")
     if not tours:
         messages.info(request, "No tours available at the moment. Please check back later.")
-    return render(request, 'pilolo/home.html', {'tours': tours})
+    return await arender(request, 'pilolo/home.html', {'tours': tours})
 
 
-def tour_detail(request, tour_id):
-    tour = get_object_or_404(Tour, id=tour_id)
-    schedules = tour.schedules.all()
+@replica_reads
+async def tour_detail(request, tour_id):
+    tour, schedules = await _cached_tour_detail(tour_id)
+    if tour is None:
+        raise Http404("No Tour matches the given query.")
     if not schedules:
         messages.info(request, "No schedules available for this tour. Please check back later.")
-    return render(request, 'pilolo/tour_details.html', {
+    return await arender(request, 'pilolo/tour_details.html', {
         'tour': tour,
         'schedules': schedules
     })
 
 
+async def _load_tour_detail(tour_id, today):
+    tour = await Tour.objects.filter(id=tour_id).afirst()
+    if tour is None:
+        return None, []
+    # Only the bookable window, read through the (tour, date) index
+    until = today + datetime.timedelta(days=getattr(settings, 'TOUR_DETAIL_WINDOW_DAYS', 120))
+    schedules = TourSchedule.objects.filter(tour=tour, date__range=(today, until))
+    return tour, [s async for s in schedules.with_availability().order_by('date', 'start_time')]
+
+
+async def _cached_tour_detail(tour_id):
+    today = timezone.localdate()
+    return await catalog_cache.acached(
+        f'tour_detail:{today}', [catalog_cache.tour_scope(tour_id)], lambda: _load_tour_detail(tour_id, today)
+    )
+
+
+async def _availability_etag(tour_id):
+    # The tour's cache version changes on every booking, participant or
+    # schedule write, so it stamps availability without touching bookings.
+    version = await catalog_cache.aversion(catalog_cache.tour_scope(tour_id))
+    return quote_etag(f"{tour_id}.{version}.{timezone.localdate():%Y%m%d}")
+
+
+def _availability_condition(view):
+    """``condition(etag_func=...)`` for the async availability views.
+
+    Django's decorator calls the ETag function synchronously, which cannot
+    reach a database-backed cache from inside an async view.
+    """
+    @wraps(view)
+    async def wrapper(request, tour_id, *args, **kwargs):
+        etag = await _availability_etag(tour_id)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = await view(request, tour_id, *args, **kwargs)
+            response.headers.setdefault('ETag', etag)
+        return response
+    return wrapper
+
+
+def _availability(schedule):
+    return {
+        'id': schedule.id,
+        'date': schedule.date,
+        'start_time': schedule.start_time,
+        'remaining': max(schedule.remaining_slots, 0),
+        'fully_booked': schedule.is_fully_booked,
+    }
+
+
+@require_http_methods(["GET", "HEAD"])
+@cache_control(private=True, no_cache=True)
+@_availability_condition
+async def tour_availability(request, tour_id):
+    """Remaining seats for every upcoming schedule of a tour; answers 304 while unchanged."""
+    tour, schedules = await _cached_tour_detail(tour_id)
+    if tour is None:
+        raise Http404("No Tour matches the given query.")
+    return JsonResponse({'tour': tour.id, 'schedules': [_availability(s) for s in schedules]})
+
+
+@require_http_methods(["GET", "HEAD"])
+@cache_control(private=True, no_cache=True)
+@_availability_condition
+async def schedule_availability(request, tour_id, schedule_id):
+    """Remaining seats for one schedule; answers 304 while unchanged."""
+    tour, schedules = await _cached_tour_detail(tour_id)
+    schedule = next((s for s in schedules if s.id == schedule_id), None)
+    if schedule is None:
+        # Outside the cached window
+        schedule = await TourSchedule.objects.with_availability().filter(id=schedule_id, tour=tour_id).afirst()
+        if schedule is None:
+            raise Http404("No TourSchedule matches the given query.")
+    return JsonResponse(_availability(schedule))
+
+
 @require_http_methods(["GET", "POST"])
 @login_required(login_url='account_login', redirect_field_name='next')
 def booking_start(request, schedule_id):
-    schedule = get_object_or_404(TourSchedule, id=schedule_id)
+    schedule = get_object_or_404(TourSchedule.objects.with_availability(), id=schedule_id)
     
     if request.method == 'POST':
         form = BookingForm(request.POST, initial={'schedule': schedule}, user=request.user)
         if form.is_valid():
             print("PART", form.cleaned_data['participants'])
-            request.session['booking'] = {
-                'schedule_id': schedule.id,
-                'participants': form.cleaned_data['participants'],
-                'special_requirements': form.cleaned_data['special_requirements'],
-            } 
-            print(form.cleaned_data['participants'])
+            try:
+                # Hold the seats (booker included) while the user finishes the wizard
+                holds.place_hold(schedule.id, request.user, form.cleaned_data['participants'] + 1)
+            except holds.SeatsUnavailable as e:
+                form.add_error('participants', str(e))
+            else:
+                drafts.start(
+                    request,
+                    schedule_id=schedule.id,
+                    participants=form.cleaned_data['participants'],
+                    special_requirements=form.cleaned_data['special_requirements'],
+                )
+                print(form.cleaned_data['participants'])
 
-            if form.cleaned_data['participants'] == 0:
-                return redirect('booking_payment')
+                if form.cleaned_data['participants'] == 0:
+                    return redirect('booking_payment')
 
-            return redirect('booking_participants')
+                return redirect('booking_participants')
     else:
         form = BookingForm(initial={
             'schedule': schedule,
@@ -75,15 +182,15 @@ def booking_start(request, schedule_id):
 
 @login_required(login_url='account_login')
 def booking_participants(request):
-    # Get booking data from session
-    booking_data = request.session.get('booking')
+    # Get the wizard draft (the session only holds its id)
+    booking_data = drafts.load(request)
     if not booking_data:
         messages.error(request, "No booking data found. Please start over.")
         return redirect('home')
 
-    schedule = get_object_or_404(TourSchedule, id=booking_data['schedule_id'])
+    schedule = get_object_or_404(TourSchedule.objects.with_availability(), id=booking_data['schedule_id'])
     participant_count = int(booking_data['participants'])
-    print(f"Participant count from session: {participant_count}")
+    print(f"Participant count from draft: {participant_count}")
     tour = schedule.tour
     participants = []
 
@@ -91,6 +198,11 @@ def booking_participants(request):
     print(participant_count)
     # Handle case with additional participants
     if request.method == 'POST':
+        # The +/- stepper only changes the page; the submitted cards (numbered
+        # 1..n by the page) are the final count, saved with the participants
+        participant_count = 0
+        while f'participant_{participant_count + 1}_full_name' in request.POST:
+            participant_count += 1
         if participant_count > 0:
             has_errors = False
 
@@ -123,8 +235,8 @@ def booking_participants(request):
                      'participants_data': participants  # Return data to repopulate form
                  })
 
-        # store participants in session
-        request.session['participants'] = participants
+        # store participants in the draft
+        drafts.save(request, participants=participant_count, participant_data=participants)
         
         return redirect('booking_payment')
 
@@ -142,55 +254,46 @@ def booking_participants(request):
 
 @login_required(login_url='account_login')
 def booking_payment(request):
-    booking_data = request.session.get('booking')
+    booking_data = drafts.load(request)
     if not booking_data:
         messages.error(request, "No booking data found. Please start over.")
         return redirect('home')
-    participants_data = request.session.get('participants', [])
+    participants_data = booking_data.get('participant_data', [])
     participant_count = len(participants_data)
-    schedule = get_object_or_404(TourSchedule, id=booking_data['schedule_id'])
+    schedule = get_object_or_404(TourSchedule.objects.select_related('tour'), id=booking_data['schedule_id'])
     tour = schedule.tour
    
 
     if request.method == 'POST':
         data = request.body.decode('utf-8')
         data = json.loads(data) if data else {}
-        payment_success = data.get('paymentSuccess', False)
         transaction_reference = data.get('reference', None)
-        booking = Booking.objects.create(
-            user=request.user,
-            schedule=schedule,
-            tour_date=schedule.date,
-            special_requirements=booking_data['special_requirements'],
-            status='confirmed',
-        )
-
-        if participants_data:
-            for p in participants_data:
-                BookingParticipant.objects.create(
-                    booking=booking,
-                    full_name=p['full_name'],
-                    age=p['age'] if p['age'] else None,
-                    notes=p['notes']
-                )
-        
-        # save payment details
-        Payment.objects.get_or_create(
-            booking=booking,
-            amount=booking.total_price,
-            payment_date=timezone.now(),
-            status= 'completed' if payment_success else 'failed',
-            transaction_id=transaction_reference if payment_success else None
-        )
-
-        # send confirmation email
-        if payment_success:
-            try:
-                send_booking_confirmation_email(request, booking)
-            except Exception as e:
-                logger.error(f"Failed to send confirmation email: {str(e)}")
-                # Don't fail the booking if email fails, just log it
-            messages.success(request, "Booking successful! A confirmation email has been sent to you.")
+        # Only a Paystack callback books seats; payments.settle() then checks the charge
+        if not data.get('paymentSuccess') or not transaction_reference:
+            return JsonResponse({'error': "No completed payment to book with."}, status=400)
+        try:
+            booking = services.commit_booking(
+                request.user,
+                schedule.id,
+                participants_data,
+                special_requirements=booking_data['special_requirements'],
+                transaction_reference=transaction_reference,
+                site_name=request.get_host(),
+            )
+        except holds.SeatsUnavailable as e:
+            logger.warning(f"Seats ran out for schedule {schedule.id}: {e}")
+            # Paystack has already charged the card: keep a record to refund from
+            booking = services.record_refund_due(
+                request.user,
+                schedule.id,
+                participants_data,
+                special_requirements=booking_data['special_requirements'],
+                transaction_reference=transaction_reference,
+            )
+            logger.error(f"Payment {transaction_reference} for booking {booking.reference} needs a refund: {e}")
+            return redirect('booking_unfulfilled', reference=booking.reference)
+
+        messages.success(request, "Booking received! Your confirmation email will follow once Paystack confirms the payment.")
         return redirect('booking_confirmation', reference=booking.reference)
 
     return render(request, 'pilolo/booking/booking_process.html', {
@@ -204,55 +307,62 @@ def booking_payment(request):
         'participants_data': participants_data  # Pass data to payment step
     })
 
-def send_booking_confirmation_email(request, booking):
-    """Send booking confirmation email to the user"""
-    subject = f"Your Tour Booking Confirmation - {booking.schedule.tour.name}"
-    from_email = settings.DEFAULT_FROM_EMAIL
-    recipient_list = [booking.user.email]
-    
-    # Prepare context for the email template
-    context = {
-        'user': booking.user,
-        'booking': booking,
-        'tour': booking.schedule.tour,
-        'schedule': booking.schedule,
-        'participants': booking.participant_details.all(),
-        'total_price': booking.total_price,
-        'site_name': request.get_host(),
-    }
-    
-    # Render email templates
-    text_content = render_to_string('emails/booking_confirmation.txt', context)
-    html_content = render_to_string('emails/booking_confirmation.html', context)
-    
-    # Create and send email
-    email = EmailMultiAlternatives(
-        subject,
-        text_content,
-        from_email,
-        recipient_list
-    )
-    email.attach_alternative(html_content, "text/html")
-    email.send()
+@require_http_methods(["POST"])
+@login_required(login_url='account_login')
+def booking_hold(request):
+    """Renew the seat hold just before the Paystack popup opens.
+
+    Answers 409 if the seats are no longer free, so the page never takes a
+    payment for a booking that cannot be made.
+    """
+    booking_data = drafts.load(request)
+    if not booking_data:
+        return JsonResponse({'error': "No booking data found. Please start over."}, status=409)
+    seats = len(booking_data.get('participant_data', [])) + 1
+    try:
+        hold = holds.place_hold(booking_data['schedule_id'], request.user, seats)
+    except holds.SeatsUnavailable as e:
+        return JsonResponse({'error': f"Sorry, this tour filled up while you were booking. {e}"}, status=409)
+    return JsonResponse({'seats': hold.seats, 'expires_at': hold.expires_at})
+
+
+@login_required(login_url='account_login')
+def booking_unfulfilled(request, reference):
+    """Shown when a payment went through but the seats had gone."""
+    booking = get_object_or_404(Booking.objects.for_listing(), reference=reference, user=request.user)
+    payment = get_object_or_404(booking.payments, status='refund_due')
+    drafts.discard(request)
+    return render(request, 'pilolo/booking/unfulfilled.html', {'booking': booking, 'payment': payment})
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def paystack_webhook(request):
+    """Record a signed Paystack event; ``process_payments`` settles the booking later."""
+    if not payments.valid_signature(request.body, request.headers.get('X-Paystack-Signature', '')):
+        return HttpResponse(status=401)
+    try:
+        payments.record_event(json.loads(request.body))
+    except (ValueError, KeyError, TypeError):
+        return HttpResponse(status=400)
+    # Repeated deliveries get a 200 too, so Paystack stops retrying
+    return HttpResponse(status=200)
+
 
 @login_required(login_url='account_login')
 def booking_confirmation(request, reference):
-    booking = get_object_or_404(Booking, reference=reference)
+    booking = get_object_or_404(Booking.objects.for_listing(), reference=reference, user=request.user)
     schedule = booking.schedule
-    participant_count = booking.participant_details.count()
+    participant_count = booking.participant_count
     special_requirements = booking.special_requirements
     participants_data = booking.participant_details.all()
 
     if not schedule:
         return redirect('home')
 
-    schedule = get_object_or_404(TourSchedule, id=schedule.id)
-
-    # Clear booking-related session data after confirmation
-    if 'booking' in request.session:
-        del request.session['booking']
-    if 'participants' in request.session:
-        del request.session['participants']
+    # Clear the wizard draft after confirmation
+    drafts.discard(request)
+    payment = booking.payments.order_by('-id').first()
 
     return render(request, 'pilolo/booking/booking_process.html', {
         'schedule': schedule,
@@ -261,11 +371,12 @@ def booking_confirmation(request, reference):
         'special_requirements': special_requirements,
         'participants_data': participants_data,
         'booking': booking,
+        'payment': payment,
     })
 
 @login_required(login_url='account_login')
 def booking_details(request, booking_id):
-    booking = get_object_or_404(Booking, id=booking_id, user=request.user)
+    booking = get_object_or_404(Booking.objects.for_listing(), id=booking_id, user=request.user)
     payment = booking.payments.first()
     context = {
         'booking': booking,
@@ -281,75 +392,139 @@ def booking_details(request, booking_id):
 
 
 @login_required(login_url='account_login')
+@replica_reads
 def my_bookings(request):
     # Get status from request (default to 'all')
     status = request.GET.get('status', 'all')
     
     # Base queryset
-    bookings_list = Booking.objects.filter(user=request.user).order_by('-booking_date')
+    bookings_list = Booking.objects.filter(user=request.user).for_listing()
     
     # Apply status filter if not 'all'
     if status == 'upcoming':
         bookings_list = bookings_list.filter(status__in=['confirmed', 'pending'], tour_date__gte=timezone.now().date())
     elif status == 'confirmed':
         bookings_list = bookings_list.filter(status='confirmed')
-        print(f"Filtered bookings for completed status: {bookings_list.count()}")
     elif status == 'cancelled':
         bookings_list = bookings_list.filter(status='cancelled')
     
-    # Pagination
-    paginator = Paginator(bookings_list, 10)  # Show 10 bookings per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Keyset pagination: newest first, 10 at a time
+    paginator = CursorPaginator(bookings_list, ('-booking_date', '-id'), 10)
+    page = paginator.page(request.GET.get('cursor'))
+    context = {
+        'bookings': page,
+        'page': page,
+        'current_status': status,
+    }
 
     if request.headers.get('HX-Request'):
+        if paginator.decode(request.GET.get('cursor')) is not None:
+            # "Load more": just the next cards, swapped in for the trigger
+            return render(request, 'pilolo/partials/booking_cards.html', context)
         # Return just the bookings list partial for HTMX requests
-        return render(request, 'pilolo/partials/bookings_list.html', {
-            'bookings': page_obj,
-            'is_paginated': page_obj.has_other_pages(),
-            'page_obj': page_obj,
-            'current_status': status
-        })
+        return render(request, 'pilolo/partials/bookings_list.html', context)
     
-    return render(request, 'pilolo/my_bookings.html', {
-        'page_obj': page_obj,
-        'is_paginated': page_obj.has_other_pages(),
-        'bookings': page_obj,  # For backward compatibility
-        'current_status': status  # Pass the current status to template
-    })
-
-def update_participant_count(request):
-    logger.info("Updating participant count")
-    if request.method == 'POST':
-        data = json.loads(request.body)
-        count = data.get('count', 0)
-        request.session['booking']['participants'] = count
-        request.session.modified = True
-
-        logger.info(f"Participant count updated to {count}")
-        print(f"Participant count updated to {count}")
+    return render(request, 'pilolo/my_bookings.html', context)
 
-        return JsonResponse({'status': 'success'})
-    return JsonResponse({'status': 'error'}, status=400)
-
-
-def tour_list(request):
-    tours = Tour.objects.all().order_by('name')
-    
+@replica_reads
+async def tour_list(request):
+    cursor = ''
     # Handle search
     if 'search' in request.GET:
         search_term = request.GET['search']
-        tours = tours.filter(name__icontains=search_term)
-        if not tours:
+        # Ranked results are ordered by relevance, so they come as one page
+        page = CursorPage(await sync_to_async(search.search_tours)(search_term, limit=60), None)
+        if not page:
             messages.info(request, "No tours found matching your search criteria.")
-    
-    # Pagination
-    paginator = Paginator(tours, 9)  # Show 9 tours per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    
-    return render(request, 'pilolo/tour_list.html', {
-        'page_obj': page_obj,
-        'tours': page_obj,  # For backward compatibility
-        'is_paginated': page_obj.has_other_pages(),
-    })
\ No newline at end of file
+    else:
+        paginator = CursorPaginator(Tour.objects.all(), ('name', 'id'), 9)  # Show 9 tours per page
+        if paginator.decode(request.GET.get('cursor')) is not None:
+            cursor = request.GET['cursor']
+        page = await catalog_cache.acached(
+            f'tour_list:{cursor}', [catalog_cache.CATALOG], lambda: paginator.apage(cursor)
+        )
+
+    context = {
+        'page': page,
+        'tours': page,  # For backward compatibility
+    }
+    if request.headers.get('HX-Request') and cursor:
+        return await arender(request, 'pilolo/partials/tour_cards.html', context)
+    return await arender(request, 'pilolo/tour_list.html', context)
+
+
+def _month_start(value):
+    """First day of the ``YYYY-MM`` month in ``value``, or of this month if it is missing or invalid."""
+    try:
+        return datetime.date.fromisoformat(f'{value}-01')
+    except (TypeError, ValueError):
+        return timezone.localdate().replace(day=1)
+
+
+async def _load_calendar(first, last):
+    # One grouped aggregate over schedules and their confirmed bookings for
+    # every tour at once, instead of a per-schedule seat count
+    schedules = (
+        TourSchedule.objects.filter(date__range=(first, last))
+        .with_availability()
+        .order_by('date', 'start_time', 'tour__name')
+        .values('id', 'tour_id', 'tour__name', 'date', 'start_time', 'seats_remaining')
+    )
+    return [row async for row in schedules]
+
+
+@replica_reads
+async def availability_calendar(request):
+    """Month view of every tour's departures and the seats left on each."""
+    month = _month_start(request.GET.get('month'))
+    last = month.replace(day=calendar.monthrange(month.year, month.month)[1])
+    departures = await catalog_cache.acached(
+        f'calendar:{month:%Y-%m}',
+        [catalog_cache.CATALOG, catalog_cache.month_scope(month)],
+        lambda: _load_calendar(month, last),
+    )
+    by_day = defaultdict(list)
+    for departure in departures:
+        by_day[departure['date']].append(departure)
+
+    context = {
+        'month': month,
+        'weeks': [
+            [{'date': day, 'in_month': day.month == month.month, 'departures': by_day[day]} for day in week]
+            for week in calendar.Calendar().monthdatescalendar(month.year, month.month)
+        ],
+        'previous_month': (month - datetime.timedelta(days=1)).replace(day=1),
+        'next_month': last + datetime.timedelta(days=1),
+        'today': timezone.localdate(),
+    }
+    if request.headers.get('HX-Request'):
+        return await arender(request, 'pilolo/partials/calendar_month.html', context)
+    return await arender(request, 'pilolo/availability_calendar.html', context)
+
+
+@replica_reads
+def tour_search(request):
+    """HTMX typeahead for the tour list search box: the best few matches."""
+    query = request.GET.get('search', '').strip()
+    tours = search.search_tours(query, limit=8) if query else []
+    return render(request, 'pilolo/partials/search_results.html', {'tours': tours, 'query': query})
+
+
+@staff_member_required
+def catalog_cache_stats(request):
+    # Counters are per process: this reports whichever worker served the request
+    return JsonResponse(catalog_cache.stats())
+
+
+@staff_member_required
+def export_csv(request, kind):
+    """Stream a bookings, participants (departure roster) or payments CSV."""
+    if kind not in exports.EXPORTS:
+        raise Http404
+    form = ExportFilterForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    filters = {name: value for name, value in form.cleaned_data.items() if value}
+    response = StreamingHttpResponse(exports.stream_csv(kind, **filters), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="pilolo-{kind}.csv"'
+    return response
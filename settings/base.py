@@ -19,7 +19,16 @@ load_dotenv() # Load environment variables from .env file
 # ... other settings
 
 PAYSTACK_API_PUBLIC_KEY = os.getenv('PAYSTACK_API_PUBLIC_KEY')
-# PAYSTACK_API_SECRET_KEY = os.getenv('PAYSTACK_API_SECRET_KEY')
+PAYSTACK_API_SECRET_KEY = os.getenv('PAYSTACK_API_SECRET_KEY', '')
+PAYSTACK_BASE_URL = os.getenv('PAYSTACK_BASE_URL', 'https://api.paystack.co')
+PAYSTACK_CURRENCY = 'GHS'
+# (connect, read) seconds for every Paystack API call
+PAYSTACK_TIMEOUT = (3.05, 10)
+PAYSTACK_POOL_SIZE = int(os.getenv('PAYSTACK_POOL_SIZE', 10))
+# Pending payments with no webhook after this many seconds are verified by polling
+PAYSTACK_VERIFY_AFTER = 60
+# A charge.success webhook with no matching payment after this many seconds is flagged for refund
+PAYSTACK_ORPHAN_AFTER = 15 * 60
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -46,7 +55,7 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
-    'django.contrib.staticfiles',
+    'pilolo.apps.PiloloStaticFilesConfig',  # django.contrib.staticfiles
 
     'widget_tweaks',  # For form styling
 
@@ -104,12 +113,16 @@ SOCIALACCOUNT_PROVIDERS = {
 }
 
 MIDDLEWARE = [
+    # Removes itself at startup unless REQUEST_METRICS_ENABLED is set
+    'pilolo.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     "whitenoise.middleware.WhiteNoiseMiddleware",
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Removes itself at startup unless DATABASE_REPLICAS is set
+    'pilolo.middleware.PrimaryPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
         # Add the account middleware:
@@ -170,6 +183,32 @@ USE_I18N = True
 USE_TZ = True
 
 
+# SQLite profile (settings/dev.py and small single-host deployments), applied
+# to every new connection. WAL lets readers run alongside the writer, and
+# IMMEDIATE transactions take the write lock at BEGIN, waiting up to
+# busy_timeout for it, instead of failing when a read turns into a write.
+SQLITE_OPTIONS = {
+    'init_command': (
+        'PRAGMA journal_mode=WAL;'
+        'PRAGMA synchronous=NORMAL;'
+        'PRAGMA busy_timeout=5000;'
+        'PRAGMA mmap_size=134217728;'
+        'PRAGMA cache_size=-20000;'
+    ),
+    'transaction_mode': 'IMMEDIATE',
+}
+# Further attempts, with jittered backoff, for booking writes that still find the database locked
+SQLITE_LOCK_RETRIES = 4
+
+
+# Read replicas (pilolo.routers): aliases in DATABASES that replicate `default`.
+# Read-only views read from them; users stay on the primary for
+# REPLICA_PIN_SECONDS after they write.
+DATABASE_ROUTERS = ['pilolo.routers.ReplicaRouter']
+DATABASE_REPLICAS = []
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 10))
+
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
@@ -178,6 +217,33 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# CACHE_BACKEND picks locmem (default), file or db; run `manage.py createcachetable` for db.
+
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem')
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pilolo',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CACHE_LOCATION', str(BASE_DIR / 'cache')),
+    },
+    'db': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'pilolo_cache',
+    },
+}
+CACHES = {'default': CACHE_BACKENDS[CACHE_BACKEND]}
+# How long (in seconds) catalog pages stay cached; writes invalidate them sooner
+CATALOG_CACHE_TIMEOUT = 60 * 60
+# tour_detail lists departures from today up to this many days ahead
+TOUR_DETAIL_WINDOW_DAYS = 120
+
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -193,3 +259,36 @@ EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')  # Your email address
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')  # Your email password
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER  # Default from email for sending emails
 
+# Email outbox (pilolo.outbox, drained by `manage.py send_outbox`)
+OUTBOX_MAX_ATTEMPTS = 6  # attempts before an email is moved to the dead state
+OUTBOX_BACKOFF_BASE = 60  # seconds before the first retry, doubled after each failure
+OUTBOX_MAX_BACKOFF = 60 * 60
+OUTBOX_MAX_WORKERS = 2  # workers allowed to hold leases at the same time
+OUTBOX_LEASE = 5 * 60  # seconds a worker may hold a claimed batch
+
+
+# Seat holds: how long (in seconds) seats stay reserved during the booking wizard
+SEAT_HOLD_TTL = int(os.getenv('SEAT_HOLD_TTL', 15 * 60))
+# Booking wizard drafts (pilolo.drafts): seconds a draft lives after its last change
+BOOKING_DRAFT_TTL = int(os.getenv('BOOKING_DRAFT_TTL', 2 * 60 * 60))
+# Keep live drafts in the cache; None means only when the cache is shared by all workers (not locmem)
+BOOKING_DRAFT_CACHE = None
+
+# Per-request metrics (Server-Timing header and a JSON log line per request)
+REQUEST_METRICS_ENABLED = os.getenv('REQUEST_METRICS_ENABLED', 'False') == 'True'
+# Warn when a view runs more queries than this, keyed by URL name
+REQUEST_METRICS_QUERY_BUDGETS = {
+    'home': 5,
+    'tours_list': 5,
+    'tour_detail': 6,
+    'availability_calendar': 3,
+    'my_bookings': 8,
+    'booking_details': 8,
+}
+
+# Booking references (pilolo.references): a distinct id (0-63) per process creating bookings.
+# Defaults to the low bits of the process id, which can repeat between processes.
+BOOKING_REFERENCE_WORKER_ID = os.getenv('BOOKING_REFERENCE_WORKER_ID')
+# Key for scrambling references so they do not reveal when they were issued; defaults to SECRET_KEY.
+# Changing it can make a new reference repeat an old one, which inserts retry.
+BOOKING_REFERENCE_KEY = os.getenv('BOOKING_REFERENCE_KEY')
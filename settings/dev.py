@@ -7,5 +7,18 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
-}
\ No newline at end of file
+        # File-backed so multi-process tests can share the test database
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        'OPTIONS': SQLITE_OPTIONS,
+    },
+    # A second file standing in for a read replica. Copy db.sqlite3 over it
+    # and set DB_REPLICAS=replica to try the replica router locally.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db_replica.sqlite3',
+        'TEST': {'NAME': BASE_DIR / 'test_db_replica.sqlite3'},
+        'OPTIONS': SQLITE_OPTIONS,
+    },
+}
+
+DATABASE_REPLICAS = [alias for alias in os.getenv('DB_REPLICAS', '').split(',') if alias]
@@ -1,3 +1,5 @@
+from django.core.exceptions import ImproperlyConfigured
+
 from .base import *
 
 DATABASES = {
@@ -9,4 +11,32 @@ DATABASES = {
         'HOST': os.environ.get('DB_HOST'),
         'PORT': os.environ.get('DB_PORT'),
     }
-}
\ No newline at end of file
+}
+
+# Streaming replicas of the primary, one per host in DB_REPLICA_HOSTS
+# (comma-separated), with the primary's credentials.
+for number, host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(',')), start=1):
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': host.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+
+# The catalog cache is invalidated by bumping version keys (seat counts,
+# availability ETags, the calendar); a per-process cache would only see the
+# bumps made by its own worker. Defaults to the database cache
+# (`manage.py createcachetable`); use file only on a single host.
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'db')
+if CACHE_BACKEND == 'locmem':
+    raise ImproperlyConfigured("CACHE_BACKEND=locmem is not shared between workers; use db or file in production.")
+CACHES = {'default': CACHE_BACKENDS[CACHE_BACKEND]}
+
+
+# Hashed file names plus precompressed .gz/.br copies written by collectstatic.
+# WhiteNoise serves hashed files with a one-year "immutable" Cache-Control and
+# supports Range requests (needed for the hero video).
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'},
+}